@@ -0,0 +1,161 @@
+"""
+Сборка и отдача статики мини-приложения.
+
+Сборка (python assets.py): app.js и style.css копируются в webapp/dist/ с хешем
+содержимого в имени, index.html переписывается на эти имена, для каждого файла
+создаются сжатые варианты .gz и .br (если установлен brotli), список - в manifest.json.
+Сборка пропускается, если исходники не менялись.
+
+Отдача: файлы из dist загружаются в память при первом обращении, ответ выбирает
+вариант сжатия по Accept-Encoding. Файлы с хешем в имени кэшируются клиентом
+навсегда (immutable), index.html - с ETag и проверкой If-None-Match.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+from typing import Dict, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+WEBAPP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'webapp')
+DIST_DIR = os.path.join(WEBAPP_DIR, 'dist')
+MANIFEST = 'manifest.json'
+# Файлы, получающие хеш в имени (на них ссылается index.html)
+FINGERPRINTED = ('app.js', 'style.css')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _write_variants(name: str, data: bytes):
+    """Записать файл и его сжатые варианты"""
+    path = os.path.join(DIST_DIR, name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+
+
+def build(force: bool = False) -> Dict:
+    """Собрать dist; возвращает манифест"""
+    sources = {}
+    for name in FINGERPRINTED + ('index.html',):
+        with open(os.path.join(WEBAPP_DIR, name), 'rb') as f:
+            sources[name] = f.read()
+    source_hash = _digest(b''.join(_digest(data).encode() for data in sources.values()))
+
+    manifest_path = os.path.join(DIST_DIR, MANIFEST)
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('source_hash') == source_hash and manifest.get('brotli') == (brotli is not None):
+            logger.info("Статика не изменилась, сборка пропущена")
+            return manifest
+
+    os.makedirs(DIST_DIR, exist_ok=True)
+    for old in os.listdir(DIST_DIR):
+        os.remove(os.path.join(DIST_DIR, old))
+
+    files = {}
+    for name in FINGERPRINTED:
+        base, ext = os.path.splitext(name)
+        hashed = f"{base}.{_digest(sources[name])[:12]}{ext}"
+        _write_variants(hashed, sources[name])
+        files[name] = hashed
+
+    index = sources['index.html'].decode('utf-8')
+    for name, hashed in files.items():
+        index = re.sub(r'(\b(?:href|src)=")' + re.escape(name) + '"', r'\g<1>' + hashed + '"', index)
+    index_bytes = index.encode('utf-8')
+    _write_variants('index.html', index_bytes)
+
+    manifest = {
+        'source_hash': source_hash,
+        'brotli': brotli is not None,
+        'files': files,
+    }
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    logger.info(f"Статика собрана: {', '.join(files.values())}")
+    return manifest
+
+
+class StaticAssets:
+    """Собранная статика в памяти: имя -> {кодировка: байты}"""
+
+    def __init__(self, dist_dir: str = DIST_DIR):
+        self.dist_dir = dist_dir
+        self.files: Dict[str, Dict[str, bytes]] = {}
+        self.etags: Dict[str, str] = {}
+        self._checked = False
+
+    def ensure_loaded(self):
+        """Загрузить dist при первом обращении (если сборки нет - отдается исходная статика)"""
+        if not self._checked:
+            self._checked = True
+            if not self.load():
+                logger.warning("webapp/dist не собран, статика отдается без хешей и сжатия")
+
+    def load(self) -> bool:
+        manifest_path = os.path.join(self.dist_dir, MANIFEST)
+        if not os.path.exists(manifest_path):
+            return False
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        for name in list(manifest['files'].values()) + ['index.html']:
+            variants = {}
+            for encoding, suffix in (('identity', ''), ('gzip', '.gz'), ('br', '.br')):
+                path = os.path.join(self.dist_dir, name + suffix)
+                if os.path.exists(path):
+                    with open(path, 'rb') as f:
+                        variants[encoding] = f.read()
+            self.files[name] = variants
+            self.etags[name] = _digest(variants['identity'])[:32]
+        return True
+
+    def get(self, name: str, accept_encoding: str) -> Optional[Tuple[bytes, str, str]]:
+        """
+        (тело, кодировка, ETag) для имени файла или None.
+        У каждого варианта сжатия свой сильный ETag.
+        """
+        variants = self.files.get(name)
+        if variants is None:
+            return None
+        accepted = {part.split(';')[0].strip() for part in accept_encoding.lower().split(',')}
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in variants:
+                return variants[encoding], encoding, f"{self.etags[name]}-{encoding}"
+        return variants['identity'], 'identity', self.etags[name]
+
+    @staticmethod
+    def cache_control(name: str) -> str:
+        return REVALIDATE if name == 'index.html' else IMMUTABLE
+
+    @staticmethod
+    def mimetype(name: str) -> str:
+        return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+if __name__ == '__main__':
+    import sys
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    build(force='--force' in sys.argv)
@@ -0,0 +1,3 @@
+"""
+Офлайн-бенчмарки бота и веб-сервера с локальными заглушками Кинопоиска и Telegram
+"""
@@ -0,0 +1,55 @@
+"""
+Локальная заглушка хоста постеров: GET /poster/{id} отдает JPEG 1000x1500
+(как исходные постеры Кинопоиска). Изображения генерируются Pillow и различаются по id.
+"""
+import random
+from collections import Counter
+from io import BytesIO
+from aiohttp import web
+
+
+class FakeImages:
+    """Заглушка постеров с подсчетом запросов и отданных байт"""
+
+    def __init__(self, width: int = 1000, height: int = 1500):
+        self.width = width
+        self.height = height
+        self.counts = Counter()
+        self.bytes_sent = 0
+        self._images = {}
+
+        self.app = web.Application()
+        self.app.router.add_get('/poster/{movie_id}', self.poster)
+
+    def reset(self):
+        self.counts.clear()
+        self.bytes_sent = 0
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.counts.values())
+
+    def image(self, movie_id: int) -> bytes:
+        if movie_id not in self._images:
+            from PIL import Image, ImageDraw
+            rng = random.Random(movie_id)
+            image = Image.new('RGB', (self.width, self.height), tuple(rng.randrange(256) for _ in range(3)))
+            draw = ImageDraw.Draw(image)
+            # Фигуры и шум, чтобы размер JPEG был похож на настоящий постер
+            for _ in range(60):
+                x, y = rng.randrange(self.width), rng.randrange(self.height)
+                size = rng.randrange(50, 400)
+                draw.ellipse((x, y, x + size, y + size), fill=tuple(rng.randrange(256) for _ in range(3)))
+            noise = Image.effect_noise((self.width, self.height), 40).convert('RGB')
+            image = Image.blend(image, noise, 0.25)
+            out = BytesIO()
+            image.save(out, 'JPEG', quality=90)
+            self._images[movie_id] = out.getvalue()
+        return self._images[movie_id]
+
+    async def poster(self, request: web.Request) -> web.Response:
+        movie_id = int(request.match_info['movie_id'])
+        body = self.image(movie_id)
+        self.counts['poster'] += 1
+        self.bytes_sent += len(body)
+        return web.Response(body=body, content_type='image/jpeg')
@@ -0,0 +1,153 @@
+"""
+Локальная заглушка kinopoisk.dev API: отдает записанные фикстуры
+с настраиваемой задержкой и случайными ответами 429
+"""
+import asyncio
+import copy
+import json
+import os
+import random
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List
+from aiohttp import web
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+# Жанры, добавляемые копиям фикстур, чтобы каталог покрывал все жанры меню бота
+EXTRA_GENRES = ['боевик', 'приключения', 'мультфильм', 'комедия', 'криминал', 'документальный',
+                'драма', 'семейный', 'фэнтези', 'история', 'ужасы', 'музыка', 'детектив',
+                'мелодрама', 'фантастика', 'триллер', 'военный', 'вестерн']
+
+
+def load_catalog(size: int = 2000) -> List[Dict]:
+    """Каталог из фикстур, размноженный до size записей с уникальными id"""
+    with open(os.path.join(FIXTURES_DIR, 'movies.json'), encoding='utf-8') as f:
+        base = json.load(f)['docs']
+    catalog = [copy.deepcopy(doc) for doc in base]
+    for i in range(max(0, size - len(base))):
+        doc = copy.deepcopy(base[i % len(base)])
+        doc['id'] = 1_000_000 + i
+        doc['name'] = f"{doc['name']} {i + 1}"
+        doc['rating']['kp'] = round(max(1.0, doc['rating']['kp'] - (i % 70) / 10), 3)
+        extra = EXTRA_GENRES[(i // len(base)) % len(EXTRA_GENRES)]
+        if all(g['name'] != extra for g in doc['genres']):
+            doc['genres'].append({'name': extra})
+        catalog.append(doc)
+    return catalog
+
+
+class FakeKinopoisk:
+    """Заглушка API с подсчетом обращений по эндпоинтам"""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0,
+                 rate_429: float = 0, catalog_size: int = 2000, seed: int = 0,
+                 stall_rate: float = 0, stall_ms: float = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.stall_rate = stall_rate
+        self.stall_ms = stall_ms
+        self.catalog = load_catalog(catalog_size)
+        self.by_id = {doc['id']: doc for doc in self.catalog}
+        self.counts = Counter()
+        self._random = random.Random(seed)
+
+        self.app = web.Application()
+        self.app.router.add_get('/v1.4/movie/search', self.search)
+        self.app.router.add_get('/v1.4/movie/{movie_id:\\d+}', self.movie)
+        self.app.router.add_get('/v1.4/movie', self.movies)
+
+    def reset(self):
+        self.counts.clear()
+
+    def touch(self, movie_id: int, **changes):
+        """Изменить запись каталога и ее updatedAt (для проверки инкрементальной синхронизации)"""
+        doc = self.by_id[movie_id]
+        doc.update(changes)
+        doc['updatedAt'] = datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+    @property
+    def total_calls(self) -> int:
+        return sum(count for (endpoint, status), count in self.counts.items())
+
+    async def _delay_or_429(self, endpoint: str):
+        """Имитация задержки сети и ограничения частоты запросов"""
+        delay = self.latency_ms + self._random.uniform(0, self.jitter_ms)
+        # Редкие многосекундные зависания, как у api.kinopoisk.dev
+        if self.stall_rate and self._random.random() < self.stall_rate:
+            delay += self.stall_ms
+        if delay:
+            await asyncio.sleep(delay / 1000)
+        if self.rate_429 and self._random.random() < self.rate_429:
+            self.counts[(endpoint, 429)] += 1
+            return web.json_response({'message': 'Too Many Requests'}, status=429)
+        self.counts[(endpoint, 200)] += 1
+        return None
+
+    def _filter(self, query) -> List[Dict]:
+        docs = self.catalog
+        media_type = query.get('type')
+        if media_type:
+            docs = [d for d in docs if d['type'] == media_type]
+        genre = query.get('genres.name')
+        if genre:
+            docs = [d for d in docs if any(g['name'] == genre for g in d['genres'])]
+        rating = query.get('rating.kp')
+        if rating:
+            low = float(rating.split('-')[0])
+            docs = [d for d in docs if d['rating']['kp'] >= low]
+        updated = query.get('updatedAt')
+        if updated:
+            low, high = (datetime.strptime(part, '%d.%m.%Y').date().isoformat() for part in updated.split('-'))
+            docs = [d for d in docs if low <= d['updatedAt'][:10] <= high]
+        ids = query.getall('id', [])
+        if ids:
+            wanted = {int(i) for i in ids}
+            docs = [d for d in docs if d['id'] in wanted]
+        return docs
+
+    @staticmethod
+    def _page(docs: List[Dict], query) -> Dict:
+        page = int(query.get('page', 1))
+        limit = int(query.get('limit', 10))
+        start = (page - 1) * limit
+        return {
+            'docs': docs[start:start + limit],
+            'total': len(docs),
+            'limit': limit,
+            'page': page,
+            'pages': (len(docs) + limit - 1) // limit,
+        }
+
+    async def movies(self, request: web.Request) -> web.Response:
+        error = await self._delay_or_429('get_movies')
+        if error is not None:
+            return error
+        query = request.query
+        docs = self._filter(query)
+        if 'type' not in query and 'id' not in query:
+            docs = [d for d in docs if d['type'] == 'movie']
+        if query.get('sortField') == 'updatedAt':
+            docs = sorted(docs, key=lambda d: d['updatedAt'])
+        else:
+            docs = sorted(docs, key=lambda d: d['rating']['kp'], reverse=True)
+        return web.json_response(self._page(docs, query))
+
+    async def movie(self, request: web.Request) -> web.Response:
+        error = await self._delay_or_429('get_movie_by_id')
+        if error is not None:
+            return error
+        doc = self.by_id.get(int(request.match_info['movie_id']))
+        if doc is None:
+            return web.json_response({'message': 'Not Found'}, status=404)
+        return web.json_response(doc)
+
+    async def search(self, request: web.Request) -> web.Response:
+        error = await self._delay_or_429('search_movies')
+        if error is not None:
+            return error
+        text = request.query.get('query', '').lower()
+        docs = [d for d in self.catalog
+                if text in d['name'].lower() or text in (d.get('alternativeName') or '').lower()]
+        return web.json_response(self._page(docs, request.query))
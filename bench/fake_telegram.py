@@ -0,0 +1,84 @@
+"""
+Локальная заглушка Telegram Bot API: отвечает успехом, считает вызовы методов
+и запоминает последнюю inline-клавиатуру в каждом чате
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from aiohttp import web
+
+# Начало текстов бота, сообщающих об ошибке (а не об успешном удалении и т.п.)
+ERROR_PREFIXES = ('❌ Не удалось', '❌ Ошибка', '❌ Фильм не найден')
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'BenchBot', 'username': 'bench_bot'}
+
+
+class FakeTelegram:
+    """Заглушка Bot API с подсчетом вызовов по методам"""
+
+    def __init__(self, latency_ms: float = 0):
+        self.latency_ms = latency_ms
+        self.counts = Counter()
+        self.error_replies = 0
+        # chat_id -> callback_data кнопок последнего сообщения с клавиатурой
+        self.keyboards = {}
+        # Время первого вызова каждого метода (для замера холодного старта)
+        self.first_seen = {}
+        self._message_ids = itertools.count(1)
+        self.app = web.Application(client_max_size=16 * 1024 * 1024)
+        self.app.router.add_post('/bot{token}/{method}', self.handle)
+
+    def reset(self):
+        self.counts.clear()
+        self.error_replies = 0
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.counts.values())
+
+    def base_url(self, server_url: str) -> str:
+        """Значение base_url для telegram.Bot"""
+        return f"{server_url}/bot"
+
+    def _message(self, chat_id) -> dict:
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private'},
+            'from': BOT_USER,
+            'text': '',
+        }
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.counts[method] += 1
+        self.first_seen.setdefault(method, time.time())
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        data = await request.post()
+        chat_id = data.get('chat_id') or 1
+
+        text = data.get('text') or data.get('caption') or ''
+        if text.startswith(ERROR_PREFIXES):
+            self.error_replies += 1
+        if data.get('reply_markup'):
+            markup = json.loads(data['reply_markup'])
+            self.keyboards[int(chat_id)] = [
+                button['callback_data']
+                for row in markup.get('inline_keyboard', [])
+                for button in row
+                if 'callback_data' in button
+            ]
+
+        if method == 'getMe':
+            result = BOT_USER
+        elif method == 'getUpdates':
+            await asyncio.sleep(min(float(data.get('timeout') or 0), 1.0))
+            result = []
+        elif method in ('answerCallbackQuery', 'deleteMessage', 'setMyCommands', 'deleteWebhook'):
+            result = True
+        else:
+            result = self._message(chat_id)
+        return web.json_response({'ok': True, 'result': result})
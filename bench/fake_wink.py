@@ -0,0 +1,49 @@
+"""
+Локальная заглушка поиска Wink: по названию отвечает, есть ли фильм в каталоге,
+с настраиваемой задержкой. Наличие определяется по хешу названия (стабильно между запусками).
+"""
+import asyncio
+import hashlib
+from collections import Counter
+from aiohttp import web
+
+
+class FakeWink:
+    """Заглушка GET /search?query=... с подсчетом запросов"""
+
+    def __init__(self, latency_ms: float = 0, availability: float = 0.5):
+        self.latency_ms = latency_ms
+        self.availability = availability
+        self.counts = Counter()
+        self.max_concurrent = 0
+        self._concurrent = 0
+
+        self.app = web.Application()
+        self.app.router.add_get('/search', self.search)
+
+    def reset(self):
+        self.counts.clear()
+        self.max_concurrent = 0
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.counts.values())
+
+    def available(self, name: str) -> bool:
+        digest = hashlib.sha256(name.encode('utf-8')).digest()
+        return digest[0] / 256 < self.availability
+
+    async def search(self, request: web.Request) -> web.Response:
+        self._concurrent += 1
+        self.max_concurrent = max(self.max_concurrent, self._concurrent)
+        try:
+            if self.latency_ms:
+                await asyncio.sleep(self.latency_ms / 1000)
+            name = request.query.get('query', '')
+            found = self.available(name)
+            self.counts['found' if found else 'not_found'] += 1
+            items = [{'id': int.from_bytes(hashlib.sha256(name.encode('utf-8')).digest()[:4], 'big'),
+                      'name': name}] if found else []
+            return web.json_response({'items': items})
+        finally:
+            self._concurrent -= 1
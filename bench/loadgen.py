@@ -0,0 +1,293 @@
+"""
+Нагрузочный генератор: тысячи виртуальных пользователей Telegram против локального бота.
+
+Запуск: python -m bench.loadgen [--stages 50,100,250,500,1000,2000] [--stage-seconds 10] [--output load.json]
+
+Пользователи нажимают кнопки из клавиатур, которые бот реально прислал им в чат
+(заглушка Telegram запоминает callback_data), и отправляют поисковые запросы.
+Число пользователей растет по ступеням; для каждой ступени считаются пропускная
+способность, латентность, доля ошибок и ошибки блокировки favorites.db.
+Часть пользователей (--web-share) работает через мини-приложение (Flask-маршруты
+в пуле потоков), чтобы воспроизвести конкуренцию двух процессов за SQLite.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import metrics
+from bench.run import Harness, percentile
+
+# Поведение пользователя бота: (действие, вес)
+BOT_BEHAVIOR = [
+    ('start', 0.05),
+    ('random_pick', 0.30),
+    ('genre_browse', 0.20),
+    ('search', 0.20),
+    ('favorite_toggle', 0.20),
+    ('favorites', 0.05),
+]
+
+# Поведение пользователя мини-приложения: (действие, вес)
+WEB_BEHAVIOR = [
+    ('get_movie', 0.5),
+    ('add_favorite', 0.2),
+    ('check_favorite', 0.2),
+    ('get_favorites', 0.1),
+]
+
+
+def bot_callbacks() -> Dict[str, List[str]]:
+    """callback_data главного меню и жанров, извлеченные из bot.py"""
+    import bot
+    with open(bot.__file__, encoding='utf-8') as f:
+        source = f.read()
+    static = sorted(set(re.findall(r"callback_data='([a-z_]+)'", source)))
+    return {
+        'menu': static,
+        'random_pick': [c for c in static if c.startswith(('random_', 'popular_', 'top_'))],
+        'genre_menus': [c for c in static if c.startswith('genres_')],
+        'genres': [f'genre_movie_{key}' for key, _ in bot.GENRES_DISPLAY['movie']]
+                  + [f'genre_tv_{key}' for key, _ in bot.GENRES_DISPLAY['tv']],
+    }
+
+
+class Stats:
+    """Результаты запросов, разбитые по ступеням нагрузки"""
+
+    def __init__(self):
+        self.stage = 0
+        self.latencies: Dict[int, List[float]] = {}
+        self.errors: Dict[int, int] = {}
+
+    def record(self, latency: float, failed: bool):
+        self.latencies.setdefault(self.stage, []).append(latency)
+        if failed:
+            self.errors[self.stage] = self.errors.get(self.stage, 0) + 1
+
+
+class LoadGenerator:
+    def __init__(self, args):
+        self.args = args
+        self.harness = Harness(args)
+        self.bot = self.harness.bot_module
+        self.callbacks = bot_callbacks()
+        self.search_words = sorted({doc['name'].split()[0] for doc in self.harness.kinopoisk.catalog})
+        self.catalog_ids = [doc['id'] for doc in self.harness.kinopoisk.catalog]
+        self.stats = Stats()
+        self.update_ids = itertools.count(1)
+        self.web_pool = ThreadPoolExecutor(max_workers=args.web_threads)
+        self.stop = asyncio.Event()
+
+    @staticmethod
+    def _weighted(rng: random.Random, behavior) -> str:
+        actions, weights = zip(*behavior)
+        return rng.choices(actions, weights)[0]
+
+    def _next_callback(self, rng: random.Random, user_id: int, action: str) -> str:
+        """Выбрать callback_data из последней клавиатуры пользователя"""
+        keyboard = self.harness.telegram.keyboards.get(user_id, [])
+        if action == 'genre_browse':
+            genres = [c for c in keyboard if c.startswith('genre_')]
+            return rng.choice(genres) if genres else rng.choice(self.callbacks['genre_menus'])
+        if action == 'favorite_toggle':
+            toggles = [c for c in keyboard if c.startswith(('add_fav_', 'remove_fav_'))]
+            return rng.choice(toggles) if toggles else rng.choice(self.callbacks['random_pick'])
+        if action == 'favorites':
+            return 'favorites'
+        return rng.choice(self.callbacks['random_pick'])
+
+    async def _call(self, handler, update):
+        start = time.perf_counter()
+        failed = False
+        try:
+            await asyncio.wait_for(handler(update, None), self.args.timeout)
+        except Exception:
+            failed = True
+        self.stats.record(time.perf_counter() - start, failed)
+
+    async def bot_user(self, tg_bot, user_id: int):
+        rng = random.Random(user_id)
+        h = self.harness
+        await self._call(self.bot.start, h.message_update(tg_bot, next(self.update_ids), user_id, '/start'))
+        while not self.stop.is_set():
+            await asyncio.sleep(rng.expovariate(1000 / self.args.think_ms))
+            action = self._weighted(rng, BOT_BEHAVIOR)
+            update_id = next(self.update_ids)
+            if action == 'start':
+                await self._call(self.bot.start, h.message_update(tg_bot, update_id, user_id, '/start'))
+            elif action == 'search':
+                text = rng.choice(self.search_words)
+                await self._call(self.bot.search_handler, h.message_update(tg_bot, update_id, user_id, text))
+            else:
+                data = self._next_callback(rng, user_id, action)
+                await self._call(self.bot.button_handler, h.callback_update(tg_bot, update_id, user_id, data))
+
+    def _web_request(self, rng: random.Random, user_id: int) -> bool:
+        client = self.harness.web_server.app.test_client()
+        action = self._weighted(rng, WEB_BEHAVIOR)
+        if action == 'get_movie':
+            response = client.get(f'/api/get_movie?user_id={user_id}')
+        elif action == 'add_favorite':
+            doc = rng.choice(self.harness.kinopoisk.catalog)
+            response = client.post('/api/add_favorite', json={'user_id': user_id, 'movie': doc})
+        elif action == 'check_favorite':
+            response = client.get(f'/api/check_favorite?user_id={user_id}&movie_id={rng.choice(self.catalog_ids)}')
+        else:
+            response = client.get(f'/api/get_favorites?user_id={user_id}')
+        return response.status_code >= 500
+
+    async def web_user(self, user_id: int):
+        rng = random.Random(user_id)
+        loop = asyncio.get_running_loop()
+        while not self.stop.is_set():
+            await asyncio.sleep(rng.expovariate(1000 / self.args.think_ms))
+            start = time.perf_counter()
+            try:
+                failed = await loop.run_in_executor(self.web_pool, self._web_request, rng, user_id)
+            except Exception:
+                failed = True
+            self.stats.record(time.perf_counter() - start, failed)
+
+    def _db_counters(self) -> Dict:
+        snap = metrics.snapshot()
+        locked = sum(value for key, value in snap['counters'].get('db_errors_total', {}).items()
+                     if ('kind', 'locked') in key)
+        db = snap['histograms'].get('db_query_duration_seconds', {})
+        return {
+            'locked': locked,
+            'db_calls': sum(entry['count'] for entry in db.values()),
+            'db_seconds': sum(entry['sum'] for entry in db.values()),
+        }
+
+    def _stage_report(self, index: int, vus: int, duration: float, before: Dict, upstream_before: int,
+                      replies_before: int) -> Dict:
+        latencies = self.stats.latencies.get(index, [])
+        errors = self.stats.errors.get(index, 0)
+        after = self._db_counters()
+        db_calls = after['db_calls'] - before['db_calls']
+        error_replies = self.harness.telegram.error_replies - replies_before
+        requests = len(latencies)
+        return {
+            'vus': vus,
+            'requests': requests,
+            'throughput_rps': round(requests / duration, 2) if duration else 0.0,
+            'latency_ms': {
+                'p50': round(percentile(latencies, 50) * 1000, 3),
+                'p95': round(percentile(latencies, 95) * 1000, 3),
+                'p99': round(percentile(latencies, 99) * 1000, 3),
+            },
+            'errors': errors,
+            'error_replies': error_replies,
+            'error_rate': round((errors + error_replies) / requests, 4) if requests else 0.0,
+            'upstream_calls': self.harness.kinopoisk.total_calls - upstream_before,
+            'sqlite_locked_errors': after['locked'] - before['locked'],
+            'sqlite_mean_ms': round((after['db_seconds'] - before['db_seconds']) / db_calls * 1000, 3)
+                              if db_calls else 0.0,
+        }
+
+    def find_saturation(self, stages: List[Dict]) -> Dict:
+        """Первая ступень, на которой нарушен SLO, растут ошибки или перестает расти пропускная способность"""
+        for i, stage in enumerate(stages):
+            reasons = []
+            if stage['latency_ms']['p95'] > self.args.slo_p95_ms:
+                reasons.append('p95_slo')
+            if stage['error_rate'] > self.args.max_error_rate:
+                reasons.append('error_rate')
+            if i and stage['throughput_rps'] < stages[i - 1]['throughput_rps'] * 1.05:
+                reasons.append('throughput_plateau')
+            if reasons:
+                last_good = stages[i - 1] if i else None
+                return {
+                    'saturated_at_vus': stage['vus'],
+                    'reasons': reasons,
+                    'max_healthy_vus': last_good['vus'] if last_good else 0,
+                    'max_healthy_rps': last_good['throughput_rps'] if last_good else 0.0,
+                }
+        return {'saturated_at_vus': None, 'reasons': [],
+                'max_healthy_vus': stages[-1]['vus'] if stages else 0,
+                'max_healthy_rps': stages[-1]['throughput_rps'] if stages else 0.0}
+
+    async def run(self) -> Dict:
+        tg_bot = await self.harness.make_bot()
+        tasks = []
+        stages = []
+        next_user = 100_000
+        for index, target in enumerate(self.args.stages):
+            self.stats.stage = index
+            while len(tasks) < target:
+                next_user += 1
+                if random.Random(next_user).random() < self.args.web_share:
+                    tasks.append(asyncio.create_task(self.web_user(next_user)))
+                else:
+                    tasks.append(asyncio.create_task(self.bot_user(tg_bot, next_user)))
+            before = self._db_counters()
+            upstream_before = self.harness.kinopoisk.total_calls
+            replies_before = self.harness.telegram.error_replies
+            started = time.perf_counter()
+            await asyncio.sleep(self.args.stage_seconds)
+            report = self._stage_report(index, target, time.perf_counter() - started,
+                                        before, upstream_before, replies_before)
+            stages.append(report)
+            print(json.dumps(report, ensure_ascii=False), file=sys.stderr)
+
+        self.stop.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(*list(self.bot._background_tasks), return_exceptions=True)
+        await self.bot.wink_resolver.close()
+        await tg_bot.shutdown()
+        return {'stages': stages, 'saturation': self.find_saturation(stages)}
+
+    def close(self):
+        self.web_pool.shutdown(wait=False, cancel_futures=True)
+        self.harness.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочный тест бота с виртуальными пользователями')
+    parser.add_argument('--stages', type=lambda s: [int(x) for x in s.split(',')],
+                        default=[50, 100, 250, 500, 1000, 2000], help='число пользователей по ступеням')
+    parser.add_argument('--stage-seconds', type=float, default=10)
+    parser.add_argument('--think-ms', type=float, default=1000, help='средняя пауза между действиями')
+    parser.add_argument('--timeout', type=float, default=30, help='таймаут обработчика, с')
+    parser.add_argument('--web-share', type=float, default=0.2, help='доля пользователей мини-приложения')
+    parser.add_argument('--web-threads', type=int, default=32, help='потоков Flask')
+    parser.add_argument('--slo-p95-ms', type=float, default=2000)
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--latency-ms', type=float, default=50, help='задержка заглушки Кинопоиска')
+    parser.add_argument('--jitter-ms', type=float, default=50)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--telegram-latency-ms', type=float, default=20)
+    parser.add_argument('--wink-latency-ms', type=float, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='записать JSON в файл')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    generator = LoadGenerator(args)
+    logging.disable(logging.CRITICAL)
+    try:
+        result = asyncio.run(generator.run())
+    finally:
+        generator.close()
+    result['config'] = vars(args)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,551 @@
+"""
+Офлайн-бенчмарк обработчиков бота и маршрутов веб-сервера.
+
+Запуск: python -m bench.run [--scenario NAME ...] [--output result.json] [--compare old.json]
+
+Кинопоиск и Telegram Bot API заменяются локальными заглушками, сеть не нужна.
+Результат - JSON с пропускной способностью, p50/p95/p99 и числом обращений к апстримам.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from bench.fake_images import FakeImages
+from bench.fake_kinopoisk import FakeKinopoisk
+from bench.fake_telegram import FakeTelegram
+from bench.fake_wink import FakeWink
+from bench.server import ServerThread
+
+BOT_TOKEN = '123456:bench'
+SEARCH_QUERIES = ['Побег', 'Зеленая', 'Форрест', 'Игра', 'тяжкие', 'рыцарь', 'Gump', 'Thrones']
+PICK_CALLBACKS = ['random_movie', 'random_tv', 'popular_movies', 'popular_tv', 'top_movies', 'top_tv',
+                  'genre_movie_драма', 'genre_tv_криминал']
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Перцентиль методом ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: List[float], errors: int, duration: float) -> Dict:
+    """Сводка по сценарию (латентность в миллисекундах)"""
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'duration_s': round(duration, 4),
+        'throughput_rps': round(count / duration, 2) if duration else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50) * 1000, 3),
+            'p95': round(percentile(latencies, 95) * 1000, 3),
+            'p99': round(percentile(latencies, 99) * 1000, 3),
+            'mean': round(sum(latencies) / count * 1000, 3) if count else 0.0,
+            'max': round(max(latencies) * 1000, 3) if count else 0.0,
+        },
+    }
+
+
+class Harness:
+    """Заглушки апстримов, временная база и загруженные модули приложения"""
+
+    def __init__(self, args):
+        self.args = args
+        self.kinopoisk = FakeKinopoisk(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                       rate_429=args.rate_429, seed=args.seed,
+                                       stall_rate=getattr(args, 'stall_rate', 0),
+                                       stall_ms=getattr(args, 'stall_ms', 0))
+        self.telegram = FakeTelegram(latency_ms=args.telegram_latency_ms)
+        self.wink = FakeWink(latency_ms=getattr(args, 'wink_latency_ms', 0))
+        self.images = FakeImages()
+        self.kinopoisk_server = ServerThread(self.kinopoisk.app).start()
+        self.telegram_server = ServerThread(self.telegram.app).start()
+        self.wink_server = ServerThread(self.wink.app).start()
+        self.images_server = ServerThread(self.images.app).start()
+        self.tmpdir = tempfile.TemporaryDirectory(prefix='kriegerfilm-bench-')
+
+        # Модули приложения читают адрес API при импорте
+        os.environ['KINOPOISK_BASE_URL'] = f"{self.kinopoisk_server.url}/v1.4"
+        os.environ['WINK_API_URL'] = self.wink_server.url
+        os.environ.setdefault('KINOPOISK_API_KEY', 'bench')
+        os.environ['BOT_METRICS_PORT'] = '0'
+
+        import bot
+        import database
+        import web_server
+        self.bot_module = bot
+        import kinopoisk_api
+        kinopoisk_api.hedging.enabled = getattr(args, 'hedge', False)
+        self.database = database
+        self.web_server = web_server
+        database.FAVORITES_BACKEND = getattr(args, 'favorites_backend', database.FAVORITES_BACKEND)
+        database.FAVORITES_SHARDS = getattr(args, 'favorites_shards', database.FAVORITES_SHARDS)
+        database.DB_NAME = os.path.join(self.tmpdir.name, 'favorites.db')
+        database.FAVORITES_WRITE_BEHIND = getattr(args, 'write_behind', False)
+        database.FAVORITES_JOURNAL_DIR = os.path.join(self.tmpdir.name, 'journal')
+        database.FAVORITES_JOURNAL_SYNC = getattr(args, 'journal_sync', 'always')
+        database.init_database()
+        self.rng = random.Random(args.seed)
+        self._hedges_base: Dict[str, float] = {}
+
+        import catalog
+        catalog.DB_NAME = os.path.join(self.tmpdir.name, 'catalog.db')
+        if getattr(args, 'catalog', False):
+            self.sync_catalog()
+
+    def sync_catalog(self):
+        """Заполнить локальный каталог из заглушки (обращения синхронизации не учитываются)"""
+        import catalog_sync
+        asyncio.run(catalog_sync.sync_once(budget=10_000))
+        self.reset_counters()
+
+    def close(self):
+        self.database.close_database()
+        self.kinopoisk_server.stop()
+        self.telegram_server.stop()
+        self.wink_server.stop()
+        self.images_server.stop()
+        self.tmpdir.cleanup()
+
+    def reset_counters(self):
+        self.kinopoisk.reset()
+        self.telegram.reset()
+        self.wink.reset()
+        self.images.reset()
+        self._hedges_base = self.hedge_counts()
+
+    @staticmethod
+    def hedge_counts() -> Dict[str, float]:
+        """Дублирующие запросы kinopoisk_api по результату (из метрик процесса)"""
+        import metrics
+        counts = {'won': 0, 'lost': 0, 'skipped': 0}
+        snapshot = metrics.snapshot()['counters']
+        for key, value in snapshot.get('upstream_hedges_total', {}).items():
+            counts[dict(key)['result']] += value
+        counts['skipped'] += sum(snapshot.get('upstream_hedges_skipped_total', {}).values())
+        return counts
+
+    def counters(self) -> Dict:
+        upstream = {}
+        for (endpoint, status), count in sorted(self.kinopoisk.counts.items()):
+            upstream.setdefault(endpoint, {})[str(status)] = count
+        return {
+            'upstream_calls': self.kinopoisk.total_calls,
+            'upstream_by_endpoint': upstream,
+            'telegram_calls': self.telegram.total_calls,
+            'telegram_by_method': dict(sorted(self.telegram.counts.items())),
+            'wink_calls': self.wink.total_calls,
+            'wink_max_concurrent': self.wink.max_concurrent,
+            'poster_source_calls': self.images.total_calls,
+            'poster_source_bytes': self.images.bytes_sent,
+            'hedges': {result: count - self._hedges_base.get(result, 0)
+                       for result, count in self.hedge_counts().items()},
+        }
+
+    # --- Апдейты Telegram ---
+
+    @staticmethod
+    def _user(user_id: int) -> Dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+
+    def callback_update(self, bot, update_id: int, user_id: int, data: str):
+        from telegram import Update
+        return Update.de_json({
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': self._user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': update_id,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'text': 'menu',
+                },
+            },
+        }, bot)
+
+    def message_update(self, bot, update_id: int, user_id: int, text: str):
+        from telegram import Update
+        return Update.de_json({
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': self._user(user_id),
+                'text': text,
+            },
+        }, bot)
+
+    async def make_bot(self):
+        from telegram import Bot
+        from telegram.request import HTTPXRequest
+        bot = Bot(BOT_TOKEN, base_url=self.telegram.base_url(self.telegram_server.url),
+                  request=HTTPXRequest(connection_pool_size=256))
+        await bot.initialize()
+        return bot
+
+    # --- Запуск сценариев ---
+
+    async def _run_bot(self, make_call: Callable, requests: int, concurrency: int) -> Dict:
+        bot = await self.make_bot()
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        errors = 0
+
+        async def one(i: int):
+            nonlocal errors
+            async with semaphore:
+                handler, update = make_call(bot, i)
+                start = time.perf_counter()
+                try:
+                    await handler(update, None)
+                except Exception:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        self.reset_counters()
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        duration = time.perf_counter() - started
+        # Фоновые проверки Wink не входят в латентность обработчиков, но дожидаемся их
+        await asyncio.gather(*list(self.bot_module._background_tasks), return_exceptions=True)
+        await self.bot_module.wink_resolver.close()
+        await bot.shutdown()
+        return {**summarize(latencies, errors, duration), **self.counters()}
+
+    def run_bot(self, make_call: Callable) -> Dict:
+        return asyncio.run(self._run_bot(make_call, self.args.requests, self.args.concurrency))
+
+    def run_web(self, make_path: Callable, headers: Optional[Dict] = None) -> Dict:
+        latencies = []
+        errors = 0
+        response_bytes = 0
+
+        def one(i: int):
+            client = self.web_server.app.test_client()
+            method, path, body = make_path(i)
+            start = time.perf_counter()
+            response = client.open(path, method=method, json=body, headers=headers)
+            return time.perf_counter() - start, response.status_code >= 500, len(response.get_data())
+
+        self.reset_counters()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            for elapsed, failed, size in pool.map(one, range(self.args.requests)):
+                latencies.append(elapsed)
+                errors += failed
+                response_bytes += size
+        duration = time.perf_counter() - started
+        return {**summarize(latencies, errors, duration), 'response_bytes': response_bytes, **self.counters()}
+
+    def seed_favorites(self, users: List[int], per_user: int):
+        """Наполнить избранное пользователей документами из каталога"""
+        for user_id in users:
+            for doc in self.rng.sample(self.kinopoisk.catalog, per_user):
+                self.database.add_to_favorites(user_id, doc)
+
+
+# --- Сценарии ---
+
+def scenario_random_pick_storm(h: Harness) -> Dict:
+    """Шквал нажатий «случайный/популярный/топ/жанр»"""
+    rng = random.Random(h.args.seed)
+
+    def make_call(bot, i):
+        data = rng.choice(PICK_CALLBACKS)
+        return h.bot_module.button_handler, h.callback_update(bot, i + 1, 10_000 + i % 500, data)
+    return h.run_bot(make_call)
+
+
+def scenario_search_burst(h: Harness) -> Dict:
+    """Всплеск текстовых поисковых запросов"""
+    rng = random.Random(h.args.seed)
+
+    def make_call(bot, i):
+        text = rng.choice(SEARCH_QUERIES)
+        return h.bot_module.search_handler, h.message_update(bot, i + 1, 20_000 + i % 500, text)
+    return h.run_bot(make_call)
+
+
+def scenario_search_view(h: Harness) -> Dict:
+    """Поиск со списком результатов, затем нажатие на один из них (view_*)"""
+    rng = random.Random(h.args.seed)
+    users = [25_000 + i for i in range(h.args.requests)]
+    queries = [q for q in SEARCH_QUERIES if q not in ('Побег', 'Зеленая', 'Форрест', 'Gump')]
+
+    def search_call(bot, i):
+        return h.bot_module.search_handler, h.message_update(bot, i + 1, users[i], rng.choice(queries))
+    search = h.run_bot(search_call)
+
+    def view_call(bot, i):
+        views = [c for c in h.telegram.keyboards.get(users[i], []) if c.startswith('view_')]
+        data = rng.choice(views) if views else 'view_movie_1'
+        return h.bot_module.view_handler, h.callback_update(bot, i + 1, users[i], data)
+    result = h.run_bot(view_call)
+    result['search'] = search
+    return result
+
+
+def scenario_favorites_heavy(h: Harness) -> Dict:
+    """Пользователи с большим избранным: просмотр списка и переключение избранного"""
+    rng = random.Random(h.args.seed)
+    users = list(range(30_000, 30_000 + h.args.heavy_users))
+    h.seed_favorites(users, h.args.favorites_per_user)
+    ids = [doc['id'] for doc in h.kinopoisk.catalog]
+
+    def make_call(bot, i):
+        user_id = rng.choice(users)
+        roll = rng.random()
+        if roll < 0.4:
+            data = 'favorites'
+        elif roll < 0.7:
+            data = f'add_fav_{rng.choice(ids)}'
+        else:
+            data = f'remove_fav_{rng.choice(ids)}'
+        return h.bot_module.button_handler, h.callback_update(bot, i + 1, user_id, data)
+    return h.run_bot(make_call)
+
+
+def scenario_for_you(h: Harness) -> Dict:
+    """Рекомендации «Для вас» для пользователей с избранным"""
+    users = list(range(35_000, 35_000 + h.args.heavy_users))
+    h.seed_favorites(users, h.args.favorites_per_user)
+    rng = random.Random(h.args.seed)
+
+    def make_call(bot, i):
+        return h.bot_module.button_handler, h.callback_update(bot, i + 1, rng.choice(users), 'for_you')
+    return h.run_bot(make_call)
+
+
+def scenario_web_get_movie(h: Harness) -> Dict:
+    """Мини-приложение: /api/get_movie"""
+    return h.run_web(lambda i: ('GET', f'/api/get_movie?user_id={40_000 + i % 500}', None))
+
+
+def scenario_web_popular(h: Harness) -> Dict:
+    """Мини-приложение: /api/get_popular"""
+    return h.run_web(lambda i: ('GET', '/api/get_popular?type=movie&limit=10', None))
+
+
+def scenario_web_favorites(h: Harness) -> Dict:
+    """Мини-приложение: чтение избранного и проверка фильма"""
+    users = list(range(50_000, 50_000 + h.args.heavy_users))
+    h.seed_favorites(users, h.args.favorites_per_user)
+    rng = random.Random(h.args.seed)
+
+    def make_path(i):
+        user_id = rng.choice(users)
+        if i % 2:
+            return 'GET', f'/api/get_favorites?user_id={user_id}', None
+        movie_id = rng.choice(h.kinopoisk.catalog)['id']
+        return 'GET', f'/api/check_favorite?user_id={user_id}&movie_id={movie_id}', None
+    return h.run_web(make_path)
+
+
+def scenario_web_favorites_write(h: Harness) -> Dict:
+    """Мини-приложение: добавление в избранное множеством разных пользователей"""
+    docs = h.kinopoisk.catalog
+
+    def make_path(i):
+        return 'POST', '/api/add_favorite', {'user_id': 60_000 + i, 'movie': docs[i % len(docs)]}
+    return h.run_web(make_path)
+
+
+def scenario_web_feed(h: Harness) -> Dict:
+    """
+    Мини-приложение: лента /api/feed (SSE). Каждый пользователь свайпает без пауз;
+    латентность - от свайпа до прихода замещающей карточки, card_waits - сколько раз
+    очередь карточек была пуста (пользователь увидел бы загрузку).
+    """
+    import feed
+    import posters
+    users = h.args.concurrency
+    swipes = max(1, h.args.requests // users)
+    rng = random.Random(h.args.seed)
+    ahead = feed.FEED_AHEAD
+
+    def read_event(events) -> Dict:
+        for chunk in events:
+            text = chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
+            if text.startswith(':'):
+                continue
+            name = text.split('\n', 1)[0][len('event: '):]
+            return {'event': name, **json.loads(text.split('data: ', 1)[1])}
+        return {'event': 'closed'}
+
+    def one(u: int):
+        client = h.web_server.app.test_client()
+        response = client.get(f'/api/feed?user_id={80_000 + u}', buffered=False)
+        events = iter(response.response)
+        stream = read_event(events)['stream']
+        queue = [read_event(events)['movie'] for _ in range(ahead)]
+        latencies, waits, errors = [], 0, 0
+        for _ in range(swipes):
+            movie = queue.pop(0)
+            start = time.perf_counter()
+            swipe = client.post('/api/feed/swipe', data=json.dumps({
+                'stream': stream, 'movie_id': movie['id'], 'action': rng.choice(('like', 'skip')),
+            }))
+            errors += swipe.status_code != 204
+            waits += not queue
+            event = read_event(events)
+            if event['event'] != 'card':
+                errors += 1
+                break
+            queue.append(event['movie'])
+            latencies.append(time.perf_counter() - start)
+        response.close()
+        return latencies, waits, errors
+
+    # Постеры каталога заглушки указывают на внешний хост: заранее не скачиваются
+    allowed_hosts = set(posters.ALLOWED_HOSTS)
+    posters.ALLOWED_HOSTS.clear()
+    h.reset_counters()
+    latencies, waits, errors = [], 0, 0
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=users) as pool:
+            for user_latencies, user_waits, user_errors in pool.map(one, range(users)):
+                latencies += user_latencies
+                waits += user_waits
+                errors += user_errors
+    finally:
+        posters.ALLOWED_HOSTS.update(allowed_hosts)
+    duration = time.perf_counter() - started
+    return {**summarize(latencies, errors, duration), 'card_waits': waits, **h.counters()}
+
+
+def scenario_web_posters(h: Harness) -> Dict:
+    """Мини-приложение: постеры через /api/poster (как при свайпах: часть постеров повторяется)"""
+    import posters
+    if posters.Image is None:
+        return {'skipped': 'Pillow не установлен'}
+    posters.ALLOWED_HOSTS.add('127.0.0.1')
+    posters.poster_cache = posters.PosterCache(os.path.join(h.tmpdir.name, 'posters'))
+    rng = random.Random(h.args.seed)
+    # Постеры одной ленты: карточки часто показываются повторно
+    ids = [doc['id'] for doc in h.kinopoisk.catalog[:50]]
+    url = h.images_server.url
+
+    def make_path(i):
+        src = f"{url}/poster/{rng.choice(ids)}"
+        return 'GET', f"/api/poster?src={src}&w={rng.choice((360, 720))}", None
+    result = h.run_web(make_path, headers={'Accept': 'image/webp,image/*'})
+    # Сколько весил бы каждый показ при загрузке исходного постера напрямую
+    result['direct_bytes'] = len(h.images.image(ids[0])) * h.args.requests
+    return result
+
+
+SCENARIOS = {
+    'random_pick_storm': scenario_random_pick_storm,
+    'search_burst': scenario_search_burst,
+    'search_view': scenario_search_view,
+    'favorites_heavy': scenario_favorites_heavy,
+    'for_you': scenario_for_you,
+    'web_get_movie': scenario_web_get_movie,
+    'web_popular': scenario_web_popular,
+    'web_favorites': scenario_web_favorites,
+    'web_favorites_write': scenario_web_favorites_write,
+    'web_posters': scenario_web_posters,
+    'web_feed': scenario_web_feed,
+}
+
+
+def compare(current: Dict, baseline: Dict) -> List[str]:
+    """Сравнение с предыдущим результатом (p95 и пропускная способность)"""
+    lines = []
+    for name, result in current['scenarios'].items():
+        old = baseline.get('scenarios', {}).get(name)
+        # Пропущенный сценарий ({'skipped': причина}) сравнивать не с чем
+        if not old or 'latency_ms' not in result or 'latency_ms' not in old:
+            continue
+        p95, old_p95 = result['latency_ms']['p95'], old['latency_ms']['p95']
+        rps, old_rps = result['throughput_rps'], old['throughput_rps']
+        lines.append(
+            f"{name}: p95 {old_p95:.1f} -> {p95:.1f} ms ({(p95 / old_p95 - 1) * 100 if old_p95 else 0:+.1f}%), "
+            f"rps {old_rps:.1f} -> {rps:.1f} ({(rps / old_rps - 1) * 100 if old_rps else 0:+.1f}%), "
+            f"upstream {old['upstream_calls']} -> {result['upstream_calls']}"
+        )
+    return lines
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Офлайн-бенчмарк бота и веб-сервера')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='сценарий (можно несколько; по умолчанию все)')
+    parser.add_argument('--requests', type=int, default=300, help='запросов на сценарий')
+    parser.add_argument('--concurrency', type=int, default=20, help='одновременных запросов')
+    parser.add_argument('--latency-ms', type=float, default=20, help='задержка заглушки Кинопоиска')
+    parser.add_argument('--jitter-ms', type=float, default=10, help='случайная добавка к задержке')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='доля ответов 429')
+    parser.add_argument('--stall-rate', type=float, default=0.0, help='доля запросов с зависанием Кинопоиска')
+    parser.add_argument('--stall-ms', type=float, default=2000, help='длительность зависания')
+    parser.add_argument('--hedge', action='store_true', help='дублирующие запросы к Кинопоиску (KINOPOISK_HEDGE)')
+    parser.add_argument('--telegram-latency-ms', type=float, default=5, help='задержка заглушки Telegram')
+    parser.add_argument('--wink-latency-ms', type=float, default=100, help='задержка заглушки Wink')
+    parser.add_argument('--heavy-users', type=int, default=10, help='пользователей с большим избранным')
+    parser.add_argument('--favorites-per-user', type=int, default=50, help='фильмов в их избранном')
+    parser.add_argument('--favorites-backend', choices=('sqlite', 'sharded'), default='sqlite',
+                        help='хранилище избранного')
+    parser.add_argument('--favorites-shards', type=int, default=4, help='файлов для sharded')
+    parser.add_argument('--write-behind', action='store_true', help='отложенная запись избранного через журнал')
+    parser.add_argument('--journal-sync', choices=('always', 'interval'), default='always',
+                        help='fsync журнала для --write-behind')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--catalog', action='store_true', help='синхронизировать локальный каталог перед сценариями')
+    parser.add_argument('--output', help='записать JSON в файл')
+    parser.add_argument('--compare', help='сравнить с предыдущим JSON')
+    parser.add_argument('--verbose', action='store_true', help='не подавлять логи приложения')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    harness = Harness(args)
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+    try:
+        results = {}
+        for name in args.scenario or list(SCENARIOS):
+            results[name] = SCENARIOS[name](harness)
+    finally:
+        harness.close()
+
+    report = {
+        'meta': {
+            'timestamp': int(time.time()),
+            'python': platform.python_version(),
+            'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'verbose')},
+        },
+        'scenarios': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        for line in compare(report, baseline):
+            print(line, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
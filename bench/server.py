@@ -0,0 +1,54 @@
+"""
+Запуск aiohttp-приложения в фоновом потоке со своим event loop
+"""
+import asyncio
+import socket
+import threading
+from aiohttp import web
+
+
+class ServerThread:
+    """Локальный HTTP-сервер в отдельном потоке"""
+
+    def __init__(self, app: web.Application, host: str = '127.0.0.1', port: int = 0):
+        self.app = app
+        self.host = host
+        self.port = port or _free_port(host)
+        self.loop = asyncio.new_event_loop()
+        self._runner = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._ready = threading.Event()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self._runner = web.AppRunner(self.app, access_log=None)
+        self.loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, self.port, backlog=1024, shutdown_timeout=0.5)
+        self.loop.run_until_complete(site.start())
+        self._ready.set()
+        self.loop.run_forever()
+        pending = asyncio.all_tasks(self.loop)
+        for task in pending:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        self.loop.close()
+
+    def start(self) -> 'ServerThread':
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self.loop).result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+
+def _free_port(host: str) -> int:
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
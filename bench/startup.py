@@ -0,0 +1,112 @@
+"""
+Замер холодного старта процессов из Procfile.
+
+Запуск: python -m bench.startup [--runs 5] [--output startup.json]
+
+web: время от запуска `python web_server.py` до первого ответа на GET /.
+worker: время от запуска `python bot.py` до первого getUpdates в заглушке Telegram.
+Первый запуск каждой серии идет с пустой базой (создание схемы), остальные - с готовой.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from bench.fake_telegram import FakeTelegram
+from bench.server import ServerThread
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _env(**extra) -> dict:
+    env = dict(os.environ)
+    env.update({'BOT_METRICS_PORT': '0', 'WEB_METRICS_PORT': '0', 'PYTHONDONTWRITEBYTECODE': '1'})
+    env.update(extra)
+    return env
+
+
+def measure_web(workdir: str, timeout: float) -> float:
+    port = _free_port()
+    started = time.time()
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'web_server.py')], cwd=workdir,
+                            env=_env(PORT=str(port)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.time() - started < timeout:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1) as response:
+                    if response.status == 200:
+                        return time.time() - started
+            except OSError:
+                time.sleep(0.005)
+        raise TimeoutError('web_server не ответил')
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def measure_bot(workdir: str, telegram: FakeTelegram, server: ServerThread, timeout: float) -> float:
+    telegram.first_seen.clear()
+    started = time.time()
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'bot.py')], cwd=workdir,
+                            env=_env(BOT_TOKEN='123456:startup', KINOPOISK_API_KEY='startup',
+                                     TELEGRAM_BASE_URL=telegram.base_url(server.url)),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.time() - started < timeout:
+            if 'getUpdates' in telegram.first_seen:
+                return telegram.first_seen['getUpdates'] - started
+            time.sleep(0.005)
+        raise TimeoutError('bot.py не начал опрос Telegram')
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def series(measure, runs: int) -> dict:
+    with tempfile.TemporaryDirectory(prefix='kriegerfilm-startup-') as workdir:
+        times = [measure(workdir) for _ in range(runs)]
+    return {
+        'first_run_ms': round(times[0] * 1000, 1),
+        'median_ms': round(statistics.median(times) * 1000, 1),
+        'min_ms': round(min(times) * 1000, 1),
+        'runs_ms': [round(t * 1000, 1) for t in times],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Замер холодного старта бота и веб-сервера')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--output', help='записать JSON в файл')
+    args = parser.parse_args(argv)
+
+    telegram = FakeTelegram()
+    server = ServerThread(telegram.app).start()
+    try:
+        report = {
+            'web': series(lambda d: measure_web(d, args.timeout), args.runs),
+            'worker': series(lambda d: measure_bot(d, telegram, server, args.timeout), args.runs),
+        }
+    finally:
+        server.stop()
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,27 @@
+import time
+
+_STARTED = time.perf_counter()
+
+import asyncio
 import logging
 import random
-import aiohttp
-import json
-import sys
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
-from config import BOT_TOKEN, KINOPOISK_API_KEY
+from telegram.request import HTTPXRequest
+from config import BOT_TOKEN, KINOPOISK_API_KEY, METRICS_HOST, BOT_METRICS_PORT, TELEGRAM_BASE_URL
+import metrics
+import profiling
 from kinopoisk_api import (
     get_popular_movies, get_popular_tv, get_top_movies, get_top_tv,
-    get_movies_by_genre, search_movies, format_movie_info, GENRES, get_movie_by_id
+    get_movies_by_genre, search_movies, format_movie_info, GENRES, get_movie_by_id,
+    get_movies_by_ids, add_docs_listener, GENRES_DISPLAY
 )
-from wink_api import get_wink_link, format_wink_info
+from wink_api import wink_resolver, wink_search_url
 from database import (
     init_database, add_to_favorites, remove_from_favorites,
     get_favorites, is_in_favorites, get_favorites_count
 )
+from recommend import recommender
 
 # Настройка логирования
 logging.basicConfig(
@@ -23,67 +30,86 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Monkey patch для исправления проблемы с Updater
-try:
-    from telegram.ext import Updater
-    
-    # Сохраняем оригинальный __init__
-    original_updater_init = Updater.__init__
-    
-    # Создаем новый __init__ без проблемного атрибута
-    def patched_updater_init(self, *args, **kwargs):
-        # Сначала вызываем оригинальный __init__ через object.__setattr__ чтобы избежать проблемы
-        # Но мы не можем вызвать оригинал напрямую из-за ошибки
-        # Поэтому используем обходной путь
+startup = metrics.StartupTimer('bot', _STARTED)
+
+# Все фильмы из ответов Кинопоиска попадают в пул кандидатов рекомендаций
+add_docs_listener(recommender.remember)
+
+
+def apply_updater_patch():
+    """Monkey patch для исправления проблемы с Updater (применяется при запуске, а не при импорте)"""
+    try:
+        from telegram.ext import Updater
         
-        # Создаем атрибут через object.__setattr__ до вызова оригинального __init__
-        try:
-            object.__setattr__(self, '_Updater__polling_cleanup_cb', None)
-        except AttributeError:
-            pass
+        # Сохраняем оригинальный __init__
+        original_updater_init = Updater.__init__
         
-        # Теперь вызываем оригинальный __init__
-        original_updater_init(self, *args, **kwargs)
-    
-    # Применяем патч
-    Updater.__init__ = patched_updater_init
-    logger.info("Monkey patch для Updater применен")
-except Exception as e:
-    logger.warning(f"Не удалось применить monkey patch: {e}")
-
-# Жанры для отображения в боте
-GENRES_DISPLAY = {
-    'movie': [
-        ('боевик', 'Боевик'),
-        ('приключения', 'Приключения'),
-        ('комедия', 'Комедия'),
-        ('драма', 'Драма'),
-        ('триллер', 'Триллер'),
-        ('ужасы', 'Ужасы'),
-        ('фантастика', 'Фантастика'),
-        ('фэнтези', 'Фэнтези'),
-        ('детектив', 'Детектив'),
-        ('мелодрама', 'Мелодрама'),
-        ('криминал', 'Криминал'),
-        ('мультфильм', 'Мультфильм')
-    ],
-    'tv': [
-        ('боевик', 'Боевик'),
-        ('приключения', 'Приключения'),
-        ('комедия', 'Комедия'),
-        ('драма', 'Драма'),
-        ('триллер', 'Триллер'),
-        ('ужасы', 'Ужасы'),
-        ('фантастика', 'Фантастика'),
-        ('фэнтези', 'Фэнтези'),
-        ('детектив', 'Детектив'),
-        ('мелодрама', 'Мелодрама'),
-        ('криминал', 'Криминал'),
-        ('мультфильм', 'Мультфильм')
-    ]
-}
+        # Создаем новый __init__ без проблемного атрибута
+        def patched_updater_init(self, *args, **kwargs):
+            # Сначала вызываем оригинальный __init__ через object.__setattr__ чтобы избежать проблемы
+            # Но мы не можем вызвать оригинал напрямую из-за ошибки
+            # Поэтому используем обходной путь
+            
+            # Создаем атрибут через object.__setattr__ до вызова оригинального __init__
+            try:
+                object.__setattr__(self, '_Updater__polling_cleanup_cb', None)
+            except AttributeError:
+                pass
+            
+            # Теперь вызываем оригинальный __init__
+            original_updater_init(self, *args, **kwargs)
+        
+        # Применяем патч
+        Updater.__init__ = patched_updater_init
+        logger.info("Monkey patch для Updater применен")
+    except Exception as e:
+        logger.warning(f"Не удалось применить monkey patch: {e}")
+
+
+def client_session():
+    """Новая сессия aiohttp (модуль импортируется при первом запросе, а не при запуске)"""
+    import aiohttp
+    return aiohttp.ClientSession()
+
 
+# Префиксы callback_data с параметром (id, жанр) — для меток метрик
+CALLBACK_PREFIXES = ('genre_movie_', 'genre_tv_', 'add_fav_', 'remove_fav_', 'view_')
 
+
+def callback_category(update: Update, context=None) -> dict:
+    """Категория нажатой кнопки для меток метрик"""
+    data = update.callback_query.data or ''
+    for prefix in CALLBACK_PREFIXES:
+        if data.startswith(prefix):
+            return {'category': prefix.rstrip('_')}
+    return {'category': data}
+
+
+def _callback_profile_context(update: Update, context=None) -> tuple:
+    """Метка (callback_data) и пользователь для профилировщика"""
+    return update.callback_query.data, update.effective_user.id
+
+
+def _movie_profile_context(message, movie_data, media_type='movie', callback_data=None, user_id=None) -> tuple:
+    return f"send_movie_info:{callback_data or media_type}", user_id
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest с записью времени запросов к Telegram Bot API в метрики"""
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        status = 'error'
+        start = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+            status = code
+            return code, payload
+        finally:
+            metrics.observe('telegram_request_duration_seconds', time.perf_counter() - start,
+                            method=url.rsplit('/', 1)[-1], status=status)
+
+
+@metrics.timed('bot_handler_duration_seconds', handler='start')
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     user_id = update.effective_user.id
@@ -112,6 +138,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("🎭 Сериалы по жанрам", callback_data='genres_tv')],
         [InlineKeyboardButton("🎲 Случайный фильм", callback_data='random_movie')],
         [InlineKeyboardButton("🎲 Случайный сериал", callback_data='random_tv')],
+        [InlineKeyboardButton("✨ Для вас", callback_data='for_you')],
         [InlineKeyboardButton("⭐ Избранное", callback_data='favorites')],
         [InlineKeyboardButton("🔍 Поиск", callback_data='search')]
     ]
@@ -124,8 +151,47 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+# Фоновые задачи (ссылки держатся, пока задача не завершится)
+_background_tasks = set()
+
+
+def _spawn(coro):
+    """Запустить корутину в фоне, не дожидаясь ее"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def _prime_details(movie_ids: list):
+    """Догрузить в фоне карточки фильмов из списка, чтобы нажатие view_* не ждало API"""
+    async def prime():
+        async with client_session() as session:
+            await get_movies_by_ids(session, movie_ids)
+    _spawn(prime())
+
+
+def _wink_row(wink_url: str) -> list:
+    return [InlineKeyboardButton("📺 Смотреть на Wink", url=wink_url)]
+
+
+async def _attach_wink_button(sent_message, keyboard: list, movie_name: str, year):
+    """Дождаться проверки Wink и добавить кнопку в уже отправленную карточку"""
+    wink_url = await wink_resolver.resolve(movie_name, year)
+    if not wink_url:
+        return
+    try:
+        await sent_message.edit_reply_markup(reply_markup=InlineKeyboardMarkup([_wink_row(wink_url)] + keyboard))
+    except Exception as e:
+        logger.error(f"Error attaching Wink button: {e}")
+
+
+@profiling.profiled(_movie_profile_context)
 async def send_movie_info(message, movie_data: dict, media_type: str = 'movie', callback_data: str = None, user_id: int = None):
-    """Отправить информацию о фильме/сериале"""
+    """
+    Отправить информацию о фильме/сериале.
+    Карточка отправляется сразу; если наличие на Wink еще не проверено,
+    кнопка Wink добавляется правкой сообщения после проверки.
+    """
     if not movie_data:
         await message.reply_text(
             "❌ Не удалось получить информацию о фильме. Попробуйте еще раз.",
@@ -135,14 +201,6 @@ async def send_movie_info(message, movie_data: dict, media_type: str = 'movie',
     
     text, poster_url = format_movie_info(movie_data, media_type)
     
-    # Добавляем информацию о Wink
-    movie_name = movie_data.get('name') or movie_data.get('alternativeName') or ''
-    async with aiohttp.ClientSession() as session:
-        wink_url = await get_wink_link(session, movie_name)
-        if wink_url:
-            wink_text = format_wink_info(movie_name, wink_url)
-            text += f"\n\n{wink_text}"
-    
     keyboard = []
     
     # Кнопка избранного
@@ -156,19 +214,28 @@ async def send_movie_info(message, movie_data: dict, media_type: str = 'movie',
     if callback_data:
         keyboard.append([InlineKeyboardButton("🔄 Еще", callback_data=callback_data)])
     keyboard.append([InlineKeyboardButton("🏠 Главное меню", callback_data='main_menu')])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    # Кнопка Wink: ссылка на поиск, результат из кэша или проверка в фоне
+    movie_name = movie_data.get('name') or movie_data.get('alternativeName') or ''
+    year = movie_data.get('year')
+    wink_pending = False
+    if movie_name and not wink_resolver.enabled:
+        reply_markup = InlineKeyboardMarkup([_wink_row(wink_search_url(movie_name))] + keyboard)
+    else:
+        hit, wink_url = wink_resolver.cached(movie_name, year)
+        wink_pending = bool(movie_name) and not hit
+        reply_markup = InlineKeyboardMarkup(([_wink_row(wink_url)] if wink_url else []) + keyboard)
     
     try:
         if poster_url:
-            await message.reply_photo(
+            sent = await message.reply_photo(
                 photo=poster_url,
                 caption=text,
                 reply_markup=reply_markup,
-                parse_mode='HTML',
-                disable_web_page_preview=False
+                parse_mode='HTML'
             )
         else:
-            await message.reply_text(
+            sent = await message.reply_text(
                 text,
                 reply_markup=reply_markup,
                 parse_mode='HTML',
@@ -177,48 +244,53 @@ async def send_movie_info(message, movie_data: dict, media_type: str = 'movie',
     except Exception as e:
         logger.error(f"Error sending movie info: {e}")
         # Если не удалось отправить с фото, отправляем без фото
-        await message.reply_text(
+        sent = await message.reply_text(
             text,
             reply_markup=reply_markup,
             parse_mode='HTML',
             disable_web_page_preview=False
         )
+    
+    if wink_pending:
+        _spawn(_attach_wink_button(sent, keyboard, movie_name, year))
 
 
+@metrics.timed('bot_handler_duration_seconds', labels_fn=callback_category, handler='button_handler')
+@profiling.profiled(_callback_profile_context)
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик нажатий на кнопки"""
     query = update.callback_query
     await query.answer()
     
-    async with aiohttp.ClientSession() as session:
+    async with client_session() as session:
         if query.data == 'popular_movies':
-            data = await get_popular_movies(session)
+            data = await get_popular_movies(session, docs_limit=10)
             if data and data.get('docs'):
-                movie = random.choice(data['docs'][:10])
+                movie = random.choice(data['docs'])
                 await send_movie_info(query.message, movie, 'movie', 'popular_movies', query.from_user.id)
             else:
                 await query.message.reply_text("❌ Не удалось получить фильмы. Попробуйте позже.")
         
         elif query.data == 'popular_tv':
-            data = await get_popular_tv(session)
+            data = await get_popular_tv(session, docs_limit=10)
             if data and data.get('docs'):
-                tv = random.choice(data['docs'][:10])
+                tv = random.choice(data['docs'])
                 await send_movie_info(query.message, tv, 'tv', 'popular_tv', query.from_user.id)
             else:
                 await query.message.reply_text("❌ Не удалось получить сериалы. Попробуйте позже.")
         
         elif query.data == 'top_movies':
-            data = await get_top_movies(session)
+            data = await get_top_movies(session, docs_limit=10)
             if data and data.get('docs'):
-                movie = random.choice(data['docs'][:10])
+                movie = random.choice(data['docs'])
                 await send_movie_info(query.message, movie, 'movie', 'top_movies', query.from_user.id)
             else:
                 await query.message.reply_text("❌ Не удалось получить фильмы. Попробуйте позже.")
         
         elif query.data == 'top_tv':
-            data = await get_top_tv(session)
+            data = await get_top_tv(session, docs_limit=10)
             if data and data.get('docs'):
-                tv = random.choice(data['docs'][:10])
+                tv = random.choice(data['docs'])
                 await send_movie_info(query.message, tv, 'tv', 'top_tv', query.from_user.id)
             else:
                 await query.message.reply_text("❌ Не удалось получить сериалы. Попробуйте позже.")
@@ -265,18 +337,18 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         elif query.data.startswith('genre_movie_'):
             genre_key = query.data.replace('genre_movie_', '')
-            data = await get_movies_by_genre(session, genre_key, type='movie')
+            data = await get_movies_by_genre(session, genre_key, type='movie', docs_limit=10)
             if data and data.get('docs'):
-                movie = random.choice(data['docs'][:10])
+                movie = random.choice(data['docs'])
                 await send_movie_info(query.message, movie, 'movie', query.data, query.from_user.id)
             else:
                 await query.message.reply_text("❌ Не удалось найти фильмы этого жанра. Попробуйте позже.")
         
         elif query.data.startswith('genre_tv_'):
             genre_key = query.data.replace('genre_tv_', '')
-            data = await get_movies_by_genre(session, genre_key, type='tv-series')
+            data = await get_movies_by_genre(session, genre_key, type='tv-series', docs_limit=10)
             if data and data.get('docs'):
-                tv = random.choice(data['docs'][:10])
+                tv = random.choice(data['docs'])
                 await send_movie_info(query.message, tv, 'tv', query.data, query.from_user.id)
             else:
                 await query.message.reply_text("❌ Не удалось найти сериалы этого жанра. Попробуйте позже.")
@@ -299,6 +371,21 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 await query.message.reply_text("❌ Не удалось получить сериал. Попробуйте позже.")
         
+        elif query.data == 'for_you':
+            user_id = query.from_user.id
+            movie = recommender.recommend(user_id)
+            if movie is None:
+                # Профиль пуст или пул кандидатов еще не набран: случайный популярный фильм
+                data = await get_popular_movies(session, random.randint(1, 5))
+                movie = recommender.recommend(user_id)
+                if movie is None and data and data.get('docs'):
+                    movie = random.choice(data['docs'])
+            if movie:
+                media_type = 'movie' if movie.get('type') == 'movie' else 'tv'
+                await send_movie_info(query.message, movie, media_type, 'for_you', user_id)
+            else:
+                await query.message.reply_text("❌ Не удалось подобрать фильм. Попробуйте позже.")
+        
         elif query.data == 'search':
             await query.message.reply_text(
                 "🔍 <b>Поиск фильмов и сериалов</b>\n\n"
@@ -345,15 +432,18 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     reply_markup=reply_markup,
                     parse_mode='HTML'
                 )
+                # В избранном сохранены снимки карточек: свежие данные догружаем заранее
+                _prime_details([movie.get('id') for movie in favorites[:10] if movie.get('id')])
         
         elif query.data.startswith('add_fav_'):
             movie_id = int(query.data.replace('add_fav_', ''))
             user_id = query.from_user.id
             
-            async with aiohttp.ClientSession() as session:
+            async with client_session() as session:
                 movie_data = await get_movie_by_id(session, movie_id)
                 if movie_data:
                     if add_to_favorites(user_id, movie_data):
+                        recommender.favorite_added(user_id, movie_data)
                         await query.answer("✅ Добавлено в избранное!", show_alert=False)
                         # Обновляем сообщение
                         media_type = 'movie' if movie_data.get('type') == 'movie' else 'tv'
@@ -368,9 +458,10 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             user_id = query.from_user.id
             
             if remove_from_favorites(user_id, movie_id):
+                recommender.favorite_removed(user_id, movie_id)
                 await query.answer("❌ Удалено из избранного", show_alert=False)
                 # Обновляем сообщение
-                async with aiohttp.ClientSession() as session:
+                async with client_session() as session:
                     movie_data = await get_movie_by_id(session, movie_id)
                     if movie_data:
                         media_type = 'movie' if movie_data.get('type') == 'movie' else 'tv'
@@ -400,6 +491,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 [InlineKeyboardButton("🎭 Сериалы по жанрам", callback_data='genres_tv')],
                 [InlineKeyboardButton("🎲 Случайный фильм", callback_data='random_movie')],
                 [InlineKeyboardButton("🎲 Случайный сериал", callback_data='random_tv')],
+                [InlineKeyboardButton("✨ Для вас", callback_data='for_you')],
                 [InlineKeyboardButton("⭐ Избранное", callback_data='favorites')],
                 [InlineKeyboardButton("🔍 Поиск", callback_data='search')]
             ]
@@ -411,6 +503,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
 
 
+@metrics.timed('bot_handler_duration_seconds', handler='search_handler')
 async def search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик поиска фильмов"""
     search_query = update.message.text.strip()
@@ -423,7 +516,7 @@ async def search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text("🔍 Ищу...")
     
-    async with aiohttp.ClientSession() as session:
+    async with client_session() as session:
         data = await search_movies(session, search_query, limit=5)
         
         if data and data.get('docs'):
@@ -469,12 +562,14 @@ async def search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     reply_markup=reply_markup,
                     parse_mode='HTML'
                 )
+                _prime_details([movie.get('id') for movie in movies if movie.get('id')])
         else:
             await update.message.reply_text(
                 f"❌ По запросу '{search_query}' ничего не найдено. Попробуйте другой запрос."
             )
 
 
+@metrics.timed('bot_handler_duration_seconds', labels_fn=callback_category, handler='view_handler')
 async def view_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик просмотра конкретного фильма/сериала"""
     query = update.callback_query
@@ -486,7 +581,7 @@ async def view_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         media_type = parts[1]  # movie или tv
         movie_id = int(parts[2])
         
-        async with aiohttp.ClientSession() as session:
+        async with client_session() as session:
             movie_data = await get_movie_by_id(session, movie_id)
             
             if movie_data:
@@ -495,10 +590,24 @@ async def view_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await query.message.reply_text("❌ Не удалось загрузить информацию о фильме.")
 
 
+async def _post_init(application: Application):
+    """Отчет о времени запуска перед началом опроса Telegram"""
+    startup.report('ready')
+
+
+async def _post_shutdown(application: Application):
+    """Закрыть HTTP-сессию проверки Wink"""
+    await wink_resolver.close()
+
+
 def main():
     """Главная функция для запуска бота"""
+    startup.mark('imports')
+    apply_updater_patch()
+    
     # Инициализируем базу данных
-    init_database()
+    init_database('bot')
+    startup.mark('init_database')
     
     if not BOT_TOKEN:
         logger.error("BOT_TOKEN не установлен! Создайте файл .env и добавьте BOT_TOKEN")
@@ -511,12 +620,27 @@ def main():
     
     try:
         # Создаем приложение
-        application = Application.builder().token(BOT_TOKEN).build()
+        builder = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .request(InstrumentedRequest(connection_pool_size=256))
+            .post_init(_post_init)
+            .post_shutdown(_post_shutdown)
+        )
+        if TELEGRAM_BASE_URL:
+            builder = builder.base_url(TELEGRAM_BASE_URL)
+        application = builder.build()
+        startup.mark('build_application')
+        
+        # Локальный сервер метрик
+        if BOT_METRICS_PORT:
+            metrics.start_metrics_server(BOT_METRICS_PORT, METRICS_HOST)
         
         # Регистрируем обработчики
         application.add_handler(CommandHandler("start", start))
-        application.add_handler(CallbackQueryHandler(button_handler))
+        # view_handler регистрируется первым: button_handler принимает любые callback_data
         application.add_handler(CallbackQueryHandler(view_handler, pattern='^view_'))
+        application.add_handler(CallbackQueryHandler(button_handler))
         
         # Обработчик текстовых сообщений для поиска
         from telegram.ext import MessageHandler, filters
@@ -0,0 +1,226 @@
+"""
+Локальный каталог фильмов и сериалов (catalog.db)
+
+Наполняется процессом catalog_sync.py: для каждого сочетания тип/жанр хранятся
+лучшие по рейтингу CATALOG_SYNC_DEPTH записей - именно из них бот и мини-приложение
+выбирают популярные, топовые и жанровые подборки. kinopoisk_api сначала ищет
+страницу здесь и обращается к API, только если сочетание еще не синхронизировано
+или запрошенная страница глубже сохраненной.
+"""
+import sqlite3
+import logging
+import os
+from typing import Dict, Iterable, List, Optional
+from config import CATALOG_DB, CATALOG_SYNC_DEPTH
+import json_codec
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DB_NAME = CATALOG_DB
+
+
+def combo_key(media_type: str, genre: Optional[str]) -> str:
+    """Ключ сочетания тип/жанр в таблице sync_state"""
+    return f"{media_type}:{genre or '*'}"
+
+
+def connect() -> sqlite3.Connection:
+    """Соединение для записи (процесс синхронизации)"""
+    conn = sqlite3.connect(DB_NAME)
+    # WAL: бот и веб-сервер читают каталог, пока синхронизация пишет
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+
+def _connect_readonly() -> Optional[sqlite3.Connection]:
+    if not os.path.exists(DB_NAME):
+        return None
+    return sqlite3.connect(f'file:{DB_NAME}?mode=ro', uri=True)
+
+
+def init_catalog(conn: sqlite3.Connection):
+    """Создать таблицы и индексы каталога"""
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS movies (
+            id INTEGER PRIMARY KEY,
+            type TEXT NOT NULL,
+            rating_kp REAL NOT NULL DEFAULT 0,
+            updated_at TEXT,
+            doc TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_movies_type_rating
+            ON movies (type, rating_kp DESC, id);
+
+        -- Рейтинг и тип продублированы, чтобы жанровая подборка читалась по одному индексу
+        CREATE TABLE IF NOT EXISTS movie_genres (
+            genre TEXT NOT NULL,
+            movie_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            rating_kp REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (genre, movie_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_movie_genres_rating
+            ON movie_genres (genre, type, rating_kp DESC, movie_id);
+        CREATE INDEX IF NOT EXISTS idx_movie_genres_movie
+            ON movie_genres (movie_id);
+
+        -- Состояние синхронизации сочетаний тип/жанр:
+        -- seeded - начальная загрузка завершена, min_rating - рейтинг последней сохраненной записи,
+        -- watermark - дата (ГГГГ-ММ-ДД), до которой изменения уже получены,
+        -- range_end и next_page - незавершенный проход (продолжается в следующем запуске)
+        CREATE TABLE IF NOT EXISTS sync_state (
+            combo TEXT PRIMARY KEY,
+            seeded INTEGER NOT NULL DEFAULT 0,
+            min_rating REAL NOT NULL DEFAULT 0,
+            watermark TEXT,
+            range_end TEXT,
+            next_page INTEGER NOT NULL DEFAULT 1,
+            synced_at TIMESTAMP
+        );
+    ''')
+    conn.commit()
+
+
+def upsert_movies(conn: sqlite3.Connection, docs: Iterable[Dict]) -> int:
+    """Сохранить документы фильмов одной транзакцией; возвращает число записей"""
+    count = 0
+    with conn:
+        for doc in docs:
+            movie_id = doc.get('id')
+            if not movie_id:
+                continue
+            media_type = doc.get('type') or 'movie'
+            rating = (doc.get('rating') or {}).get('kp') or 0
+            conn.execute('''
+                INSERT OR REPLACE INTO movies (id, type, rating_kp, updated_at, doc)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (movie_id, media_type, rating, doc.get('updatedAt'), json_codec.dumps(doc)))
+            conn.execute('DELETE FROM movie_genres WHERE movie_id = ?', (movie_id,))
+            conn.executemany('''
+                INSERT OR IGNORE INTO movie_genres (genre, movie_id, type, rating_kp)
+                VALUES (?, ?, ?, ?)
+            ''', [(g['name'], movie_id, media_type, rating) for g in doc.get('genres') or [] if g.get('name')])
+            count += 1
+    return count
+
+
+def get_state(conn: sqlite3.Connection, combo: str) -> Dict:
+    """Состояние синхронизации сочетания (пустое, если еще не синхронизировалось)"""
+    row = conn.execute('''
+        SELECT seeded, min_rating, watermark, range_end, next_page, synced_at
+        FROM sync_state WHERE combo = ?
+    ''', (combo,)).fetchone()
+    if row is None:
+        return {'seeded': 0, 'min_rating': 0, 'watermark': None, 'range_end': None,
+                'next_page': 1, 'synced_at': None}
+    return dict(zip(('seeded', 'min_rating', 'watermark', 'range_end', 'next_page', 'synced_at'), row))
+
+
+def combo_ids(conn: sqlite3.Connection, media_type: str, genre: Optional[str], min_rating: float) -> List[int]:
+    """id сохраненных записей сочетания с рейтингом не ниже min_rating"""
+    if genre:
+        rows = conn.execute('''
+            SELECT movie_id FROM movie_genres WHERE genre = ? AND type = ? AND rating_kp >= ?
+            ORDER BY movie_id
+        ''', (genre, media_type, min_rating))
+    else:
+        rows = conn.execute('''
+            SELECT id FROM movies WHERE type = ? AND rating_kp >= ? ORDER BY id
+        ''', (media_type, min_rating))
+    return [row[0] for row in rows]
+
+
+def save_state(conn: sqlite3.Connection, combo: str, state: Dict):
+    """Записать состояние синхронизации сочетания"""
+    with conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO sync_state
+            (combo, seeded, min_rating, watermark, range_end, next_page, synced_at)
+            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (combo, state['seeded'], state['min_rating'], state['watermark'],
+              state['range_end'], state['next_page']))
+
+
+def get_page(media_type: str, genre: Optional[str], min_rating: Optional[float],
+             page: int, limit: int, docs_limit: Optional[int] = None) -> Optional[Dict]:
+    """
+    Страница подборки в формате ответа API (docs, total, limit, page, pages)
+    или None, если каталог ее не покрывает. С docs_limit разбираются только первые документы.
+    """
+    offset = (page - 1) * limit
+    if offset + limit > CATALOG_SYNC_DEPTH:
+        return None
+    try:
+        conn = _connect_readonly()
+        if conn is None:
+            return None
+        try:
+            row = conn.execute('SELECT seeded, min_rating FROM sync_state WHERE combo = ?',
+                               (combo_key(media_type, genre),)).fetchone()
+            if not row or not row[0]:
+                metrics.record_cache('catalog', False)
+                return None
+            # Записи ниже порога синхронизации могли выпасть из лучших - их не отдаем
+            min_rating = max(min_rating or 0, row[1] or 0)
+            if genre:
+                where = 'FROM movie_genres g JOIN movies m ON m.id = g.movie_id ' \
+                        'WHERE g.genre = ? AND g.type = ? AND g.rating_kp >= ?'
+                order = 'ORDER BY g.rating_kp DESC, g.movie_id'
+                params = (genre, media_type, min_rating)
+            else:
+                where = 'FROM movies m WHERE m.type = ? AND m.rating_kp >= ?'
+                order = 'ORDER BY m.rating_kp DESC, m.id'
+                params = (media_type, min_rating)
+            rows = conn.execute(f'SELECT m.doc {where} {order} LIMIT ? OFFSET ?',
+                                params + (min(limit, docs_limit or limit), offset)).fetchall()
+            if not rows:
+                metrics.record_cache('catalog', False)
+                return None
+            total = min(conn.execute(f'SELECT COUNT(*) {where}', params).fetchone()[0], CATALOG_SYNC_DEPTH)
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка чтения каталога: {e}")
+        return None
+    metrics.record_cache('catalog', True)
+    return {
+        'docs': [json_codec.loads(row[0]) for row in rows],
+        'total': total,
+        'limit': limit,
+        'page': page,
+        'pages': (total + limit - 1) // limit,
+    }
+
+
+def get_movie(movie_id: int) -> Optional[Dict]:
+    """Документ фильма из каталога или None"""
+    try:
+        conn = _connect_readonly()
+        if conn is None:
+            return None
+        try:
+            row = conn.execute('SELECT doc FROM movies WHERE id = ?', (movie_id,)).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка чтения каталога: {e}")
+        return None
+    metrics.record_cache('catalog', row is not None)
+    return json_codec.loads(row[0]) if row else None
+
+
+def top_movies(limit: int) -> List[Dict]:
+    """Документы лучших по рейтингу фильмов и сериалов каталога (пусто, если каталога нет)"""
+    try:
+        conn = _connect_readonly()
+        if conn is None:
+            return []
+        try:
+            rows = conn.execute('SELECT doc FROM movies ORDER BY rating_kp DESC, id LIMIT ?', (limit,)).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка чтения каталога: {e}")
+        return []
+    return [json_codec.loads(row[0]) for row in rows]
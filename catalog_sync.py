@@ -0,0 +1,189 @@
+"""
+Синхронизация локального каталога (catalog.db) с Кинопоиском
+
+Запуск: python catalog_sync.py [--once]  (в Procfile - отдельный процесс catalog)
+
+Для каждого сочетания тип/жанр, которое предлагает бот, сначала загружаются лучшие
+по рейтингу CATALOG_SYNC_DEPTH записей. Дальше каждый проход запрашивает только
+записи, измененные (updatedAt) с даты последней синхронизации и не ниже рейтинга
+последней сохраненной записи, и отдельно - измененные записи из уже сохраненных без
+фильтра по рейтингу: так обновляются и те, чей рейтинг опустился ниже порога (каталог
+больше не отдает их в подборках). Проход тратит не больше CATALOG_SYNC_BUDGET запросов;
+недоделанная пагинация продолжается со следующего прохода, первыми обслуживаются
+сочетания, которые дольше всего не синхронизировались.
+"""
+import asyncio
+import logging
+import sys
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+from config import CATALOG_SYNC_DEPTH, CATALOG_SYNC_BUDGET, CATALOG_SYNC_INTERVAL_SEC
+import catalog
+from kinopoisk_api import GENRES_DISPLAY, get_movies, get_updated_movies
+
+logger = logging.getLogger(__name__)
+
+# Максимальный размер страницы kinopoisk.dev
+PAGE_LIMIT = 250
+# Подряд неудачных запросов, после которых проход прерывается (лимит API, сеть)
+MAX_FAILURES = 3
+
+# Сочетания тип/жанр, которые использует бот (топ - подмножество тех же подборок по рейтингу):
+# жанры - только из меню бота, остальные подборки пользователь запросить не может
+COMBOS: List[Tuple[str, Optional[str]]] = [
+    (media_type, genre)
+    for media_type, menu in (('movie', 'movie'), ('tv-series', 'tv'))
+    for genre in [None] + [key for key, _ in GENRES_DISPLAY[menu]]
+]
+
+
+def _api_date(day: str) -> str:
+    """ГГГГ-ММ-ДД -> дд.мм.гггг (формат фильтра updatedAt)"""
+    return date.fromisoformat(day).strftime('%d.%m.%Y')
+
+
+class SyncRun:
+    """Один проход синхронизации с ограничением числа запросов"""
+
+    def __init__(self, session, conn, budget: int = CATALOG_SYNC_BUDGET):
+        self.session = session
+        self.conn = conn
+        self.budget = budget
+        self.requests = 0
+        self.failures = 0
+        self.saved = 0
+        self.completed = 0
+
+    @property
+    def exhausted(self) -> bool:
+        return self.requests >= self.budget or self.failures >= MAX_FAILURES
+
+    async def _fetch(self, coro) -> Optional[Dict]:
+        self.requests += 1
+        data = await coro
+        if data is None:
+            self.failures += 1
+        else:
+            self.failures = 0
+        return data
+
+    async def seed(self, media_type: str, genre: Optional[str], state: Dict) -> bool:
+        """Начальная загрузка лучших записей сочетания; True - если завершена"""
+        limit = min(PAGE_LIMIT, CATALOG_SYNC_DEPTH)
+        pages = (CATALOG_SYNC_DEPTH + limit - 1) // limit
+        if state['range_end'] is None:
+            state['range_end'] = date.today().isoformat()
+        while state['next_page'] <= pages:
+            if self.exhausted:
+                return False
+            data = await self._fetch(get_movies(self.session, page=state['next_page'], limit=limit,
+                                                genre=genre, type=media_type, use_catalog=False))
+            if data is None:
+                return False
+            docs = data.get('docs') or []
+            self.saved += catalog.upsert_movies(self.conn, docs)
+            if docs:
+                state['min_rating'] = (docs[-1].get('rating') or {}).get('kp') or 0
+            if not docs or state['next_page'] >= data.get('pages', 0):
+                # Записей меньше глубины каталога - храним сочетание целиком
+                state['min_rating'] = 0
+                break
+            state['next_page'] += 1
+        state.update(seeded=1, watermark=state['range_end'], range_end=None, next_page=1)
+        return True
+
+    async def refresh(self, media_type: str, genre: Optional[str], state: Dict) -> bool:
+        """Обновление сохраненных записей, измененных с даты watermark; True - если завершено"""
+        ids = catalog.combo_ids(self.conn, media_type, genre, state['min_rating'])
+        for start in range(0, len(ids), PAGE_LIMIT):
+            if self.exhausted:
+                return False
+            batch = ids[start:start + PAGE_LIMIT]
+            data = await self._fetch(get_updated_movies(
+                self.session, _api_date(state['watermark']), _api_date(state['range_end']),
+                limit=len(batch), type=media_type, ids=batch))
+            if data is None:
+                return False
+            self.saved += catalog.upsert_movies(self.conn, data.get('docs') or [])
+        return True
+
+    async def update(self, media_type: str, genre: Optional[str], state: Dict) -> bool:
+        """Догрузка изменений с даты watermark; True - если все страницы получены"""
+        if state['range_end'] is None:
+            state['range_end'] = date.today().isoformat()
+        # Без порога по рейтингу основной запрос и так получает все изменения;
+        # прерванное обновление повторяется целиком (это несколько запросов)
+        if state['next_page'] == 1 and state['min_rating']:
+            if not await self.refresh(media_type, genre, state):
+                return False
+        while True:
+            if self.exhausted:
+                return False
+            data = await self._fetch(get_updated_movies(
+                self.session, _api_date(state['watermark']), _api_date(state['range_end']),
+                page=state['next_page'], limit=PAGE_LIMIT, genre=genre,
+                rating_kp=state['min_rating'] or None, type=media_type))
+            if data is None:
+                return False
+            docs = data.get('docs') or []
+            self.saved += catalog.upsert_movies(self.conn, docs)
+            if not docs or state['next_page'] >= data.get('pages', 0):
+                break
+            state['next_page'] += 1
+        state.update(watermark=state['range_end'], range_end=None, next_page=1)
+        return True
+
+    async def run(self):
+        states = {}
+        for media_type, genre in COMBOS:
+            key = catalog.combo_key(media_type, genre)
+            states[key] = (media_type, genre, catalog.get_state(self.conn, key))
+        # Сначала несинхронизированные, затем давно не обновлявшиеся
+        order = sorted(states, key=lambda k: (states[k][2]['synced_at'] or '', k))
+        for key in order:
+            if self.exhausted:
+                break
+            media_type, genre, state = states[key]
+            if state['seeded']:
+                done = await self.update(media_type, genre, state)
+            else:
+                done = await self.seed(media_type, genre, state)
+            catalog.save_state(self.conn, key, state)
+            self.completed += done
+        logger.info(
+            f"Синхронизация каталога: запросов {self.requests}/{self.budget}, "
+            f"сохранено записей {self.saved}, сочетаний завершено {self.completed}/{len(COMBOS)}"
+        )
+
+
+async def sync_once(budget: int = CATALOG_SYNC_BUDGET) -> SyncRun:
+    """Один проход синхронизации"""
+    import aiohttp
+    conn = catalog.connect()
+    try:
+        catalog.init_catalog(conn)
+        async with aiohttp.ClientSession() as session:
+            run = SyncRun(session, conn, budget)
+            await run.run()
+        return run
+    finally:
+        conn.close()
+
+
+async def main_loop(once: bool):
+    while True:
+        try:
+            await sync_once()
+        except Exception as e:
+            logger.error(f"Ошибка синхронизации каталога: {e}")
+        if once or CATALOG_SYNC_INTERVAL_SEC <= 0:
+            return
+        await asyncio.sleep(CATALOG_SYNC_INTERVAL_SEC)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    asyncio.run(main_loop('--once' in sys.argv))
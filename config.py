@@ -8,9 +8,117 @@ BOT_TOKEN = os.getenv('BOT_TOKEN', '')
 
 # Кинопоиск API (kinopoisk.dev)
 KINOPOISK_API_KEY = os.getenv('KINOPOISK_API_KEY', '')
-KINOPOISK_BASE_URL = 'https://api.kinopoisk.dev/v1.4'
+KINOPOISK_BASE_URL = os.getenv('KINOPOISK_BASE_URL', 'https://api.kinopoisk.dev/v1.4')
 KINOPOISK_IMAGE_BASE_URL = 'https://kinopoiskapiunofficial.tech/images/posters/kp'
 
 # Wink (для поиска фильмов)
 WINK_SEARCH_URL = 'https://wink.rt.ru'
 
+
+# Метрики (текстовый формат Prometheus)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+BOT_METRICS_PORT = int(os.getenv('BOT_METRICS_PORT', '9101'))
+# Веб-сервер отдает метрики на отдельном порту, а не маршрутом за обратным прокси
+WEB_METRICS_PORT = int(os.getenv('WEB_METRICS_PORT', '9102'))
+
+# Выборочный профилировщик (profiling.py)
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DEBUG_USERS = os.getenv('PROFILE_DEBUG_USERS', '')
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '5'))
+PROFILE_INTERVAL_SEC = float(os.getenv('PROFILE_INTERVAL_SEC', '60'))
+PROFILE_TOP_N = int(os.getenv('PROFILE_TOP_N', '5'))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '200'))
+
+# Адрес Telegram Bot API (пусто - api.telegram.org; используется для локальных заглушек)
+TELEGRAM_BASE_URL = os.getenv('TELEGRAM_BASE_URL', '')
+
+# Сжатие JSON-ответов веб-сервера: ответы меньше порога отдаются без сжатия
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+
+# Хранилище избранного (storage.py): sqlite - один файл, sharded - FAVORITES_SHARDS файлов
+# SQLite с разбиением пользователей по хешу user_id, postgres - база FAVORITES_POSTGRES_DSN
+FAVORITES_BACKEND = os.getenv('FAVORITES_BACKEND', 'sqlite')
+FAVORITES_DB = os.getenv('FAVORITES_DB', 'favorites.db')
+FAVORITES_SHARDS = int(os.getenv('FAVORITES_SHARDS', '4'))
+FAVORITES_POSTGRES_DSN = os.getenv('FAVORITES_POSTGRES_DSN', '')
+# Соединений с PostgreSQL на процесс (пользователь закреплен за одним из них)
+FAVORITES_POSTGRES_CONNECTIONS = int(os.getenv('FAVORITES_POSTGRES_CONNECTIONS', '4'))
+
+# Отложенная запись избранного (write_behind.py): изменения пишутся в журнал процесса
+# в FAVORITES_JOURNAL_DIR и раз в FAVORITES_FLUSH_MS переносятся в базу пачкой.
+# FAVORITES_JOURNAL_SYNC: always - fsync журнала до ответа (миллисекунды на изменение),
+# interval - без fsync до ответа (микросекунды), fsync при переносе в базу; при отключении
+# питания теряется не больше FAVORITES_FLUSH_MS изменений
+FAVORITES_WRITE_BEHIND = os.getenv('FAVORITES_WRITE_BEHIND', '0') == '1'
+FAVORITES_JOURNAL_DIR = os.getenv('FAVORITES_JOURNAL_DIR', 'journal')
+FAVORITES_FLUSH_MS = float(os.getenv('FAVORITES_FLUSH_MS', '200'))
+FAVORITES_JOURNAL_SYNC = os.getenv('FAVORITES_JOURNAL_SYNC', 'always')
+
+# Кэш избранного в памяти процесса (database.py)
+FAVORITES_CACHE_USERS = int(os.getenv('FAVORITES_CACHE_USERS', '10000'))
+FAVORITES_CACHE_CHECK_MS = float(os.getenv('FAVORITES_CACHE_CHECK_MS', '100'))
+
+# Рекомендации «Для вас» (recommend.py)
+RECOMMEND_POOL_SIZE = int(os.getenv('RECOMMEND_POOL_SIZE', '3000'))
+RECOMMEND_PROFILES = int(os.getenv('RECOMMEND_PROFILES', '10000'))
+RECOMMEND_TOP_K = int(os.getenv('RECOMMEND_TOP_K', '10'))
+# Как часто пул кандидатов пополняется лучшими фильмами локального каталога
+RECOMMEND_CATALOG_REFRESH_SEC = float(os.getenv('RECOMMEND_CATALOG_REFRESH_SEC', '3600'))
+
+# Локальный каталог Кинопоиска (catalog.py, синхронизация - catalog_sync.py)
+CATALOG_DB = os.getenv('CATALOG_DB', 'catalog.db')
+# Сколько лучших по рейтингу записей хранить для каждого сочетания тип/жанр
+CATALOG_SYNC_DEPTH = int(os.getenv('CATALOG_SYNC_DEPTH', '250'))
+# Максимум запросов к API за один проход синхронизации
+CATALOG_SYNC_BUDGET = int(os.getenv('CATALOG_SYNC_BUDGET', '100'))
+# Пауза между проходами (0 - один проход и выход)
+CATALOG_SYNC_INTERVAL_SEC = float(os.getenv('CATALOG_SYNC_INTERVAL_SEC', '3600'))
+
+# Проверка наличия фильмов на Wink (wink_api.py); без WINK_API_URL бот дает ссылку на поиск Wink
+WINK_API_URL = os.getenv('WINK_API_URL', '')
+WINK_CONCURRENCY = int(os.getenv('WINK_CONCURRENCY', '8'))
+WINK_POSITIVE_TTL_SEC = float(os.getenv('WINK_POSITIVE_TTL_SEC', '86400'))
+WINK_NEGATIVE_TTL_SEC = float(os.getenv('WINK_NEGATIVE_TTL_SEC', '3600'))
+WINK_TIMEOUT_SEC = float(os.getenv('WINK_TIMEOUT_SEC', '5'))
+WINK_CACHE_SIZE = int(os.getenv('WINK_CACHE_SIZE', '10000'))
+
+# Кэш карточек фильмов по id (kinopoisk_api.py)
+DETAIL_CACHE_SIZE = int(os.getenv('DETAIL_CACHE_SIZE', '5000'))
+DETAIL_CACHE_TTL_SEC = float(os.getenv('DETAIL_CACHE_TTL_SEC', '3600'))
+# id в одном запросе с фильтром по нескольким id и число одновременных запросов догрузки
+DETAIL_BATCH_SIZE = int(os.getenv('DETAIL_BATCH_SIZE', '50'))
+DETAIL_FANOUT = int(os.getenv('DETAIL_FANOUT', '4'))
+
+# Дублирующие запросы к Кинопоиск API (kinopoisk_api.py): если ответ не пришел за
+# KINOPOISK_HEDGE_PERCENTILE-й перцентиль времени ответа функции, отправляется второй такой же
+KINOPOISK_HEDGE = os.getenv('KINOPOISK_HEDGE', '0') == '1'
+KINOPOISK_HEDGE_FUNCTIONS = os.getenv('KINOPOISK_HEDGE_FUNCTIONS', 'get_movie_by_id,search_movies')
+KINOPOISK_HEDGE_PERCENTILE = float(os.getenv('KINOPOISK_HEDGE_PERCENTILE', '90'))
+# Порог, пока ответов функции меньше 20, и нижняя граница порога
+KINOPOISK_HEDGE_DEFAULT_MS = float(os.getenv('KINOPOISK_HEDGE_DEFAULT_MS', '1000'))
+KINOPOISK_HEDGE_MIN_MS = float(os.getenv('KINOPOISK_HEDGE_MIN_MS', '50'))
+# Дублей не больше этой доли обычных запросов (расход квоты растет не больше чем на нее)
+KINOPOISK_HEDGE_BUDGET = float(os.getenv('KINOPOISK_HEDGE_BUDGET', '0.05'))
+
+# Прокси постеров для мини-приложения (posters.py)
+POSTER_CACHE_DIR = os.getenv('POSTER_CACHE_DIR', 'poster_cache')
+POSTER_CACHE_MAX_MB = float(os.getenv('POSTER_CACHE_MAX_MB', '200'))
+# Ширины уменьшенных копий (px); мини-приложение выбирает нужную через srcset
+POSTER_WIDTHS = os.getenv('POSTER_WIDTHS', '240,360,480,720')
+POSTER_ALLOWED_HOSTS = os.getenv(
+    'POSTER_ALLOWED_HOSTS',
+    'image.openmoviedb.com,avatars.mds.yandex.net,st.kp.yandex.net,kinopoiskapiunofficial.tech'
+)
+POSTER_QUALITY = int(os.getenv('POSTER_QUALITY', '75'))
+POSTER_FETCH_TIMEOUT_SEC = float(os.getenv('POSTER_FETCH_TIMEOUT_SEC', '10'))
+
+# Лента карточек мини-приложения через Server-Sent Events (feed.py)
+# Карточек, отправляемых заранее (дальше - по одной на свайп)
+FEED_AHEAD = int(os.getenv('FEED_AHEAD', '3'))
+FEED_MAX_STREAMS = int(os.getenv('FEED_MAX_STREAMS', '200'))
+# Время жизни потока (после него EventSource переподключается) и интервал пинга
+FEED_MAX_SEC = float(os.getenv('FEED_MAX_SEC', '300'))
+FEED_PING_SEC = float(os.getenv('FEED_PING_SEC', '15'))
+# Насколько признаки пропущенных фильмов снижают оценку кандидатов
+FEED_SKIP_WEIGHT = float(os.getenv('FEED_SKIP_WEIGHT', '0.5'))
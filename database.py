@@ -1,154 +1,344 @@
 """
 Модуль для работы с базой данных избранных фильмов
 """
-import sqlite3
+import atexit
 import logging
-from typing import List, Dict, Optional
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Set, Iterable, Iterator, Tuple
+from config import (
+    FAVORITES_CACHE_USERS, FAVORITES_CACHE_CHECK_MS, FAVORITES_BACKEND, FAVORITES_DB,
+    FAVORITES_SHARDS, FAVORITES_POSTGRES_DSN, FAVORITES_POSTGRES_CONNECTIONS,
+    FAVORITES_WRITE_BEHIND, FAVORITES_JOURNAL_DIR, FAVORITES_FLUSH_MS, FAVORITES_JOURNAL_SYNC
+)
+import json_codec
+import metrics
+import storage
+from write_behind import WriteBehind
 
 logger = logging.getLogger(__name__)
 
-DB_NAME = 'favorites.db'
-
-
-def init_database():
-    """Инициализация базы данных"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS favorites (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            movie_id INTEGER NOT NULL,
-            movie_name TEXT NOT NULL,
-            movie_type TEXT NOT NULL,
-            movie_data TEXT,
-            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(user_id, movie_id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    logger.info("База данных инициализирована")
+# Для sqlite - файл базы, для sharded - имя, от которого образованы файлы шардов
+DB_NAME = FAVORITES_DB
 
 
+# Хранилище (storage.py) создается при первом обращении и пересоздается, если сменились DB_NAME или настройки
+_backend_lock = threading.Lock()
+_backend = None
+_backend_key: Optional[Tuple] = None
+
+# Кэш избранного: user_id -> множество movie_id (LRU по пользователям).
+# Запись и чтение из базы для пользователя идут под блокировкой его шарда,
+# изменения своего процесса записываются в кэш сразу (write-through). Если шард
+# изменил другой процесс (бот и веб-сервер), пользователи этого шарда вытесняются.
+# Порядок блокировок: shard.lock -> _cache_lock.
+_cache_lock = threading.Lock()
+_favorites_cache: "OrderedDict[int, Set[int]]" = OrderedDict()
+# Увеличивается при сбросе кэша: загруженное до сброса в кэш не попадает
+_cache_generation = 0
+
+# Отложенная запись (write_behind.py), включается в init_database при FAVORITES_WRITE_BEHIND=1
+_write_behind: Optional[WriteBehind] = None
+
+
+def _get_backend():
+    """Хранилище избранного процесса"""
+    global _backend, _backend_key
+    key = (FAVORITES_BACKEND, DB_NAME, FAVORITES_SHARDS)
+    with _backend_lock:
+        if _backend is None or _backend_key != key:
+            if _backend is not None:
+                _backend.close()
+            _backend = storage.open_backend(
+                FAVORITES_BACKEND, DB_NAME, shards=FAVORITES_SHARDS, dsn=FAVORITES_POSTGRES_DSN,
+                connections=FAVORITES_POSTGRES_CONNECTIONS, check_interval=FAVORITES_CACHE_CHECK_MS / 1000
+            )
+            _backend_key = key
+            _clear_cache()
+        return _backend
+
+
+def _clear_cache(shards: Optional[Set[int]] = None, total: int = 1):
+    """Вытеснить из кэша пользователей указанных шардов (всех, если shards не задан)"""
+    global _cache_generation
+    with _cache_lock:
+        _cache_generation += 1
+        if shards is None or len(shards) >= total:
+            _favorites_cache.clear()
+            return
+        for user_id in [u for u in _favorites_cache if storage.shard_index(u, total) in shards]:
+            del _favorites_cache[user_id]
+
+
+def _user_shard(user_id: int):
+    """Хранилище и шард, в котором хранится избранное пользователя"""
+    backend = _get_backend()
+    return backend, backend.shard(user_id)
+
+
+def _sync_shard(backend, shard):
+    """Сбросить кэш шардов, измененных другими процессами (вызывать под shard.lock)"""
+    changed = backend.external_changes(shard)
+    if changed:
+        _clear_cache(changed, len(backend.shards))
+
+
+def _cached_ids(backend, shard, user_id: int) -> Set[int]:
+    """Множество id избранного пользователя из кэша или из базы (вызывать под shard.lock)"""
+    _sync_shard(backend, shard)
+    with _cache_lock:
+        ids = _favorites_cache.get(user_id)
+        if ids is not None:
+            _favorites_cache.move_to_end(user_id)
+            metrics.record_cache('favorites', True)
+            return ids
+        generation = _cache_generation
+    metrics.record_cache('favorites', False)
+    ids = backend.load_ids(shard, user_id)
+    if _write_behind is not None:
+        # Изменения из журнала, еще не записанные в базу
+        for changes in _write_behind.overlay(user_id):
+            for movie_id, row in changes.items():
+                if row is None:
+                    ids.discard(movie_id)
+                else:
+                    ids.add(movie_id)
+    with _cache_lock:
+        if generation == _cache_generation:
+            _favorites_cache[user_id] = ids
+            if len(_favorites_cache) > FAVORITES_CACHE_USERS:
+                _favorites_cache.popitem(last=False)
+    return ids
+
+
+def _change(user_id: int, rows: Iterable[Tuple], removals: List[int]) -> Tuple[List[int], int]:
+    """
+    Добавить строки и удалить фильмы из избранного пользователя одной транзакцией
+    (или через журнал отложенной записи). Возвращает (id добавленных, число удаленных).
+    """
+    added = []
+
+    def tracked():
+        for row in rows:
+            added.append(row[1])
+            yield row
+
+    journal = _write_behind
+    backend, shard = _user_shard(user_id)
+    with shard.lock:
+        _sync_shard(backend, shard)
+        if journal is not None:
+            rows = list(tracked())
+            if any(movie_id is None for movie_id in added):
+                raise ValueError("Фильм без id")
+            ids = _cached_ids(backend, shard, user_id)
+            removed = len(ids.intersection(removals))
+            seq = journal.log(user_id, rows, removals)
+            ids.update(added)
+            ids.difference_update(removals)
+        else:
+            seq = None
+            removed = backend.apply(shard, tracked(), [(user_id, movie_id) for movie_id in removals])
+            with _cache_lock:
+                ids = _favorites_cache.get(user_id)
+            if ids is not None:
+                ids.update(added)
+                ids.difference_update(removals)
+    if seq is not None:
+        journal.wait(seq)
+    return added, removed
+
+
+def _flush_user(user_id: int):
+    """Записать в базу отложенные изменения пользователя перед чтением списка из базы"""
+    if _write_behind is not None and _write_behind.has_pending(user_id):
+        _write_behind.flush()
+
+
+def _timed(func):
+    """Записывать время выполнения функции в метрики"""
+    return metrics.timed('db_query_duration_seconds', function=func.__name__)(func)
+
+
+def _record_error(function: str, error: Exception):
+    """Учесть ошибку базы данных (отдельно считаются блокировки)"""
+    kind = 'locked' if 'locked' in str(error) else type(error).__name__
+    metrics.inc('db_errors_total', function=function, kind=kind)
+
+
+@_timed
+def init_database(process: str = 'main'):
+    """Инициализация базы данных; process - имя журнала отложенной записи (bot, web)"""
+    global _write_behind
+    if _get_backend().init():
+        logger.info("База данных инициализирована")
+    if FAVORITES_WRITE_BEHIND and _write_behind is None:
+        journal = WriteBehind(_get_backend, FAVORITES_JOURNAL_DIR, process,
+                              FAVORITES_FLUSH_MS / 1000, FAVORITES_JOURNAL_SYNC)
+        try:
+            journal.start()
+        except Exception as e:
+            logger.error(f"Отложенная запись избранного отключена: {e}")
+            return
+        _write_behind = journal
+        atexit.register(close_database)
+
+
+def close_database():
+    """Записать отложенные изменения избранного и остановить фоновую запись"""
+    global _write_behind
+    journal, _write_behind = _write_behind, None
+    if journal is not None:
+        journal.close()
+
+
+def _favorite_row(user_id: int, movie_data: Dict) -> Tuple:
+    """Строка таблицы favorites для фильма"""
+    movie_id = movie_data.get('id')
+    movie_name = movie_data.get('name') or movie_data.get('alternativeName') or 'Без названия'
+    movie_type = movie_data.get('type', 'movie')
+    movie_data_json = json_codec.dumps(movie_data)
+    return user_id, movie_id, movie_name, movie_type, movie_data_json
+
+
+@_timed
 def add_to_favorites(user_id: int, movie_data: Dict) -> bool:
     """Добавить фильм в избранное"""
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        
-        movie_id = movie_data.get('id')
-        movie_name = movie_data.get('name') or movie_data.get('alternativeName') or 'Без названия'
-        movie_type = movie_data.get('type', 'movie')
+        row = _favorite_row(user_id, movie_data)
+        movie_id = row[1]
         
-        import json
-        movie_data_json = json.dumps(movie_data, ensure_ascii=False)
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO favorites 
-            (user_id, movie_id, movie_name, movie_type, movie_data)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, movie_id, movie_name, movie_type, movie_data_json))
-        
-        conn.commit()
-        conn.close()
+        _change(user_id, [row], [])
         logger.info(f"Фильм {movie_id} добавлен в избранное пользователя {user_id}")
         return True
     except Exception as e:
+        _record_error('add_to_favorites', e)
         logger.error(f"Ошибка при добавлении в избранное: {e}")
         return False
 
 
+@_timed
 def remove_from_favorites(user_id: int, movie_id: int) -> bool:
     """Удалить фильм из избранного"""
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            DELETE FROM favorites 
-            WHERE user_id = ? AND movie_id = ?
-        ''', (user_id, movie_id))
-        
-        conn.commit()
-        conn.close()
+        _change(user_id, [], [movie_id])
         logger.info(f"Фильм {movie_id} удален из избранного пользователя {user_id}")
         return True
     except Exception as e:
+        _record_error('remove_from_favorites', e)
         logger.error(f"Ошибка при удалении из избранного: {e}")
         return False
 
 
+@_timed
 def get_favorites(user_id: int, limit: int = 50) -> List[Dict]:
     """Получить список избранных фильмов пользователя"""
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
+        _flush_user(user_id)
+        results = _get_backend().list_docs(user_id, limit)
         
-        cursor.execute('''
-            SELECT movie_data FROM favorites 
-            WHERE user_id = ? 
-            ORDER BY added_at DESC 
-            LIMIT ?
-        ''', (user_id, limit))
-        
-        results = cursor.fetchall()
-        conn.close()
-        
-        import json
         favorites = []
         for row in results:
             try:
-                movie_data = json.loads(row[0])
+                movie_data = json_codec.loads(row)
                 favorites.append(movie_data)
             except:
                 pass
         
         return favorites
     except Exception as e:
+        _record_error('get_favorites', e)
         logger.error(f"Ошибка при получении избранного: {e}")
         return []
 
 
+@_timed
 def is_in_favorites(user_id: int, movie_id: int) -> bool:
-    """Проверить, есть ли фильм в избранном"""
+    """Проверить, есть ли фильм в избранном (из кэша)"""
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT COUNT(*) FROM favorites 
-            WHERE user_id = ? AND movie_id = ?
-        ''', (user_id, movie_id))
-        
-        count = cursor.fetchone()[0]
-        conn.close()
-        
-        return count > 0
+        backend, shard = _user_shard(user_id)
+        with shard.lock:
+            return movie_id in _cached_ids(backend, shard, user_id)
     except Exception as e:
+        _record_error('is_in_favorites', e)
         logger.error(f"Ошибка при проверке избранного: {e}")
         return False
 
 
+@_timed
 def get_favorites_count(user_id: int) -> int:
-    """Получить количество избранных фильмов"""
+    """Получить количество избранных фильмов (из кэша)"""
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT COUNT(*) FROM favorites 
-            WHERE user_id = ?
-        ''', (user_id,))
-        
-        count = cursor.fetchone()[0]
-        conn.close()
-        
-        return count
+        backend, shard = _user_shard(user_id)
+        with shard.lock:
+            return len(_cached_ids(backend, shard, user_id))
     except Exception as e:
+        _record_error('get_favorites_count', e)
         logger.error(f"Ошибка при подсчете избранного: {e}")
         return 0
 
 
+@_timed
+def get_favorite_ids(user_id: int) -> Set[int]:
+    """Множество id избранного (из кэша; копия)"""
+    try:
+        backend, shard = _user_shard(user_id)
+        with shard.lock:
+            return set(_cached_ids(backend, shard, user_id))
+    except Exception as e:
+        _record_error('get_favorite_ids', e)
+        logger.error(f"Ошибка при чтении избранного: {e}")
+        return set()
+
+
+@_timed
+def check_favorites(user_id: int, movie_ids: Iterable[int]) -> Set[int]:
+    """Какие из переданных фильмов есть в избранном (одним запросом или из кэша)"""
+    try:
+        backend, shard = _user_shard(user_id)
+        with shard.lock:
+            ids = _cached_ids(backend, shard, user_id)
+            return {movie_id for movie_id in movie_ids if movie_id in ids}
+    except Exception as e:
+        _record_error('check_favorites', e)
+        logger.error(f"Ошибка при проверке избранного: {e}")
+        return set()
+
+
+@_timed
+def add_many_to_favorites(user_id: int, movies: Iterable[Dict]) -> Optional[int]:
+    """
+    Добавить несколько фильмов в избранное одной транзакцией.
+    movies может быть генератором - фильмы читаются по одному.
+    Возвращает число добавленных фильмов или None при ошибке.
+    """
+    try:
+        added, _ = _change(user_id, (_favorite_row(user_id, movie_data) for movie_data in movies), [])
+        logger.info(f"В избранное пользователя {user_id} добавлено фильмов: {len(added)}")
+        return len(added)
+    except Exception as e:
+        _record_error('add_many_to_favorites', e)
+        logger.error(f"Ошибка при добавлении в избранное: {e}")
+        return None
+
+
+@_timed
+def remove_many_from_favorites(user_id: int, movie_ids: Iterable[int]) -> Optional[int]:
+    """Удалить несколько фильмов из избранного одной транзакцией; возвращает число удаленных"""
+    try:
+        _, removed = _change(user_id, [], list(movie_ids))
+        logger.info(f"Из избранного пользователя {user_id} удалено фильмов: {removed}")
+        return removed
+    except Exception as e:
+        _record_error('remove_many_from_favorites', e)
+        logger.error(f"Ошибка при удалении из избранного: {e}")
+        return None
+
+
+def iter_favorites_json(user_id: int, batch_size: int = 500) -> Iterator[str]:
+    """
+    Все избранное пользователя построчно (JSON каждого фильма, как он хранится в базе),
+    от старых к новым. Строки читаются из базы пачками по batch_size.
+    """
+    _flush_user(user_id)
+    return _get_backend().iter_docs(user_id, batch_size)
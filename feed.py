@@ -0,0 +1,221 @@
+"""
+Лента карточек мини-приложения через Server-Sent Events (маршруты /api/feed в web_server.py)
+
+Мини-приложение открывает поток GET /api/feed?user_id=... и получает события:
+    hello - {"stream": id потока}
+    card  - {"movie": документ фильма}
+    empty - кандидатов не осталось (приложение запрашивает фильмы само)
+Сразу отправляется FEED_AHEAD карточек, затем по одной на каждый свайп, поэтому у
+приложения всегда есть следующие карточки и свайп не ждет ответа сервера.
+Свайп приходит отдельным запросом POST /api/feed/swipe (navigator.sendBeacon) с id
+потока, фильмом и направлением: like или skip. Следующие карточки выбираются по
+профилю избранного (recommend.py): like сразу учитывается в профиле, а признаки
+пропущенных фильмов до конца потока снижают оценку похожих кандидатов.
+
+Кандидаты - фильмы из страниц популярного, страницы догружаются, когда подходящие
+кандидаты кончаются. Исходный постер каждой отправленной карточки заранее скачивается
+в кэш posters.py. Поток закрывается через FEED_MAX_SEC - EventSource переподключается
+сам; раз в FEED_PING_SEC отправляется комментарий, чтобы прокси не закрывали соединение.
+"""
+import logging
+import random
+import secrets
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+from config import FEED_AHEAD, FEED_MAX_STREAMS, FEED_MAX_SEC, FEED_PING_SEC, FEED_SKIP_WEIGHT
+from recommend import RECENT_SHOWN, TasteProfile, movie_features, recommender
+import json_codec
+import metrics
+import posters
+
+logger = logging.getLogger(__name__)
+
+# Страницы популярного, из которых берутся кандидаты (как в /api/get_movie)
+POPULAR_PAGES = 10
+
+ACTIONS = ('like', 'skip')
+
+# Загрузка постеров заранее не должна занимать потоки ленты
+_poster_prefetch = ThreadPoolExecutor(max_workers=4, thread_name_prefix='poster-prefetch')
+
+
+def _event(name: str, data: Dict) -> str:
+    return f"event: {name}\ndata: {json_codec.dumps(data)}\n\n"
+
+
+def _prefetch_poster(movie: Dict):
+    poster = movie.get('poster') or {}
+    src = poster.get('url') or poster.get('previewUrl')
+    if src and posters.allowed(src):
+        _poster_prefetch.submit(posters.poster_cache.prefetch, src)
+
+
+class FeedStream:
+    """Один поток ленты: отправленные карточки, свайпы и выбор следующих карточек"""
+
+    def __init__(self, stream_id: str, user_id: int, fetch_page: Callable[[int], List[Dict]],
+                 ahead: int = FEED_AHEAD, rng: random.Random = random):
+        self.id = stream_id
+        self.user_id = user_id
+        self.fetch_page = fetch_page
+        self.rng = rng
+        self.skipped = TasteProfile()
+        # Отправленные карточки, на которые еще не пришел свайп
+        self.pending: Dict[int, Dict] = {}
+        self.sent: Set[int] = set()
+        self.pages = list(range(1, POPULAR_PAGES + 1))
+        rng.shuffle(self.pages)
+        self.closed = False
+        self._cond = threading.Condition()
+        self._credit = ahead
+        self._reports: deque = deque()
+
+    def report(self, movie_id: int, action: str) -> bool:
+        """Свайп карточки этого потока; False - карточка не из потока или неизвестное действие"""
+        if action not in ACTIONS:
+            return False
+        with self._cond:
+            movie = self.pending.pop(movie_id, None)
+            if movie is None:
+                return False
+            self._reports.append((movie, action))
+            self._credit += 1
+            self._cond.notify()
+        metrics.inc('feed_swipes_total', action=action)
+        return True
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+    def _wait(self, deadline: float) -> Tuple[Optional[List[Tuple[Dict, str]]], int]:
+        """Дождаться свайпов (не дольше FEED_PING_SEC); (None, 0) - поток пора закрыть"""
+        with self._cond:
+            timeout = min(FEED_PING_SEC, deadline - time.monotonic())
+            if not (self._reports or self._credit or self.closed) and timeout > 0:
+                self._cond.wait(timeout)
+            if self.closed or time.monotonic() >= deadline:
+                return None, 0
+            reports = list(self._reports)
+            self._reports.clear()
+            wanted, self._credit = self._credit, 0
+            return reports, wanted
+
+    def _apply(self, movie: Dict, action: str):
+        if action == 'like':
+            # Избранное приложение добавляет своим запросом; профиль учитывает фильм сразу
+            recommender.favorite_added(self.user_id, movie)
+        else:
+            self.skipped.add(movie['id'], movie_features(movie))
+
+    def _pick(self) -> Tuple[Optional[Dict], bool]:
+        """Следующая карточка и нужно ли догрузить кандидатов"""
+        # Запросы к базе и каталогу - до блокировки общего пула
+        docs = recommender.catalog_candidates()
+        if docs:
+            recommender.remember(docs)
+        profile = recommender.profile(self.user_id)
+        with recommender.lock:
+            return self._choose(profile)
+
+    def _choose(self, profile: TasteProfile) -> Tuple[Optional[Dict], bool]:
+        """Выбор карточки из пула (вызывать под recommender.lock)"""
+        shown = recommender.shown.setdefault(self.user_id, deque(maxlen=RECENT_SHOWN))
+        exclude = set(profile.items) | set(shown) | self.sent
+        combined = TasteProfile()
+        combined.vector = dict(profile.vector)
+        for name, w in self.skipped.vector.items():
+            combined.vector[name] = combined.vector.get(name, 0.0) - FEED_SKIP_WEIGHT * w
+        scores = recommender.scores(combined, exclude)
+        liked = [movie_id for movie_id, score in scores.items() if score > 0]
+        if liked:
+            top = sorted(liked, key=scores.get, reverse=True)[:recommender.top_k]
+            movie_id = self.rng.choices(top, weights=[scores[m] for m in top])[0]
+            source, left = 'profile', len(liked)
+        else:
+            # Профиля нет (или все похожее уже показано): случайный из наименее похожих на пропущенные
+            rest = [m for m in recommender.docs if m not in exclude]
+            if not rest:
+                return None, True
+            best = max(scores.get(m, 0.0) for m in rest)
+            movie_id = self.rng.choice([m for m in rest if scores.get(m, 0.0) >= best - 1e-9])
+            source, left = 'fallback', len(rest)
+        shown.append(movie_id)
+        metrics.inc('feed_cards_total', source=source)
+        return recommender.docs[movie_id], left <= recommender.top_k
+
+    def _next_card(self) -> Optional[Dict]:
+        while True:
+            movie, refill = self._pick()
+            if refill and self.pages:
+                recommender.remember(self.fetch_page(self.pages.pop()))
+                if movie is None:
+                    continue
+            if movie is not None:
+                with self._cond:
+                    self.pending[movie['id']] = movie
+                self.sent.add(movie['id'])
+                _prefetch_poster(movie)
+            return movie
+
+    def events(self) -> Iterator[str]:
+        """Поток событий SSE"""
+        deadline = time.monotonic() + FEED_MAX_SEC
+        yield 'retry: 1000\n' + _event('hello', {'stream': self.id})
+        while True:
+            reports, wanted = self._wait(deadline)
+            if reports is None:
+                return
+            for movie, action in reports:
+                self._apply(movie, action)
+            if not wanted:
+                yield ': ping\n\n'
+                continue
+            for _ in range(wanted):
+                movie = self._next_card()
+                if movie is None:
+                    yield _event('empty', {})
+                    break
+                yield _event('card', {'movie': movie})
+
+
+class FeedStreams:
+    """Открытые потоки ленты процесса"""
+
+    def __init__(self, max_streams: int = FEED_MAX_STREAMS):
+        self.max_streams = max_streams
+        self._lock = threading.Lock()
+        self._streams: Dict[str, FeedStream] = {}
+
+    def open(self, user_id: int, fetch_page: Callable[[int], List[Dict]]) -> Optional[FeedStream]:
+        """Новый поток; None - открыто максимум потоков"""
+        with self._lock:
+            if len(self._streams) >= self.max_streams:
+                return None
+            stream = FeedStream(secrets.token_urlsafe(16), user_id, fetch_page)
+            self._streams[stream.id] = stream
+            metrics.set_gauge('feed_streams', len(self._streams))
+        return stream
+
+    def get(self, stream_id: str) -> Optional[FeedStream]:
+        with self._lock:
+            return self._streams.get(stream_id)
+
+    def events(self, stream: FeedStream) -> Iterator[str]:
+        """События потока; поток удаляется, когда клиент отключился или истек FEED_MAX_SEC"""
+        try:
+            yield from stream.events()
+        except Exception as e:
+            logger.error(f"Ошибка ленты {stream.id}: {e}")
+        finally:
+            stream.close()
+            with self._lock:
+                self._streams.pop(stream.id, None)
+                metrics.set_gauge('feed_streams', len(self._streams))
+
+
+streams = FeedStreams()
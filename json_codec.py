@@ -0,0 +1,111 @@
+"""
+JSON для всего приложения: orjson, если установлен, иначе стандартный json
+
+Через этот модуль разбираются ответы Кинопоиск API, сериализуются документы
+фильмов в базах (избранное, каталог, журнал) и ответы веб-сервера.
+Результат dumps - компактный JSON без экранирования не-ASCII символов.
+"""
+import json
+import re
+from typing import Any, Callable, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_decoder = json.JSONDecoder()
+_DOCS_START = re.compile(r'\s*\{\s*"docs"\s*:\s*\[\s*')
+_SEPARATOR = re.compile(r'\s*([,\]])\s*')
+# Строки JSON и скобки: для поиска конца массива без разбора документов
+_BRACKETS = re.compile(r'"(?:[^"\\]|\\.)*"|[\[\]{}]')
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def dumpb(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """JSON в UTF-8"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS)
+    return dumps(obj, default).encode('utf-8')
+
+
+def dumps(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> str:
+    """JSON строкой"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=default)
+
+
+def loads(data: Union[str, bytes, bytearray]) -> Any:
+    """Разобрать JSON (ошибки - ValueError)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def loads_docs(raw: bytes, limit: int) -> Any:
+    """
+    Разобрать ответ API со списком docs, оставив в нем не больше limit первых документов.
+
+    Со стандартным json документы после limit не разбираются: из остатка ответа читаются
+    только поля после массива (total, pages...). orjson разбирает ответ целиком - даже
+    так это быстрее, чем разбор первой половины страницы стандартным json.
+    """
+    if orjson is not None:
+        return _truncated(orjson.loads(raw), limit)
+    text = raw.decode('utf-8')
+    match = _DOCS_START.match(text)
+    if match is None:
+        return _truncated(json.loads(text), limit)
+    pos = match.end()
+    docs = []
+    closed = text.startswith(']', pos)
+    if closed:
+        pos += 1
+    while not closed and len(docs) < limit:
+        doc, pos = _decoder.raw_decode(text, pos)
+        docs.append(doc)
+        separator = _SEPARATOR.match(text, pos)
+        if separator is None:
+            raise ValueError(f"Некорректный массив docs в позиции {pos}")
+        pos = separator.end()
+        closed = separator.group(1) == ']'
+    # Конец массива docs: дальше в ответе только числовые поля
+    end = pos - 1 if closed else _array_end(text, pos)
+    if end is None:
+        return _truncated(json.loads(text), limit)
+    tail = text[end + 1:].strip()
+    try:
+        if tail == '}':
+            rest = {}
+        elif tail.startswith(','):
+            rest = json.loads('{' + tail[1:])
+        else:
+            rest = None
+    except ValueError:
+        rest = None
+    if not isinstance(rest, dict) or any(isinstance(v, (dict, list)) for v in rest.values()):
+        return _truncated(json.loads(text), limit)
+    return {'docs': docs, **rest}
+
+
+def _array_end(text: str, pos: int) -> Optional[int]:
+    """Позиция ']', закрывающей массив, внутри которого находится pos; None - не найдена"""
+    depth = 1
+    for match in _BRACKETS.finditer(text, pos):
+        token = match.group()
+        if token in '[{':
+            depth += 1
+        elif token in ']}':
+            depth -= 1
+            if depth == 0:
+                return match.start()
+    return None
+
+
+def _truncated(data: Any, limit: int) -> Any:
+    if isinstance(data, dict) and isinstance(data.get('docs'), list):
+        del data['docs'][limit:]
+    return data
@@ -1,10 +1,26 @@
 """
 Модуль для работы с Кинопоиск API (kinopoisk.dev)
 """
+from __future__ import annotations
+
+import asyncio
 import logging
-import aiohttp
-from typing import Optional, Dict, List
-from config import KINOPOISK_API_KEY, KINOPOISK_BASE_URL
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Optional, Dict, List, Callable, Iterable, TYPE_CHECKING
+from config import (
+    KINOPOISK_API_KEY, KINOPOISK_BASE_URL, DETAIL_CACHE_SIZE, DETAIL_CACHE_TTL_SEC,
+    DETAIL_BATCH_SIZE, DETAIL_FANOUT, KINOPOISK_HEDGE, KINOPOISK_HEDGE_FUNCTIONS, KINOPOISK_HEDGE_PERCENTILE,
+    KINOPOISK_HEDGE_DEFAULT_MS, KINOPOISK_HEDGE_MIN_MS, KINOPOISK_HEDGE_BUDGET
+)
+import catalog
+import json_codec
+import metrics
+
+if TYPE_CHECKING:
+    # aiohttp нужен только для аннотаций: модуль не должен замедлять запуск процесса
+    import aiohttp
 
 logger = logging.getLogger(__name__)
 
@@ -32,39 +48,336 @@ GENRES = {
     }
 }
 
+# Жанры, которые бот предлагает в меню (их же синхронизирует catalog_sync.py)
+GENRES_DISPLAY = {
+    'movie': [
+        ('боевик', 'Боевик'),
+        ('приключения', 'Приключения'),
+        ('комедия', 'Комедия'),
+        ('драма', 'Драма'),
+        ('триллер', 'Триллер'),
+        ('ужасы', 'Ужасы'),
+        ('фантастика', 'Фантастика'),
+        ('фэнтези', 'Фэнтези'),
+        ('детектив', 'Детектив'),
+        ('мелодрама', 'Мелодрама'),
+        ('криминал', 'Криминал'),
+        ('мультфильм', 'Мультфильм')
+    ],
+    'tv': [
+        ('боевик', 'Боевик'),
+        ('приключения', 'Приключения'),
+        ('комедия', 'Комедия'),
+        ('драма', 'Драма'),
+        ('триллер', 'Триллер'),
+        ('ужасы', 'Ужасы'),
+        ('фантастика', 'Фантастика'),
+        ('фэнтези', 'Фэнтези'),
+        ('детектив', 'Детектив'),
+        ('мелодрама', 'Мелодрама'),
+        ('криминал', 'Криминал'),
+        ('мультфильм', 'Мультфильм')
+    ]
+}
 
-async def get_movie_by_id(session: aiohttp.ClientSession, movie_id: int) -> Optional[Dict]:
-    """Получить информацию о фильме по ID"""
-    url = f"{KINOPOISK_BASE_URL}/movie/{movie_id}"
+
+# Подписчики на документы фильмов из ответов API (пул рекомендаций и т.п.)
+_docs_listeners: List[Callable[[List[Dict]], None]] = []
+
+
+def add_docs_listener(listener: Callable[[List[Dict]], None]):
+    """Передавать listener документы фильмов из каждого успешного ответа API"""
+    _docs_listeners.append(listener)
+
+
+def _notify_docs(data):
+    if not _docs_listeners or not isinstance(data, dict):
+        return
+    docs = data.get('docs') if 'docs' in data else [data]
+    docs = [doc for doc in docs or [] if isinstance(doc, dict) and doc.get('id')]
+    if not docs:
+        return
+    for listener in _docs_listeners:
+        try:
+            listener(docs)
+        except Exception as e:
+            logger.error(f"Error in docs listener: {e}")
+
+
+# Кэш карточек фильмов: movie_id -> (истекает, документ)
+_details: "OrderedDict[int, tuple]" = OrderedDict()
+# Веб-сервер обращается к кэшу из нескольких потоков
+_details_lock = threading.Lock()
+
+
+def _cached_detail(movie_id: int) -> Optional[Dict]:
+    with _details_lock:
+        entry = _details.get(movie_id)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        _details.move_to_end(movie_id)
+        return entry[1]
+
+
+def _store_detail(doc: Dict):
+    with _details_lock:
+        _details[doc['id']] = (time.monotonic() + DETAIL_CACHE_TTL_SEC, doc)
+        _details.move_to_end(doc['id'])
+        if len(_details) > DETAIL_CACHE_SIZE:
+            _details.popitem(last=False)
+
+
+class Hedging:
+    """
+    Дублирующие запросы: порог ожидания по функциям и бюджет дублей.
+
+    Порог - перцентиль времени последних WINDOW успешных ответов функции (пересчитывается
+    каждые RECALC ответов). Бюджет - корзина токенов: каждый обычный запрос добавляет
+    budget токена (не больше BURST), дубль тратит один, поэтому дублей не больше доли
+    budget от всех запросов. Состояние общее для потоков веб-сервера.
+    """
+
+    WINDOW = 200
+    MIN_SAMPLES = 20
+    RECALC = 10
+    BURST = 10.0
+
+    def __init__(self, enabled: bool = KINOPOISK_HEDGE, functions: str = KINOPOISK_HEDGE_FUNCTIONS,
+                 percentile: float = KINOPOISK_HEDGE_PERCENTILE, default_ms: float = KINOPOISK_HEDGE_DEFAULT_MS,
+                 min_ms: float = KINOPOISK_HEDGE_MIN_MS, budget: float = KINOPOISK_HEDGE_BUDGET):
+        self.enabled = enabled
+        self.functions = {name.strip() for name in functions.split(',') if name.strip()}
+        self.percentile = percentile
+        self.default_delay = default_ms / 1000
+        self.min_delay = min_ms / 1000
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {}
+        self._fresh: Dict[str, int] = {}
+        self._delays: Dict[str, float] = {}
+        self._tokens = self.BURST
+
+    def applies(self, function: str) -> bool:
+        return self.enabled and function in self.functions
+
+    def record(self, function: str, seconds: float):
+        """Учесть время успешного ответа"""
+        with self._lock:
+            samples = self._samples.setdefault(function, deque(maxlen=self.WINDOW))
+            samples.append(seconds)
+            self._fresh[function] = self._fresh.get(function, 0) + 1
+            if len(samples) < self.MIN_SAMPLES or self._fresh[function] < self.RECALC:
+                return
+            self._fresh[function] = 0
+            ordered = sorted(samples)
+            index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+            self._delays[function] = max(self.min_delay, ordered[index])
+        metrics.set_gauge('upstream_hedge_delay_seconds', self._delays[function], function=function)
+
+    def delay(self, function: str) -> float:
+        """Сколько ждать ответа перед отправкой дубля"""
+        return self._delays.get(function, self.default_delay)
+
+    def earn(self):
+        with self._lock:
+            self._tokens = min(self.BURST, self._tokens + self.budget)
+
+    def spend(self) -> bool:
+        """Взять токен на дубль; False - бюджет исчерпан"""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+hedging = Hedging()
+
+
+async def _get_json(session: aiohttp.ClientSession,
+                    function: str,
+                    what: str,
+                    url: str,
+                    params: Optional[Dict] = None,
+                    docs_limit: Optional[int] = None) -> Optional[Dict]:
+    """
+    Выполнить GET-запрос к API и записать время и статус ответа в метрики.
+    docs_limit - сколько первых документов из docs нужно вызывающему (остальные не разбираются).
+    Для функций из KINOPOISK_HEDGE_FUNCTIONS (при KINOPOISK_HEDGE=1) запрос, не получивший
+    ответа за порог hedging, дублируется; используется ответ, пришедший первым.
+    """
+    if not hedging.applies(function):
+        return await _fetch_json(session, function, what, url, params, docs_limit)
+    
+    hedging.earn()
+    primary = asyncio.ensure_future(_fetch_json(session, function, what, url, params, docs_limit))
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedging.delay(function))
+        if done:
+            return primary.result()
+        if not hedging.spend():
+            metrics.inc('upstream_hedges_skipped_total', function=function)
+            return await primary
+        hedge = asyncio.ensure_future(_fetch_json(session, function, what, url, params, docs_limit))
+        tasks.append(hedge)
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # Ответ с ошибкой не выигрывает: ждем второй запрос
+            winner = next((task for task in done if task.result() is not None), None)
+            if winner is not None:
+                metrics.inc('upstream_hedges_total', function=function,
+                            result='won' if winner is hedge else 'lost')
+                return winner.result()
+        metrics.inc('upstream_hedges_total', function=function, result='lost')
+        return None
+    finally:
+        losers = [task for task in tasks if not task.done()]
+        for task in losers:
+            task.cancel()
+        # Отмена должна завершиться до возврата: веб-сервер закрывает цикл событий сразу после ответа
+        await asyncio.gather(*losers, return_exceptions=True)
+
+
+async def _fetch_json(session: aiohttp.ClientSession,
+                      function: str,
+                      what: str,
+                      url: str,
+                      params: Optional[Dict] = None,
+                      docs_limit: Optional[int] = None) -> Optional[Dict]:
+    """Один GET-запрос к API"""
     headers = {
         'X-API-KEY': KINOPOISK_API_KEY
     }
+    status = 'error'
+    start = time.perf_counter()
     try:
-        async with session.get(url, headers=headers) as response:
+        async with session.get(url, headers=headers, params=params) as response:
+            status = str(response.status)
             if response.status == 200:
-                return await response.json()
+                raw = await response.read()
+                if docs_limit is None:
+                    data = json_codec.loads(raw)
+                else:
+                    data = json_codec.loads_docs(raw, docs_limit)
+                if hedging.enabled:
+                    hedging.record(function, time.perf_counter() - start)
+                _notify_docs(data)
+                return data
             else:
-                logger.error(f"Error fetching movie {movie_id}: {response.status}")
+                logger.error(f"Error {what}: {response.status}")
+    except asyncio.CancelledError:
+        # Проигравший дублирующий запрос
+        status = 'cancelled'
+        raise
     except Exception as e:
-        logger.error(f"Exception fetching movie {movie_id}: {e}")
+        logger.error(f"Exception {what}: {e}")
+    finally:
+        metrics.observe('upstream_request_duration_seconds', time.perf_counter() - start,
+                        function=function, status=status)
     return None
 
 
+async def get_movie_by_id(session: aiohttp.ClientSession, movie_id: int) -> Optional[Dict]:
+    """Получить информацию о фильме по ID (из кэша, локального каталога или API)"""
+    doc = _cached_detail(movie_id)
+    metrics.record_cache('movie_details', doc is not None)
+    if doc is not None:
+        return doc
+    doc = catalog.get_movie(movie_id)
+    if doc is not None:
+        _notify_docs(doc)
+    else:
+        url = f"{KINOPOISK_BASE_URL}/movie/{movie_id}"
+        doc = await _get_json(session, 'get_movie_by_id', f"fetching movie {movie_id}", url)
+    if doc is not None and doc.get('id'):
+        _store_detail(doc)
+    return doc
+
+
+async def get_movies_by_ids(session: aiohttp.ClientSession, movie_ids: Iterable[int]) -> Dict[int, Dict]:
+    """
+    Карточки нескольких фильмов: {movie_id: документ}.
+    Недостающие в кэше и каталоге запрашиваются пачками по DETAIL_BATCH_SIZE id
+    (фильтр id=...&id=...), не больше DETAIL_FANOUT запросов одновременно;
+    id, которых не оказалось в успешном ответе, догружаются по одному. Если запрос пачки
+    не удался (429, таймаут, 5xx), ее id не догружаются и возвращаются без них - иначе
+    один отказ превратился бы в DETAIL_BATCH_SIZE запросов к ограничивающему API.
+    Результаты кладутся в кэш.
+    """
+    result = {}
+    missing = []
+    for movie_id in dict.fromkeys(movie_ids):
+        doc = _cached_detail(movie_id)
+        metrics.record_cache('movie_details', doc is not None)
+        if doc is None:
+            doc = catalog.get_movie(movie_id)
+            if doc is not None:
+                _store_detail(doc)
+        if doc is not None:
+            result[movie_id] = doc
+        else:
+            missing.append(movie_id)
+    if not missing:
+        return result
+    
+    semaphore = asyncio.Semaphore(DETAIL_FANOUT)
+    url = f"{KINOPOISK_BASE_URL}/movie"
+    
+    # id из успешных ответов, которых в ответе не оказалось
+    absent = []
+    
+    async def fetch_batch(batch: List[int]):
+        params = [('page', 1), ('limit', len(batch))] + [('id', movie_id) for movie_id in batch]
+        async with semaphore:
+            data = await _get_json(session, 'get_movies_by_ids', "fetching movies by ids", url, params)
+        if data is None:
+            return
+        for doc in data.get('docs') or []:
+            if doc.get('id') in batch:
+                _store_detail(doc)
+                result[doc['id']] = doc
+        absent.extend(movie_id for movie_id in batch if movie_id not in result)
+    
+    batches = [missing[i:i + DETAIL_BATCH_SIZE] for i in range(0, len(missing), DETAIL_BATCH_SIZE)]
+    await asyncio.gather(*(fetch_batch(batch) for batch in batches))
+    
+    async def fetch_one(movie_id: int):
+        async with semaphore:
+            doc = await get_movie_by_id(session, movie_id)
+        if doc is not None:
+            result[movie_id] = doc
+    
+    await asyncio.gather(*(fetch_one(movie_id) for movie_id in absent))
+    return result
+
+
 async def get_movies(session: aiohttp.ClientSession, 
                      page: int = 1, 
                      limit: int = 20,
                      genre: Optional[str] = None,
                      rating_kp: Optional[float] = None,
                      year: Optional[int] = None,
-                     type: str = 'movie') -> Optional[Dict]:
-    """Получить список фильмов/сериалов"""
-    url = f"{KINOPOISK_BASE_URL}/{type}"
-    headers = {
-        'X-API-KEY': KINOPOISK_API_KEY
-    }
+                     type: str = 'movie',
+                     use_catalog: bool = True,
+                     docs_limit: Optional[int] = None) -> Optional[Dict]:
+    """
+    Получить список фильмов/сериалов по убыванию рейтинга.
+    Страница берется из локального каталога, если он синхронизирован для этого типа и жанра.
+    С docs_limit в ответе остаются только первые docs_limit документов страницы.
+    """
+    if use_catalog and year is None:
+        data = catalog.get_page(type, genre, rating_kp, page, limit, docs_limit)
+        if data is not None:
+            _notify_docs(data)
+            return data
+    
+    url = f"{KINOPOISK_BASE_URL}/movie"
     params = {
         'page': page,
         'limit': limit,
+        'type': type,
         'sortField': 'rating.kp',
         'sortType': '-1'
     }
@@ -76,43 +389,73 @@ async def get_movies(session: aiohttp.ClientSession,
     if year:
         params['year'] = year
     
-    try:
-        async with session.get(url, headers=headers, params=params) as response:
-            if response.status == 200:
-                return await response.json()
-            else:
-                logger.error(f"Error fetching movies: {response.status}")
-    except Exception as e:
-        logger.error(f"Exception fetching movies: {e}")
-    return None
+    return await _get_json(session, 'get_movies', "fetching movies", url, params, docs_limit)
+
+
+async def get_updated_movies(session: aiohttp.ClientSession,
+                             since: str,
+                             until: str,
+                             page: int = 1,
+                             limit: int = 250,
+                             genre: Optional[str] = None,
+                             rating_kp: Optional[float] = None,
+                             type: str = 'movie',
+                             ids: Optional[List[int]] = None) -> Optional[Dict]:
+    """
+    Фильмы/сериалы, измененные в интервале дат since-until (дд.мм.гггг), по возрастанию updatedAt.
+    С ids - только среди записей с этими id.
+    """
+    url = f"{KINOPOISK_BASE_URL}/movie"
+    params = {
+        'page': page,
+        'limit': limit,
+        'type': type,
+        'updatedAt': f'{since}-{until}',
+        'sortField': 'updatedAt',
+        'sortType': '1'
+    }
+    
+    if genre:
+        params['genres.name'] = genre
+    if rating_kp:
+        params['rating.kp'] = f'{rating_kp}-10'
+    if ids:
+        params = list(params.items()) + [('id', movie_id) for movie_id in ids]
+    
+    return await _get_json(session, 'get_updated_movies', "fetching updated movies", url, params)
 
 
-async def get_popular_movies(session: aiohttp.ClientSession, page: int = 1) -> Optional[Dict]:
+async def get_popular_movies(session: aiohttp.ClientSession, page: int = 1,
+                             docs_limit: Optional[int] = None) -> Optional[Dict]:
     """Получить популярные фильмы"""
-    return await get_movies(session, page=page, limit=20, type='movie')
+    return await get_movies(session, page=page, limit=20, type='movie', docs_limit=docs_limit)
 
 
-async def get_popular_tv(session: aiohttp.ClientSession, page: int = 1) -> Optional[Dict]:
+async def get_popular_tv(session: aiohttp.ClientSession, page: int = 1,
+                         docs_limit: Optional[int] = None) -> Optional[Dict]:
     """Получить популярные сериалы"""
-    return await get_movies(session, page=page, limit=20, type='tv-series')
+    return await get_movies(session, page=page, limit=20, type='tv-series', docs_limit=docs_limit)
 
 
-async def get_top_movies(session: aiohttp.ClientSession, page: int = 1) -> Optional[Dict]:
+async def get_top_movies(session: aiohttp.ClientSession, page: int = 1,
+                         docs_limit: Optional[int] = None) -> Optional[Dict]:
     """Получить топ фильмы (с высоким рейтингом)"""
-    return await get_movies(session, page=page, limit=20, rating_kp=7.5, type='movie')
+    return await get_movies(session, page=page, limit=20, rating_kp=7.5, type='movie', docs_limit=docs_limit)
 
 
-async def get_top_tv(session: aiohttp.ClientSession, page: int = 1) -> Optional[Dict]:
+async def get_top_tv(session: aiohttp.ClientSession, page: int = 1,
+                     docs_limit: Optional[int] = None) -> Optional[Dict]:
     """Получить топ сериалы (с высоким рейтингом)"""
-    return await get_movies(session, page=page, limit=20, rating_kp=7.5, type='tv-series')
+    return await get_movies(session, page=page, limit=20, rating_kp=7.5, type='tv-series', docs_limit=docs_limit)
 
 
 async def get_movies_by_genre(session: aiohttp.ClientSession, 
                               genre: str, 
                               page: int = 1,
-                              type: str = 'movie') -> Optional[Dict]:
+                              type: str = 'movie',
+                              docs_limit: Optional[int] = None) -> Optional[Dict]:
     """Получить фильмы/сериалы по жанру"""
-    return await get_movies(session, page=page, limit=20, genre=genre, type=type)
+    return await get_movies(session, page=page, limit=20, genre=genre, type=type, docs_limit=docs_limit)
 
 
 async def search_movies(session: aiohttp.ClientSession, 
@@ -121,24 +464,13 @@ async def search_movies(session: aiohttp.ClientSession,
                        limit: int = 20) -> Optional[Dict]:
     """Поиск фильмов и сериалов"""
     url = f"{KINOPOISK_BASE_URL}/movie/search"
-    headers = {
-        'X-API-KEY': KINOPOISK_API_KEY
-    }
     params = {
         'page': page,
         'limit': limit,
         'query': query
     }
     
-    try:
-        async with session.get(url, headers=headers, params=params) as response:
-            if response.status == 200:
-                return await response.json()
-            else:
-                logger.error(f"Error searching movies: {response.status}")
-    except Exception as e:
-        logger.error(f"Exception searching movies: {e}")
-    return None
+    return await _get_json(session, 'search_movies', "searching movies", url, params)
 
 
 def format_movie_info(data: Dict, media_type: str = 'movie') -> tuple:
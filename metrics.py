@@ -0,0 +1,227 @@
+"""
+Модуль метрик: гистограммы латентности, счетчики и экспорт в текстовом формате Prometheus
+"""
+import asyncio
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Границы корзин гистограмм (в секундах)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Описания метрик для строк # HELP
+HELP = {
+    'bot_handler_duration_seconds': 'Время обработки апдейта обработчиком бота',
+    'http_request_duration_seconds': 'Время обработки HTTP-запроса веб-сервером',
+    'upstream_request_duration_seconds': 'Время запроса к Кинопоиск API',
+    'telegram_request_duration_seconds': 'Время запроса к Telegram Bot API',
+    'db_query_duration_seconds': 'Время выполнения функции базы данных',
+    'db_errors_total': 'Ошибки базы данных',
+    'cache_requests_total': 'Обращения к кэшам (попадания и промахи)',
+    'process_startup_seconds': 'Длительность фаз запуска процесса',
+    'recommendations_total': 'Рекомендации «Для вас» по источнику (профиль или запасной вариант)',
+    'favorites_flush_total': 'Записи журнала избранного в базу (отложенная запись)',
+    'favorites_flush_duration_seconds': 'Время записи журнала избранного в базу',
+    'favorites_flushed_changes_total': 'Изменения избранного, записанные в базу из журнала',
+    'favorites_pending_changes': 'Изменения избранного, ожидающие записи в базу',
+    'feed_streams': 'Открытые потоки ленты мини-приложения (SSE)',
+    'feed_cards_total': 'Карточки, отправленные в ленту, по источнику (профиль или запасной вариант)',
+    'feed_swipes_total': 'Свайпы в ленте по направлению',
+    'upstream_hedges_total': 'Дублирующие запросы к Кинопоиск API (won - дубль ответил первым)',
+    'upstream_hedges_skipped_total': 'Дублирующие запросы, не отправленные из-за исчерпанного бюджета',
+    'upstream_hedge_delay_seconds': 'Порог ожидания ответа перед отправкой дублирующего запроса',
+}
+
+_lock = threading.Lock()
+# name -> {labels: [bucket_counts, sum, count]}
+_histograms: Dict[str, Dict[Tuple, list]] = {}
+# name -> {labels: value}
+_counters: Dict[str, Dict[Tuple, float]] = {}
+_gauges: Dict[str, Dict[Tuple, float]] = {}
+
+
+def _key(labels: Dict) -> Tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def observe(name: str, value: float, **labels):
+    """Записать значение в гистограмму"""
+    key = _key(labels)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        entry = series.get(key)
+        if entry is None:
+            entry = series[key] = [[0] * len(DEFAULT_BUCKETS), 0.0, 0]
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                entry[0][i] += 1
+        entry[1] += value
+        entry[2] += 1
+
+
+def inc(name: str, amount: float = 1, **labels):
+    """Увеличить счетчик"""
+    key = _key(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + amount
+
+
+def set_gauge(name: str, value: float, **labels):
+    """Установить значение показателя"""
+    key = _key(labels)
+    with _lock:
+        _gauges.setdefault(name, {})[key] = value
+
+
+def record_cache(cache: str, hit: bool):
+    """Учесть попадание/промах кэша"""
+    inc('cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+
+def timed(name: str, labels_fn: Optional[Callable[..., Dict]] = None, **labels):
+    """
+    Декоратор для замера времени выполнения функции (синхронной или асинхронной).
+    labels_fn получает аргументы вызова и возвращает дополнительные метки.
+    """
+    def decorator(func):
+        def _labels(args, kwargs):
+            if labels_fn is None:
+                return labels
+            try:
+                return {**labels, **labels_fn(*args, **kwargs)}
+            except Exception:
+                return labels
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    observe(name, time.perf_counter() - start, **_labels(args, kwargs))
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start, **_labels(args, kwargs))
+        return wrapper
+    return decorator
+
+
+def _format_labels(key: Tuple, extra: Optional[Tuple] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ''
+    body = ','.join(
+        '{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in items
+    )
+    return '{' + body + '}'
+
+
+def render() -> str:
+    """Сформировать текст метрик в формате Prometheus"""
+    lines = []
+    with _lock:
+        for name in sorted(_histograms):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, (buckets, total, count) in sorted(_histograms[name].items()):
+                for bound, bucket_count in zip(DEFAULT_BUCKETS, buckets):
+                    lines.append(f"{name}_bucket{_format_labels(key, ('le', repr(bound)))} {bucket_count}")
+                lines.append(f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {count}")
+                lines.append(f"{name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{name}_count{_format_labels(key)} {count}")
+        for kind, registry in (('counter', _counters), ('gauge', _gauges)):
+            for name in sorted(registry):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in sorted(registry[name].items()):
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def snapshot() -> Dict:
+    """Текущие значения счетчиков и сводка гистограмм (count/sum) по меткам"""
+    with _lock:
+        return {
+            'counters': {name: {key: value for key, value in series.items()}
+                         for name, series in _counters.items()},
+            'histograms': {name: {key: {'count': entry[2], 'sum': entry[1]}
+                                  for key, entry in series.items()}
+                           for name, series in _histograms.items()},
+        }
+
+
+def reset():
+    """Сбросить все метрики"""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _gauges.clear()
+
+
+class StartupTimer:
+    """Замер фаз запуска процесса с записью в метрики и итоговым отчетом в лог"""
+
+    def __init__(self, process: str, started: Optional[float] = None):
+        self.process = process
+        self.started = started if started is not None else time.perf_counter()
+        self._last = self.started
+        self.phases = []
+
+    def mark(self, phase: str):
+        """Завершить фазу phase (длительность - с предыдущей отметки)"""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        set_gauge('process_startup_seconds', now - self._last, process=self.process, phase=phase)
+        self._last = now
+
+    def report(self, phase: str = 'total'):
+        """Записать общее время с начала запуска и вывести отчет"""
+        total = time.perf_counter() - self.started
+        set_gauge('process_startup_seconds', total, process=self.process, phase=phase)
+        details = ', '.join(f"{name} {seconds * 1000:.0f} мс" for name, seconds in self.phases)
+        logger.info(f"Запуск {self.process}: {details}; {phase} {total * 1000:.0f} мс")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = '127.0.0.1') -> Optional[ThreadingHTTPServer]:
+    """Запустить HTTP-сервер метрик (/metrics) в фоновом потоке"""
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.error(f"Не удалось запустить сервер метрик на {host}:{port}: {e}")
+        return None
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,94 @@
+"""
+Перенос избранного между хранилищами (storage.py)
+
+Запуск:
+    python migrate_favorites.py --from sqlite:favorites.db --to sharded:favorites.db --shards 8
+    python migrate_favorites.py --from sharded:favorites.db --shards 8 --to postgres:postgresql://user@host/db
+    python migrate_favorites.py --from sharded:favorites.db --from-shards 4 \
+        --to sharded:favorites8.db --to-shards 8
+
+--shards задает число файлов sharded для обеих сторон, --from-shards и --to-shards - для
+каждой отдельно (смена числа файлов). Перенос в те же файлы, из которых читаются строки,
+не поддерживается: у sharded с другим числом файлов укажите другой путь.
+
+Строки читаются пачками и записываются с исходной датой добавления; повторный запуск
+перезаписывает уже перенесенные строки, поэтому прерванный перенос можно просто повторить.
+Бот и веб-сервер на время переноса лучше остановить, после переноса - переключить
+FAVORITES_BACKEND (и FAVORITES_SHARDS) на новое хранилище.
+"""
+import argparse
+import logging
+import sys
+from collections import defaultdict
+import storage
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+
+def open_spec(spec: str, shards: int):
+    """Хранилище по строке вида sqlite:путь, sharded:путь или postgres:DSN"""
+    kind, sep, target = spec.partition(':')
+    if not sep or not target:
+        raise ValueError(f"Ожидается вид:адрес (sqlite:favorites.db), получено: {spec}")
+    if kind == 'postgres':
+        return storage.open_backend(kind, '', dsn=target)
+    return storage.open_backend(kind, target, shards=shards)
+
+
+def migrate(source, target, batch_size: int = BATCH_SIZE) -> int:
+    """Скопировать все строки source в target; возвращает число строк"""
+    target.init()
+    pending = defaultdict(list)
+    copied = 0
+
+    def flush(index: int):
+        shard = target.shards[index]
+        with shard.lock:
+            target.insert_raw(shard, pending.pop(index))
+
+    for row in source.iter_rows(batch_size):
+        index = target.shard(row[0]).index
+        pending[index].append(row)
+        copied += 1
+        if len(pending[index]) >= batch_size:
+            flush(index)
+        if copied % (batch_size * 10) == 0:
+            logger.info(f"Перенесено строк: {copied}")
+    for index in list(pending):
+        flush(index)
+    return copied
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Перенос избранного между хранилищами')
+    parser.add_argument('--from', dest='source', required=True, help='sqlite:путь, sharded:путь или postgres:DSN')
+    parser.add_argument('--to', dest='target', required=True, help='sqlite:путь, sharded:путь или postgres:DSN')
+    parser.add_argument('--shards', type=int, default=4, help='число файлов для sharded')
+    parser.add_argument('--from-shards', type=int, help='число файлов исходного sharded (по умолчанию --shards)')
+    parser.add_argument('--to-shards', type=int, help='число файлов нового sharded (по умолчанию --shards)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    source = open_spec(args.source, args.from_shards or args.shards)
+    target = open_spec(args.target, args.to_shards or args.shards)
+    try:
+        copied = migrate(source, target, args.batch_size)
+        total = target.count()
+        logger.info(f"Перенесено строк: {copied}, в новом хранилище: {total}")
+        if total < copied:
+            logger.error("В новом хранилище меньше строк, чем перенесено")
+            return 1
+        return 0
+    finally:
+        source.close()
+        target.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    sys.exit(main())
@@ -0,0 +1,272 @@
+"""
+Прокси постеров для мини-приложения (маршрут /api/poster в web_server.py)
+
+Постер скачивается с разрешенного хоста (POSTER_ALLOWED_HOSTS) один раз, уменьшается
+до ширины из POSTER_WIDTHS и сохраняется в WebP или JPEG (по заголовку Accept) в
+дисковом кэше POSTER_CACHE_DIR. Кэш ограничен POSTER_CACHE_MAX_MB: при переполнении
+удаляются давно не запрошенные файлы. Вместе с уменьшенными копиями хранится
+исходный файл, поэтому другие ширины не скачиваются повторно.
+
+Без Pillow постер отдается в исходном размере (но так же кэшируется).
+Если постера нет или его не удалось получить, отдается SVG-заглушка с названием фильма.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from io import BytesIO
+from typing import Optional, Tuple
+from xml.sax.saxutils import escape
+from config import (
+    POSTER_CACHE_DIR, POSTER_CACHE_MAX_MB, POSTER_WIDTHS, POSTER_ALLOWED_HOSTS,
+    POSTER_QUALITY, POSTER_FETCH_TIMEOUT_SEC
+)
+import metrics
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Постеры больше этого размера не скачиваются
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+
+MIMETYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+WIDTHS = sorted(int(w) for w in POSTER_WIDTHS.split(',') if w.strip())
+ALLOWED_HOSTS = {h.strip().lower() for h in POSTER_ALLOWED_HOSTS.split(',') if h.strip()}
+
+# Цвета фона заглушки (выбираются по названию)
+_PLACEHOLDER_COLORS = ('#6366f1', '#8b5cf6', '#ec4899', '#f59e0b', '#10b981', '#0ea5e9', '#64748b')
+
+
+def allowed(src: str) -> bool:
+    """Можно ли скачивать постер по этому адресу"""
+    try:
+        parsed = urllib.parse.urlsplit(src)
+    except ValueError:
+        return False
+    host = (parsed.hostname or '').lower()
+    if parsed.scheme not in ('http', 'https') or not host:
+        return False
+    return any(host == allowed_host or host.endswith('.' + allowed_host) for allowed_host in ALLOWED_HOSTS)
+
+
+def pick_width(width: int) -> int:
+    """Ближайшая разрешенная ширина не меньше запрошенной"""
+    for candidate in WIDTHS:
+        if candidate >= width:
+            return candidate
+    return WIDTHS[-1]
+
+
+def placeholder_svg(title: str) -> bytes:
+    """SVG-заглушка 2:3 с названием фильма"""
+    title = ' '.join(title.split())[:60] or 'Нет постера'
+    color = _PLACEHOLDER_COLORS[int(hashlib.sha256(title.encode('utf-8')).hexdigest(), 16) % len(_PLACEHOLDER_COLORS)]
+    # Название разбивается на строки по ~16 символов
+    lines, line = [], ''
+    for word in title.split():
+        if line and len(line) + len(word) > 16:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}".strip()
+    lines.append(line)
+    lines = lines[:4]
+    start = 300 - (len(lines) - 1) * 22
+    text = ''.join(
+        f'<text x="200" y="{start + i * 44}" font-size="34" text-anchor="middle" '
+        f'font-family="sans-serif" fill="#fff">{escape(part)}</text>'
+        for i, part in enumerate(lines)
+    )
+    svg = (
+        '<svg xmlns="http://www.w3.org/2000/svg" width="400" height="600" viewBox="0 0 400 600">'
+        f'<rect width="400" height="600" fill="{color}"/>'
+        '<text x="200" y="190" font-size="72" text-anchor="middle">🎬</text>'
+        f'{text}</svg>'
+    )
+    return svg.encode('utf-8')
+
+
+def _key(src: str) -> str:
+    return hashlib.sha256(src.encode('utf-8')).hexdigest()[:32]
+
+
+def _sniff(data: bytes) -> str:
+    if data[:3] == b'\xff\xd8\xff':
+        return 'jpeg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return 'jpeg'
+
+
+class _AllowedRedirects(urllib.request.HTTPRedirectHandler):
+    """Перенаправления только на разрешенные хосты"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if not allowed(newurl):
+            raise urllib.error.HTTPError(newurl, code, 'redirect to a host that is not allowed', headers, fp)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+_opener = urllib.request.build_opener(_AllowedRedirects)
+
+
+class PosterCache:
+    """Дисковый LRU-кэш постеров"""
+
+    def __init__(self, directory: str = POSTER_CACHE_DIR, max_bytes: int = int(POSTER_CACHE_MAX_MB * 1024 * 1024),
+                 quality: int = POSTER_QUALITY, timeout: float = POSTER_FETCH_TIMEOUT_SEC):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # имя файла -> размер; порядок - от давно не запрошенных к недавним
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        self._loaded = False
+        # Один постер обрабатывается одним потоком, остальные ждут его результата
+        self._key_locks = [threading.Lock() for _ in range(64)]
+
+    def _ensure_loaded(self):
+        """Прочитать содержимое каталога кэша (вызывать под _lock)"""
+        if self._loaded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self._total += size
+        self._loaded = True
+
+    def _read(self, name: str) -> Optional[bytes]:
+        with self._lock:
+            self._ensure_loaded()
+            if name not in self._index:
+                return None
+            self._index.move_to_end(name)
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # mtime - порядок вытеснения после перезапуска
+            os.utime(path)
+            return data
+        except OSError:
+            with self._lock:
+                self._total -= self._index.pop(name, 0)
+            return None
+
+    def _store(self, name: str, data: bytes):
+        path = os.path.join(self.directory, name)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        evicted = []
+        with self._lock:
+            self._total += len(data) - self._index.pop(name, 0)
+            self._index[name] = len(data)
+            while self._total > self.max_bytes and len(self._index) > 1:
+                old, size = self._index.popitem(last=False)
+                self._total -= size
+                evicted.append(old)
+        for old in evicted:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except OSError:
+                pass
+
+    def _fetch(self, src: str) -> bytes:
+        status = 'error'
+        start = time.perf_counter()
+        try:
+            with _opener.open(urllib.request.Request(src, headers={'User-Agent': 'kriegerfilm-poster-proxy'}),
+                              timeout=self.timeout) as response:
+                status = str(response.status)
+                data = response.read(MAX_SOURCE_BYTES + 1)
+        except urllib.error.HTTPError as e:
+            status = str(e.code)
+            raise
+        finally:
+            metrics.observe('upstream_request_duration_seconds', time.perf_counter() - start,
+                            function='poster', status=status)
+        if len(data) > MAX_SOURCE_BYTES:
+            raise ValueError(f"постер больше {MAX_SOURCE_BYTES} байт")
+        return data
+
+    def _resize(self, source: bytes, width: int, fmt: str) -> bytes:
+        image = Image.open(BytesIO(source))
+        # Для JPEG декодер сразу уменьшает изображение кратно 2 - это быстрее полного декодирования
+        image.draft('RGB', (width, width * 3))
+        image = image.convert('RGB')
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        out = BytesIO()
+        if fmt == 'webp':
+            image.save(out, 'WEBP', quality=self.quality, method=4)
+        else:
+            image.save(out, 'JPEG', quality=self.quality, optimize=True, progressive=True)
+        return out.getvalue()
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        return self._key_locks[int(key[:8], 16) % len(self._key_locks)]
+
+    def _source(self, key: str, src: str) -> bytes:
+        """Исходный постер из кэша или с хоста (вызывать под _key_lock)"""
+        source = self._read(f"{key}.src")
+        if source is None:
+            source = self._fetch(src)
+            self._store(f"{key}.src", source)
+        return source
+
+    def prefetch(self, src: str):
+        """Заранее скачать исходный постер в кэш (для карточек, которые скоро покажут)"""
+        key = _key(src)
+        with self._key_lock(key):
+            try:
+                self._source(key, src)
+            except Exception as e:
+                logger.error(f"Ошибка загрузки постера {src}: {e}")
+
+    def get(self, src: str, width: int, fmt: str) -> Optional[Tuple[bytes, str]]:
+        """(содержимое, mimetype) постера нужной ширины или None, если его не удалось получить"""
+        key = _key(src)
+        resize = Image is not None
+        name = f"{key}_{pick_width(width)}.{fmt}" if resize else f"{key}.src"
+        data = self._read(name)
+        metrics.record_cache('posters', data is not None)
+        if data is None:
+            with self._key_lock(key):
+                data = self._read(name)
+                if data is None:
+                    try:
+                        source = self._source(key, src)
+                        if resize:
+                            data = self._resize(source, pick_width(width), fmt)
+                            self._store(name, data)
+                        else:
+                            data = source
+                    except Exception as e:
+                        logger.error(f"Ошибка получения постера {src}: {e}")
+                        return None
+        return data, MIMETYPES[fmt if resize else _sniff(data)]
+
+
+poster_cache = PosterCache()
@@ -0,0 +1,253 @@
+"""
+Выборочный профилировщик медленных запросов.
+
+Включается переменными окружения:
+    PROFILE_SAMPLE_RATE  - доля профилируемых запросов (0 - выключено), например 0.01
+    PROFILE_DEBUG_USERS  - id пользователей через запятую, чьи запросы профилируются всегда
+
+Пока профилируемый запрос выполняется, фоновый поток раз в PROFILE_SAMPLE_INTERVAL_MS
+снимает его стек (для корутин - цепочку await, если задача сейчас ожидает).
+За каждый интервал PROFILE_INTERVAL_SEC сохраняются PROFILE_TOP_N самых медленных
+запросов в PROFILE_DIR в формате folded stacks (flamegraph.pl, speedscope),
+старые файлы удаляются сверх PROFILE_MAX_FILES.
+"""
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Optional, Tuple
+from config import (
+    PROFILE_SAMPLE_RATE, PROFILE_DEBUG_USERS, PROFILE_DIR, PROFILE_SAMPLE_INTERVAL_MS,
+    PROFILE_INTERVAL_SEC, PROFILE_TOP_N, PROFILE_MAX_FILES
+)
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = PROFILE_SAMPLE_RATE
+DEBUG_USERS = {int(x) for x in PROFILE_DEBUG_USERS.split(',') if x.strip()}
+SAMPLE_INTERVAL = PROFILE_SAMPLE_INTERVAL_MS / 1000
+INTERVAL_SEC = PROFILE_INTERVAL_SEC
+TOP_N = PROFILE_TOP_N
+MAX_FILES = PROFILE_MAX_FILES
+
+ENABLED = SAMPLE_RATE > 0 or bool(DEBUG_USERS)
+
+
+class _Request:
+    __slots__ = ('label', 'thread_id', 'task', 'start', 'stacks')
+
+    def __init__(self, label: str, thread_id: int, task):
+        self.label = label
+        self.thread_id = thread_id
+        self.task = task
+        self.start = time.perf_counter()
+        self.stacks = Counter()
+
+
+_lock = threading.Lock()
+_active = {}
+_ids = itertools.count()
+_sampler: Optional[threading.Thread] = None
+_wakeup = threading.Event()
+# Куча (длительность, номер, метка, стеки) самых медленных запросов текущего интервала
+_slowest = []
+_interval_start = time.time()
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _thread_stack(frame, root=None) -> list:
+    """Стек потока от корня (или от кадра root, если он есть в стеке) к текущему кадру"""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        if frame is root:
+            break
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+def _await_stack(coro) -> list:
+    """Цепочка await приостановленной корутины (от внешней к внутренней)"""
+    names = []
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame is None:
+            break
+        names.append(_frame_name(frame))
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    names.append('[await]')
+    return names
+
+
+def _sample_once():
+    frames = sys._current_frames()
+    with _lock:
+        requests = list(_active.items())
+    samples = []
+    for token, req in requests:
+        coro = req.task.get_coro() if req.task is not None else None
+        if coro is not None and not getattr(coro, 'cr_running', False):
+            stack = _await_stack(coro)
+        else:
+            frame = frames.get(req.thread_id)
+            if frame is None:
+                continue
+            stack = _thread_stack(frame, getattr(coro, 'cr_frame', None))
+        samples.append((token, req, ';'.join(stack)))
+    # Счетчики меняются только под _lock и только у незавершенных запросов:
+    # после finish() стеки запроса больше не меняются и их можно записывать в файл
+    with _lock:
+        for token, req, stack in samples:
+            if token in _active:
+                req.stacks[stack] += 1
+
+
+def _sampler_loop():
+    while True:
+        _wakeup.wait()
+        while True:
+            with _lock:
+                if not _active:
+                    _wakeup.clear()
+                    break
+            _sample_once()
+            time.sleep(SAMPLE_INTERVAL)
+
+
+def _ensure_sampler():
+    global _sampler
+    if _sampler is None:
+        _sampler = threading.Thread(target=_sampler_loop, name='profiler-sampler', daemon=True)
+        _sampler.start()
+
+
+def _should_profile(user_id: Optional[int]) -> bool:
+    if user_id is not None and user_id in DEBUG_USERS:
+        return True
+    return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+
+def start(label: str, user_id: Optional[int] = None) -> Optional[int]:
+    """Начать профилирование запроса; возвращает токен или None, если запрос не выбран"""
+    if not ENABLED or not _should_profile(user_id):
+        return None
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    token = next(_ids)
+    with _lock:
+        _active[token] = _Request(label, threading.get_ident(), task)
+    _ensure_sampler()
+    _wakeup.set()
+    return token
+
+
+def finish(token: Optional[int]):
+    """Завершить профилирование запроса"""
+    if token is None:
+        return
+    with _lock:
+        req = _active.pop(token, None)
+    if req is None:
+        return
+    duration = time.perf_counter() - req.start
+    rotated = None
+    with _lock:
+        entry = (duration, token, req.label, req.stacks)
+        if len(_slowest) < TOP_N:
+            heapq.heappush(_slowest, entry)
+        elif duration > _slowest[0][0]:
+            heapq.heapreplace(_slowest, entry)
+        if time.time() - _interval_start >= INTERVAL_SEC:
+            rotated = _rotate_interval()
+    if rotated:
+        _write_profiles(rotated)
+
+
+def _rotate_interval():
+    global _slowest, _interval_start
+    entries, _slowest = _slowest, []
+    _interval_start = time.time()
+    return entries
+
+
+def _write_profiles(entries):
+    """Записать профили интервала и удалить старые файлы сверх лимита"""
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        for duration, token, label, stacks in sorted(entries, reverse=True):
+            if not stacks:
+                continue
+            safe_label = re.sub(r'[^\w.-]+', '_', label)[:60]
+            name = f"{stamp}_{int(duration * 1000)}ms_{safe_label}_{token}.folded"
+            with open(os.path.join(PROFILE_DIR, name), 'w', encoding='utf-8') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{label};{stack} {count}\n")
+        files = sorted(
+            (os.path.join(PROFILE_DIR, n) for n in os.listdir(PROFILE_DIR) if n.endswith('.folded')),
+            key=os.path.getmtime
+        )
+        for path in files[:-MAX_FILES] if len(files) > MAX_FILES else []:
+            os.remove(path)
+    except OSError as e:
+        logger.error(f"Ошибка при записи профилей: {e}")
+
+
+def flush():
+    """Принудительно сохранить профили текущего интервала"""
+    with _lock:
+        entries = _rotate_interval()
+    if entries:
+        _write_profiles(entries)
+
+
+def profiled(context_fn: Callable[..., Tuple[str, Optional[int]]]):
+    """
+    Декоратор обработчика: context_fn получает аргументы вызова
+    и возвращает (метка, user_id) для выбора и подписи профиля.
+    """
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        def _start(args, kwargs):
+            try:
+                label, user_id = context_fn(*args, **kwargs)
+            except Exception:
+                label, user_id = func.__name__, None
+            return start(label, user_id)
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                token = _start(args, kwargs)
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    finish(token)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            token = _start(args, kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                finish(token)
+        return wrapper
+    return decorator
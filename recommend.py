@@ -0,0 +1,232 @@
+"""
+Рекомендации «Для вас» на основе избранного.
+
+Каждый фильм описывается разреженным вектором признаков (жанры, страны, десятилетие,
+рейтинг, тип), нормированным на единичную длину. Вектор вычисляется один раз - когда
+фильм попадает в пул кандидатов: документы из ответов Кинопоиск API и лучшие по
+рейтингу фильмы локального каталога (catalog.py; перечитываются раз в
+RECOMMEND_CATALOG_REFRESH_SEC). Профиль пользователя - сумма векторов его избранного;
+он обновляется инкрементально при добавлении и удалении фильма и перестраивается
+из базы, только если избранное изменил другой процесс (не совпал набор id).
+
+Оценка кандидатов - произведение разреженной матрицы пула на вектор профиля через
+обратный индекс признак -> {movie_id: вес}: перебираются только кандидаты,
+у которых есть общие с профилем признаки.
+
+Пул и профили общие для потоков веб-сервера: их меняют и читают под Recommender.lock,
+запросы к базе (набор id избранного, перестроение профиля) выполняются без блокировки.
+"""
+import math
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Set
+from config import RECOMMEND_POOL_SIZE, RECOMMEND_PROFILES, RECOMMEND_TOP_K, RECOMMEND_CATALOG_REFRESH_SEC
+from database import get_favorites, get_favorite_ids
+import catalog
+import metrics
+
+# Веса групп признаков
+WEIGHTS = {
+    'g': 1.0,   # жанр
+    'c': 0.5,   # страна
+    'd': 0.5,   # десятилетие
+    'r': 0.3,   # рейтинг (округленный вниз)
+    't': 0.3,   # фильм / сериал
+}
+
+# Сколько последних показанных рекомендаций не повторять
+RECENT_SHOWN = 20
+
+
+def movie_features(doc: Dict) -> Dict[str, float]:
+    """Нормированный разреженный вектор признаков фильма"""
+    features = {}
+    for genre in doc.get('genres') or []:
+        if genre.get('name'):
+            features[f"g:{genre['name']}"] = WEIGHTS['g']
+    for country in doc.get('countries') or []:
+        if country.get('name'):
+            features[f"c:{country['name']}"] = WEIGHTS['c']
+    year = doc.get('year')
+    if isinstance(year, int) and year > 0:
+        features[f"d:{year // 10 * 10}"] = WEIGHTS['d']
+    rating = (doc.get('rating') or {}).get('kp')
+    if isinstance(rating, (int, float)) and rating > 0:
+        features[f"r:{int(rating)}"] = WEIGHTS['r']
+    if doc.get('type'):
+        features[f"t:{doc['type']}"] = WEIGHTS['t']
+    norm = math.sqrt(sum(w * w for w in features.values()))
+    return {name: w / norm for name, w in features.items()} if norm else {}
+
+
+class TasteProfile:
+    """Сумма векторов избранного пользователя"""
+
+    def __init__(self):
+        self.vector: Dict[str, float] = {}
+        self.items: Dict[int, Dict[str, float]] = {}
+
+    def add(self, movie_id: int, features: Dict[str, float]):
+        if movie_id in self.items:
+            return
+        self.items[movie_id] = features
+        for name, w in features.items():
+            self.vector[name] = self.vector.get(name, 0.0) + w
+
+    def remove(self, movie_id: int):
+        features = self.items.pop(movie_id, None)
+        if features is None:
+            return
+        for name, w in features.items():
+            value = self.vector.get(name, 0.0) - w
+            if value > 1e-9:
+                self.vector[name] = value
+            else:
+                self.vector.pop(name, None)
+
+
+class Recommender:
+    """Пул кандидатов, профили пользователей и выбор рекомендаций"""
+
+    def __init__(self, pool_size: int = RECOMMEND_POOL_SIZE, max_profiles: int = RECOMMEND_PROFILES,
+                 top_k: int = RECOMMEND_TOP_K):
+        self.pool_size = pool_size
+        self.max_profiles = max_profiles
+        self.top_k = top_k
+        # movie_id -> документ (порядок - давность появления в ответах API)
+        self.docs: "OrderedDict[int, Dict]" = OrderedDict()
+        self.vectors: Dict[int, Dict[str, float]] = {}
+        # признак -> {movie_id: вес}
+        self.index: Dict[str, Dict[int, float]] = {}
+        self.profiles: "OrderedDict[int, TasteProfile]" = OrderedDict()
+        self.shown: Dict[int, deque] = {}
+        self._catalog_at: Optional[float] = None
+        self.lock = threading.RLock()
+
+    # --- пул кандидатов ---
+
+    def catalog_candidates(self) -> List[Dict]:
+        """
+        Лучшие фильмы локального каталога, если пора обновить ими пул (иначе пусто).
+        Каталог занимает не больше половины пула - остальное остается ответам API.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if self._catalog_at is not None and now - self._catalog_at < RECOMMEND_CATALOG_REFRESH_SEC:
+                return []
+            self._catalog_at = now
+        return catalog.top_movies(self.pool_size // 2)
+
+    def remember(self, docs: List[Dict]):
+        """Добавить документы фильмов в пул кандидатов"""
+        vectors = [(doc, movie_features(doc)) for doc in docs if doc.get('id')]
+        with self.lock:
+            for doc, features in vectors:
+                movie_id = doc['id']
+                if movie_id in self.docs:
+                    self.docs[movie_id] = doc
+                    self.docs.move_to_end(movie_id)
+                    continue
+                if not features:
+                    continue
+                self.docs[movie_id] = doc
+                self.vectors[movie_id] = features
+                for name, w in features.items():
+                    self.index.setdefault(name, {})[movie_id] = w
+                if len(self.docs) > self.pool_size:
+                    self._forget(next(iter(self.docs)))
+
+    def _forget(self, movie_id: int):
+        self.docs.pop(movie_id, None)
+        for name in self.vectors.pop(movie_id, {}):
+            postings = self.index.get(name)
+            if postings is not None:
+                postings.pop(movie_id, None)
+                if not postings:
+                    del self.index[name]
+
+    # --- профили ---
+
+    def _build_profile(self, user_id: int, ids: Set[int]) -> TasteProfile:
+        """Профиль по всему избранному: ключи items совпадают с ids, даже если документ не прочитался"""
+        profile = TasteProfile()
+        for doc in get_favorites(user_id, limit=len(ids)) if ids else []:
+            if doc.get('id') in ids:
+                profile.add(doc['id'], movie_features(doc))
+        for movie_id in ids:
+            profile.add(movie_id, {})
+        return profile
+
+    def profile(self, user_id: int) -> TasteProfile:
+        """Профиль пользователя (перестраивается, если избранное изменили вне этого процесса)"""
+        ids = get_favorite_ids(user_id)
+        with self.lock:
+            profile = self.profiles.get(user_id)
+            # Сравнивается набор id: удаление одного фильма и добавление другого не меняют их число
+            if profile is not None and profile.items.keys() == ids:
+                self.profiles.move_to_end(user_id)
+                metrics.record_cache('taste_profile', True)
+                return profile
+        metrics.record_cache('taste_profile', False)
+        profile = self._build_profile(user_id, ids)
+        with self.lock:
+            self.profiles[user_id] = profile
+            if len(self.profiles) > self.max_profiles:
+                evicted, _ = self.profiles.popitem(last=False)
+                self.shown.pop(evicted, None)
+        return profile
+
+    def favorite_added(self, user_id: int, doc: Dict):
+        """Инкрементально учесть добавленный фильм"""
+        self.remember([doc])
+        with self.lock:
+            profile = self.profiles.get(user_id)
+            if profile is not None and doc.get('id'):
+                profile.add(doc['id'], self.vectors.get(doc['id']) or movie_features(doc))
+
+    def favorite_removed(self, user_id: int, movie_id: int):
+        """Инкрементально учесть удаленный фильм"""
+        with self.lock:
+            profile = self.profiles.get(user_id)
+            if profile is not None:
+                profile.remove(movie_id)
+
+    # --- рекомендации ---
+
+    def scores(self, profile: TasteProfile, exclude: Set[int]) -> Dict[int, float]:
+        """Косинусная близость кандидатов к профилю (вызывать под lock)"""
+        norm = math.sqrt(sum(w * w for w in profile.vector.values()))
+        if not norm:
+            return {}
+        scores: Dict[int, float] = {}
+        for name, pw in profile.vector.items():
+            for movie_id, w in self.index.get(name, {}).items():
+                scores[movie_id] = scores.get(movie_id, 0.0) + pw * w
+        for movie_id in exclude:
+            scores.pop(movie_id, None)
+        return {movie_id: score / norm for movie_id, score in scores.items()}
+
+    def recommend(self, user_id: int, rng: random.Random = random) -> Optional[Dict]:
+        """
+        Фильм для пользователя: случайный из top_k самых близких к профилю,
+        кроме избранного и недавно показанных. None - если профиль пуст
+        или в пуле нет подходящих кандидатов.
+        """
+        self.remember(self.catalog_candidates())
+        profile = self.profile(user_id)
+        with self.lock:
+            shown = self.shown.setdefault(user_id, deque(maxlen=RECENT_SHOWN))
+            scores = self.scores(profile, set(profile.items) | set(shown))
+            if not scores:
+                metrics.inc('recommendations_total', source='fallback')
+                return None
+            top = sorted(scores, key=scores.get, reverse=True)[:self.top_k]
+            movie_id = rng.choices(top, weights=[scores[m] for m in top])[0]
+            shown.append(movie_id)
+            metrics.inc('recommendations_total', source='profile')
+            return self.docs[movie_id]
+
+
+recommender = Recommender()
@@ -0,0 +1,446 @@
+"""
+Хранилища избранного (выбираются в config.py через FAVORITES_BACKEND)
+
+sqlite   - один файл FAVORITES_DB, как раньше
+sharded  - FAVORITES_SHARDS файлов SQLite рядом с FAVORITES_DB (favorites_0.db, favorites_1.db, ...).
+           Пользователь попадает в файл по crc32(user_id). У SQLite один писатель на файл,
+           поэтому записи пользователей из разных файлов идут параллельно
+postgres - таблица favorites в PostgreSQL (FAVORITES_POSTGRES_DSN, нужен пакет psycopg)
+
+Хранилище разбито на шарды: у sqlite шард один, у sharded - по файлу, у postgres - по
+соединению. У каждого шарда своя блокировка и общее соединение процесса. Через
+external_changes database.py узнает о записях других процессов и сбрасывает кэш.
+"""
+import sqlite3
+import logging
+import os
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Версия схемы хранится в PRAGMA user_version: если она актуальна,
+# init только читает ее и не выполняет DDL и commit при каждом запуске
+SCHEMA_VERSION = 1
+
+# Строка избранного: (user_id, movie_id, movie_name, movie_type, movie_data)
+Row = Tuple[int, int, str, str, str]
+# Строка для переноса между хранилищами: то же и added_at
+RawRow = Tuple[int, int, str, str, str, Optional[str]]
+
+
+def shard_index(user_id: int, shards: int) -> int:
+    """Номер шарда пользователя (стабилен между процессами и запусками)"""
+    return zlib.crc32(str(user_id).encode()) % shards
+
+
+def shard_paths(db_name: str, shards: int) -> List[str]:
+    """Файлы шардов: favorites.db -> favorites_0.db, favorites_1.db, ..."""
+    base, ext = os.path.splitext(db_name)
+    return [f"{base}_{i}{ext or '.db'}" for i in range(shards)]
+
+
+class Shard:
+    """Часть хранилища со своей блокировкой"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.lock = threading.Lock()
+
+
+# --- SQLite ---
+
+class SQLiteShard(Shard):
+    def __init__(self, index: int, path: str):
+        super().__init__(index)
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+
+    def connection(self) -> sqlite3.Connection:
+        """Общее соединение шарда (вызывать под lock)"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class SQLiteBackend:
+    """Один или несколько файлов SQLite"""
+
+    def __init__(self, paths: List[str], wal: bool = False, check_interval: float = 0.1):
+        self.kind = 'sqlite' if len(paths) == 1 else 'sharded'
+        self.shards = [SQLiteShard(i, path) for i, path in enumerate(paths)]
+        self.wal = wal
+        self.check_interval = check_interval
+
+    def shard(self, user_id: int) -> SQLiteShard:
+        return self.shards[shard_index(user_id, len(self.shards))]
+
+    def init(self) -> bool:
+        """Создать схему во всех файлах; True - если что-то создавалось"""
+        created = False
+        for shard in self.shards:
+            conn = sqlite3.connect(shard.path)
+            try:
+                if self.wal:
+                    # WAL: чтение не ждет писателя, запись не ждет читателей
+                    conn.execute('PRAGMA journal_mode=WAL')
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                if version >= SCHEMA_VERSION:
+                    continue
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS favorites (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        movie_id INTEGER NOT NULL,
+                        movie_name TEXT NOT NULL,
+                        movie_type TEXT NOT NULL,
+                        movie_data TEXT,
+                        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        UNIQUE(user_id, movie_id)
+                    )
+                ''')
+                conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+                conn.commit()
+                created = True
+            finally:
+                conn.close()
+        return created
+
+    def external_changes(self, shard: SQLiteShard) -> Optional[Set[int]]:
+        """
+        Шарды, измененные другими соединениями с прошлой проверки (вызывать под shard.lock).
+        PRAGMA data_version меняется только от чужих коммитов, свои записи его не меняют.
+        """
+        now = time.monotonic()
+        if shard._version is not None and now - shard._checked_at < self.check_interval:
+            return None
+        shard._checked_at = now
+        version = shard.connection().execute('PRAGMA data_version').fetchone()[0]
+        changed = shard._version is not None and version != shard._version
+        shard._version = version
+        return {shard.index} if changed else None
+
+    def load_ids(self, shard: SQLiteShard, user_id: int) -> Set[int]:
+        rows = shard.connection().execute('SELECT movie_id FROM favorites WHERE user_id = ?', (user_id,))
+        return {row[0] for row in rows}
+
+    def insert_raw(self, shard: SQLiteShard, rows: Iterable[RawRow]):
+        conn = shard.connection()
+        with conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO favorites
+                (user_id, movie_id, movie_name, movie_type, movie_data, added_at)
+                VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+            ''', rows)
+
+    def apply(self, shard: SQLiteShard, rows: Iterable[Row], removals: List[Tuple[int, int]]) -> int:
+        """Записать добавления и удаления (user_id, movie_id) одной транзакцией; возвращает число удаленных"""
+        conn = shard.connection()
+        with conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO favorites
+                (user_id, movie_id, movie_name, movie_type, movie_data)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+            if not removals:
+                return 0
+            cursor = conn.executemany('DELETE FROM favorites WHERE user_id = ? AND movie_id = ?', removals)
+            return cursor.rowcount
+
+    def list_docs(self, user_id: int, limit: int) -> List[str]:
+        """JSON фильмов пользователя, новые первыми (отдельное соединение, без блокировки шарда)"""
+        conn = sqlite3.connect(self.shard(user_id).path)
+        try:
+            rows = conn.execute('''
+                SELECT movie_data FROM favorites
+                WHERE user_id = ?
+                ORDER BY added_at DESC
+                LIMIT ?
+            ''', (user_id, limit)).fetchall()
+        finally:
+            conn.close()
+        return [row[0] for row in rows]
+
+    def iter_docs(self, user_id: int, batch_size: int) -> Iterator[str]:
+        """JSON фильмов пользователя от старых к новым, чтение пачками"""
+        conn = sqlite3.connect(self.shard(user_id).path)
+        try:
+            cursor = conn.execute('''
+                SELECT movie_data FROM favorites
+                WHERE user_id = ?
+                ORDER BY added_at, id
+            ''', (user_id,))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row[0]
+        finally:
+            conn.close()
+
+    def iter_rows(self, batch_size: int = 1000) -> Iterator[RawRow]:
+        """Все строки хранилища (для переноса)"""
+        for shard in self.shards:
+            conn = sqlite3.connect(shard.path)
+            try:
+                cursor = conn.execute('''
+                    SELECT user_id, movie_id, movie_name, movie_type, movie_data, added_at
+                    FROM favorites ORDER BY user_id, id
+                ''')
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield from rows
+            finally:
+                conn.close()
+
+    def count(self) -> int:
+        total = 0
+        for shard in self.shards:
+            conn = sqlite3.connect(shard.path)
+            try:
+                total += conn.execute('SELECT COUNT(*) FROM favorites').fetchone()[0]
+            finally:
+                conn.close()
+        return total
+
+    def close(self):
+        for shard in self.shards:
+            with shard.lock:
+                shard.close()
+
+
+# --- PostgreSQL ---
+
+class PostgresShard(Shard):
+    def __init__(self, index: int, dsn: str):
+        super().__init__(index)
+        self.dsn = dsn
+        self._conn = None
+
+    def connection(self):
+        """Соединение шарда (вызывать под lock)"""
+        if self._conn is None or self._conn.closed:
+            import psycopg
+            self._conn = psycopg.connect(self.dsn, autocommit=True)
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class VersionTracker:
+    """
+    Учет версий общей последовательности: какие версии выданы своим записям, а какие - чужим.
+    Свои версии хранятся по значению, поэтому своя запись, попавшая между чтением
+    последовательности и проверкой, не засчитывается дважды.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seen: Optional[int] = None
+        self._own: Set[int] = set()
+
+    @property
+    def initialized(self) -> bool:
+        return self._seen is not None
+
+    def own(self, version: int):
+        """Версия, полученная своей записью"""
+        with self._lock:
+            if self._seen is None or version > self._seen:
+                self._own.add(version)
+
+    def check(self, last: int) -> bool:
+        """Текущее значение последовательности; True - с прошлой проверки были чужие записи"""
+        with self._lock:
+            if self._seen is None:
+                foreign = False
+            elif last <= self._seen:
+                return False
+            else:
+                own = sum(1 for version in self._own if self._seen < version <= last)
+                foreign = last - self._seen > own
+            self._seen = last
+            self._own = {version for version in self._own if version > last}
+            return foreign
+
+
+class PostgresBackend:
+    """
+    Таблица favorites в PostgreSQL. Шарды - соединения процесса (пользователь
+    закреплен за соединением по crc32). Каждая запись берет nextval из
+    favorites_version_seq: если в последовательности появились версии, полученные
+    не своими записями (VersionTracker), избранное менял другой процесс.
+    """
+
+    kind = 'postgres'
+
+    def __init__(self, dsn: str, connections: int = 4, check_interval: float = 0.1):
+        try:
+            import psycopg  # noqa: F401
+        except ImportError:
+            raise RuntimeError("Для FAVORITES_BACKEND=postgres установите psycopg: pip install 'psycopg[binary]'")
+        self.dsn = dsn
+        self.shards = [PostgresShard(i, dsn) for i in range(connections)]
+        self.check_interval = check_interval
+        self._versions = VersionTracker()
+        self._checked_lock = threading.Lock()
+        self._checked_at = 0.0
+
+    def shard(self, user_id: int) -> PostgresShard:
+        return self.shards[shard_index(user_id, len(self.shards))]
+
+    def init(self) -> bool:
+        shard = self.shards[0]
+        with shard.lock:
+            conn = shard.connection()
+            # Таблица могла появиться раньше последовательности версий: проверяются обе
+            table, sequence = conn.execute(
+                "SELECT to_regclass('favorites'), to_regclass('favorites_version_seq')"
+            ).fetchone()
+            if table and sequence:
+                return False
+            with conn.transaction():
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS favorites (
+                        id BIGSERIAL PRIMARY KEY,
+                        user_id BIGINT NOT NULL,
+                        movie_id BIGINT NOT NULL,
+                        movie_name TEXT NOT NULL,
+                        movie_type TEXT NOT NULL,
+                        movie_data TEXT,
+                        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        UNIQUE (user_id, movie_id)
+                    )
+                ''')
+                conn.execute('CREATE SEQUENCE IF NOT EXISTS favorites_version_seq')
+            return True
+
+    def _bump(self, conn):
+        version = conn.execute("SELECT nextval('favorites_version_seq')").fetchone()[0]
+        self._versions.own(version)
+
+    def external_changes(self, shard: PostgresShard) -> Optional[Set[int]]:
+        now = time.monotonic()
+        with self._checked_lock:
+            if self._versions.initialized and now - self._checked_at < self.check_interval:
+                return None
+            self._checked_at = now
+        last = shard.connection().execute('''
+            SELECT CASE WHEN is_called THEN last_value ELSE last_value - 1 END
+            FROM favorites_version_seq
+        ''').fetchone()[0]
+        foreign = self._versions.check(last)
+        return {s.index for s in self.shards} if foreign else None
+
+    def load_ids(self, shard: PostgresShard, user_id: int) -> Set[int]:
+        rows = shard.connection().execute('SELECT movie_id FROM favorites WHERE user_id = %s', (user_id,))
+        return {row[0] for row in rows}
+
+    def insert_raw(self, shard: PostgresShard, rows: Iterable[RawRow]):
+        conn = shard.connection()
+        with conn.transaction():
+            with conn.cursor() as cur:
+                cur.executemany('''
+                    INSERT INTO favorites (user_id, movie_id, movie_name, movie_type, movie_data, added_at)
+                    VALUES (%s, %s, %s, %s, %s, COALESCE(%s::timestamp, CURRENT_TIMESTAMP))
+                    ON CONFLICT (user_id, movie_id) DO UPDATE SET
+                        movie_name = EXCLUDED.movie_name, movie_type = EXCLUDED.movie_type,
+                        movie_data = EXCLUDED.movie_data, added_at = EXCLUDED.added_at
+                ''', rows)
+            self._bump(conn)
+
+    def apply(self, shard: PostgresShard, rows: Iterable[Row], removals: List[Tuple[int, int]]) -> int:
+        conn = shard.connection()
+        removed = 0
+        with conn.transaction():
+            with conn.cursor() as cur:
+                rows = list(rows)
+                if rows:
+                    cur.executemany('''
+                        INSERT INTO favorites (user_id, movie_id, movie_name, movie_type, movie_data)
+                        VALUES (%s, %s, %s, %s, %s)
+                        ON CONFLICT (user_id, movie_id) DO UPDATE SET
+                            movie_name = EXCLUDED.movie_name, movie_type = EXCLUDED.movie_type,
+                            movie_data = EXCLUDED.movie_data, added_at = CURRENT_TIMESTAMP
+                    ''', rows)
+                if removals:
+                    cur.execute('''
+                        DELETE FROM favorites f
+                        USING unnest(%s::bigint[], %s::bigint[]) AS r(user_id, movie_id)
+                        WHERE f.user_id = r.user_id AND f.movie_id = r.movie_id
+                    ''', ([u for u, _ in removals], [m for _, m in removals]))
+                    removed = cur.rowcount
+            self._bump(conn)
+        return removed
+
+    def list_docs(self, user_id: int, limit: int) -> List[str]:
+        shard = self.shard(user_id)
+        with shard.lock:
+            rows = shard.connection().execute('''
+                SELECT movie_data FROM favorites
+                WHERE user_id = %s
+                ORDER BY added_at DESC
+                LIMIT %s
+            ''', (user_id, limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def _iter_query(self, query: str, params: tuple, batch_size: int) -> Iterator[tuple]:
+        """Серверный курсор на отдельном соединении: выгрузка не держит блокировку шарда"""
+        import psycopg
+        with psycopg.connect(self.dsn) as conn:
+            with conn.cursor(name='favorites_export') as cur:
+                cur.itersize = batch_size
+                cur.execute(query, params)
+                yield from cur
+
+    def iter_docs(self, user_id: int, batch_size: int) -> Iterator[str]:
+        for row in self._iter_query('''
+            SELECT movie_data FROM favorites WHERE user_id = %s ORDER BY added_at, id
+        ''', (user_id,), batch_size):
+            yield row[0]
+
+    def iter_rows(self, batch_size: int = 1000) -> Iterator[RawRow]:
+        for row in self._iter_query('''
+            SELECT user_id, movie_id, movie_name, movie_type, movie_data, added_at::text
+            FROM favorites ORDER BY user_id, id
+        ''', (), batch_size):
+            yield tuple(row)
+
+    def count(self) -> int:
+        shard = self.shards[0]
+        with shard.lock:
+            return shard.connection().execute('SELECT COUNT(*) FROM favorites').fetchone()[0]
+
+    def close(self):
+        for shard in self.shards:
+            with shard.lock:
+                shard.close()
+
+
+def open_backend(kind: str, db_name: str, shards: int = 4, dsn: str = '', connections: int = 4,
+                 check_interval: float = 0.1):
+    """Хранилище по названию: sqlite, sharded или postgres"""
+    if kind == 'sqlite':
+        return SQLiteBackend([db_name], check_interval=check_interval)
+    if kind == 'sharded':
+        return SQLiteBackend(shard_paths(db_name, shards), wal=True, check_interval=check_interval)
+    if kind == 'postgres':
+        if not dsn:
+            raise RuntimeError("Для FAVORITES_BACKEND=postgres задайте FAVORITES_POSTGRES_DSN")
+        return PostgresBackend(dsn, connections, check_interval=check_interval)
+    raise ValueError(f"Неизвестное хранилище избранного: {kind}")
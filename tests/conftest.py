@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+@pytest.fixture
+def favorites_db(tmp_path, monkeypatch):
+    """Избранное во временном файле SQLite, проверка чужих записей без интервала"""
+    monkeypatch.setattr(database, 'DB_NAME', str(tmp_path / 'favorites.db'))
+    monkeypatch.setattr(database, 'FAVORITES_BACKEND', 'sqlite')
+    monkeypatch.setattr(database, 'FAVORITES_CACHE_CHECK_MS', 0)
+    monkeypatch.setattr(database, 'FAVORITES_WRITE_BEHIND', False)
+    database.init_database()
+    yield database.DB_NAME
+    database.close_database()
+    with database._backend_lock:
+        if database._backend is not None:
+            database._backend.close()
+            database._backend = None
+            database._backend_key = None
+    database._clear_cache()
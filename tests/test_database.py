@@ -0,0 +1,46 @@
+import sqlite3
+
+import database
+
+
+def _movie(movie_id):
+    return {'id': movie_id, 'name': f'Фильм {movie_id}', 'type': 'movie', 'year': 2000}
+
+
+def test_own_writes_update_cache(favorites_db):
+    assert database.get_favorite_ids(1) == set()
+    assert database.add_to_favorites(1, _movie(10))
+    assert database.is_in_favorites(1, 10)
+    assert database.remove_from_favorites(1, 10)
+    assert database.get_favorite_ids(1) == set()
+
+
+def test_commit_from_other_connection_invalidates_cache(favorites_db):
+    database.add_to_favorites(1, _movie(10))
+    assert database.get_favorite_ids(1) == {10}
+
+    # Другой процесс (бот или веб-сервер) пишет в тот же файл своим соединением
+    other = sqlite3.connect(favorites_db)
+    with other:
+        other.execute('''
+            INSERT INTO favorites (user_id, movie_id, movie_name, movie_type, movie_data)
+            VALUES (1, 20, 'Фильм 20', 'movie', '{}')
+        ''')
+        other.execute('DELETE FROM favorites WHERE user_id = 1 AND movie_id = 10')
+    other.close()
+
+    assert database.get_favorite_ids(1) == {20}
+    assert database.is_in_favorites(1, 20)
+    assert not database.is_in_favorites(1, 10)
+    assert database.get_favorites_count(1) == 1
+
+
+def test_own_commits_keep_cache(favorites_db, monkeypatch):
+    database.add_to_favorites(1, _movie(10))
+    database.get_favorite_ids(1)
+    cleared = []
+    monkeypatch.setattr(database, '_clear_cache', lambda *args: cleared.append(args))
+
+    database.add_to_favorites(1, _movie(11))
+    assert database.get_favorite_ids(1) == {10, 11}
+    assert cleared == []
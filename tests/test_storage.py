@@ -0,0 +1,65 @@
+import storage
+from storage import VersionTracker
+
+
+def test_first_check_only_sets_baseline():
+    versions = VersionTracker()
+    assert not versions.initialized
+    assert not versions.check(5)
+    assert versions.initialized
+
+
+def test_own_versions_are_not_foreign():
+    versions = VersionTracker()
+    versions.check(5)
+    versions.own(6)
+    versions.own(7)
+    assert not versions.check(7)
+    assert not versions.check(7)
+
+
+def test_foreign_version_between_own():
+    versions = VersionTracker()
+    versions.check(5)
+    versions.own(6)
+    versions.own(8)
+    # 7 выдана другому процессу
+    assert versions.check(8)
+
+
+def test_own_version_after_read_counts_once():
+    versions = VersionTracker()
+    versions.check(5)
+    versions.own(6)
+    # Последовательность прочитана до своей записи 7, проверка - после нее
+    assert not versions.check(6)
+    versions.own(7)
+    assert not versions.check(7)
+    versions.own(8)
+    assert versions.check(9)
+
+
+def test_own_version_older_than_seen_is_ignored():
+    versions = VersionTracker()
+    versions.check(10)
+    # nextval до первой проверки уже учтен в ней
+    versions.own(9)
+    assert versions.check(11)
+
+
+def test_sqlite_backend_reports_only_foreign_commits(tmp_path):
+    path = str(tmp_path / 'favorites.db')
+    ours = storage.SQLiteBackend([path], check_interval=0)
+    theirs = storage.SQLiteBackend([path], check_interval=0)
+    try:
+        ours.init()
+        shard = ours.shards[0]
+        assert ours.external_changes(shard) is None
+        ours.apply(shard, [(1, 10, 'Фильм', 'movie', '{}')], [])
+        assert ours.external_changes(shard) is None
+        theirs.apply(theirs.shards[0], [(1, 20, 'Фильм', 'movie', '{}')], [])
+        assert ours.external_changes(shard) == {0}
+        assert ours.load_ids(shard, 1) == {10, 20}
+    finally:
+        ours.close()
+        theirs.close()
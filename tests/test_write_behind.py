@@ -0,0 +1,68 @@
+import json
+import os
+
+import pytest
+
+import storage
+from write_behind import WriteBehind
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = storage.SQLiteBackend([str(tmp_path / 'favorites.db')], check_interval=0)
+    backend.init()
+    yield backend
+    backend.close()
+
+
+def _record(user_id, movie_id, removed=False):
+    row = None if removed else [user_id, movie_id, f'Фильм {movie_id}', 'movie', '{}']
+    return json.dumps({'u': user_id, 'm': movie_id, 'r': row}, ensure_ascii=False)
+
+
+def test_replay_after_crash_mid_segment(tmp_path, backend):
+    directory = tmp_path / 'journal'
+    directory.mkdir()
+    backend.apply(backend.shards[0], [(1, 5, 'Фильм 5', 'movie', '{}')], [])
+    # Процесс упал, не дописав последнюю строку второго файла журнала
+    (directory / 'web.000001.journal').write_text(
+        _record(1, 10) + '\n' + _record(1, 5, removed=True) + '\n', encoding='utf-8')
+    (directory / 'web.000002.journal').write_text(
+        _record(2, 20) + '\n' + _record(1, 10, removed=True) + '\n' + _record(3, 30)[:15], encoding='utf-8')
+
+    journal = WriteBehind(lambda: backend, str(directory), 'web', flush_interval=60)
+    journal.start()
+    try:
+        shard = backend.shards[0]
+        assert backend.load_ids(shard, 1) == set()
+        assert backend.load_ids(shard, 2) == {20}
+        assert backend.load_ids(shard, 3) == set()
+        assert sorted(p.name for p in directory.glob('*.journal')) == ['web.000003.journal']
+    finally:
+        journal.close()
+
+
+def test_logged_changes_survive_restart(tmp_path, backend):
+    directory = str(tmp_path / 'journal')
+    journal = WriteBehind(lambda: backend, directory, 'bot', flush_interval=60, sync='interval')
+    journal.start()
+    journal.log(1, [(1, 10, 'Фильм 10', 'movie', '{}')], [])
+    journal.wait(journal.log(1, [(1, 11, 'Фильм 11', 'movie', '{}')], [10]))
+    assert journal.has_pending(1)
+    # Без close: журнал остается на диске, как после падения процесса
+    journal._stop.set()
+    journal._thread.join()
+    os.close(journal._fd)
+    os.close(journal._lock_fd)
+
+    restarted = WriteBehind(lambda: backend, directory, 'bot', flush_interval=60)
+    restarted.start()
+    try:
+        assert backend.load_ids(backend.shards[0], 1) == {11}
+    finally:
+        restarted.close()
+
+
+def test_unknown_sync_mode_is_rejected(tmp_path, backend):
+    with pytest.raises(ValueError):
+        WriteBehind(lambda: backend, str(tmp_path), 'bot', sync='never')
@@ -1,27 +1,88 @@
 """
 Веб-сервер для мини-приложения и API
+
+aiohttp, kinopoisk_api, posters (Pillow) и feed импортируются внутри API-маршрутов: для
+отдачи статики они не нужны, а их импорт заметно удлиняет холодный старт.
 """
-from flask import Flask, send_from_directory, jsonify, request
+import time
+
+_STARTED = time.perf_counter()
+
+from flask import Flask, send_from_directory, jsonify, request, g, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-import aiohttp
-import asyncio
 import os
-from kinopoisk_api import get_popular_movies, get_popular_tv, get_movie_by_id
-from database import get_favorites, add_to_favorites, is_in_favorites
+import gzip
+import hashlib
+import json_codec
+import metrics
+import profiling
+from assets import IMMUTABLE, StaticAssets
+from config import COMPRESS_MIN_BYTES, METRICS_HOST, WEB_METRICS_PORT
+from database import (
+    init_database, get_favorites, add_to_favorites, is_in_favorites,
+    check_favorites, add_many_to_favorites, remove_many_from_favorites, iter_favorites_json
+)
 import random
 import logging
+from typing import Dict, List, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """jsonify и request.json через json_codec (orjson, если установлен)"""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return json_codec.dumps(obj, default=self.default)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return json_codec.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Аргументы как у jsonify: один объект, несколько позиционных (список) или именованные
+        if args and kwargs:
+            raise TypeError("jsonify() принимает либо позиционные, либо именованные аргументы")
+        if len(args) == 1:
+            obj = args[0]
+        else:
+            obj = list(args) or kwargs or None
+        return self._app.response_class(json_codec.dumpb(obj, default=self.default) + b'\n',
+                                        mimetype=self.mimetype)
+
 
-app = Flask(__name__, static_folder='webapp', static_url_path='')
+# Встроенный static-маршрут Flask отключен: статику отдает serve_static
+app = Flask(__name__, static_folder=None)
+app.json = CodecJSONProvider(app)
 CORS(app)
 
 logger = logging.getLogger(__name__)
 
+startup = metrics.StartupTimer('web', _STARTED)
+startup.mark('imports')
+
 # Кэш для очереди фильмов
 movies_cache = []
 
+# Максимум id в одном запросе check_favorites, add_favorites и remove_favorites
+MAX_CHECK_IDS = 200
+# Фильмов в одной транзакции при импорте избранного
+IMPORT_BATCH = 500
+
+# Собранная статика мини-приложения (python assets.py)
+static_assets = StaticAssets()
+
 
 def run_async(coro):
     """Запустить асинхронную функцию"""
+    import asyncio
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     try:
@@ -30,16 +91,130 @@ def run_async(coro):
         loop.close()
 
 
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+    if startup is not None:
+        _report_first_request()
+    if profiling.ENABLED:
+        route = request.url_rule.rule if request.url_rule else request.path
+        g.profile_token = profiling.start(route, request.args.get('user_id', type=int))
+
+
+def _report_first_request():
+    global startup
+    timer, startup = startup, None
+    if timer is not None:
+        timer.report('first_request')
+
+
+@app.teardown_request
+def _finish_profile(exc=None):
+    profiling.finish(g.pop('profile_token', None))
+
+
+@app.after_request
+def _record_request(response):
+    """Записать время обработки запроса в метрики"""
+    start = getattr(g, 'request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - start,
+                        route=route, method=request.method, status=response.status_code)
+    return response
+
+
+def _negotiate_encoding() -> Optional[str]:
+    """Лучшее поддерживаемое клиентом сжатие (br, gzip) или None"""
+    accepted = {part.split(';')[0].strip()
+                for part in request.headers.get('Accept-Encoding', '').lower().split(',')}
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+@app.after_request
+def _compress_json(response):
+    """Сжатие JSON-ответов больше порога COMPRESS_MIN_BYTES"""
+    if (response.mimetype != 'application/json'
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.status_code < 200 or response.status_code == 304):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    encoding = _negotiate_encoding()
+    if encoding is None or len(body) < COMPRESS_MIN_BYTES:
+        return response
+    if encoding == 'br':
+        response.set_data(brotli.compress(body, quality=4))
+    else:
+        response.set_data(gzip.compress(body, compresslevel=5))
+    response.headers['Content-Encoding'] = encoding
+    # У сжатого представления свой сильный ETag
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f"{etag}-{encoding}")
+    return response
+
+
+def cacheable_json(payload: dict):
+    """
+    JSON-ответ с сильным ETag: при совпадении If-None-Match возвращается 304 без тела.
+    Сжатый вариант получает ETag с суффиксом кодировки (см. _compress_json).
+    Cache-Control: no-cache - браузер хранит ответ и сам перепроверяет его по ETag,
+    скрипту не нужно отправлять If-None-Match (с ним запрос с другого домена
+    потребовал бы preflight). Не подходит для ответов со случайным содержимым.
+    """
+    response = jsonify(payload)
+    body = response.get_data()
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    encoding = _negotiate_encoding()
+    if encoding and len(body) >= COMPRESS_MIN_BYTES:
+        current = f"{etag}-{encoding}"
+    else:
+        current = etag
+    if request.if_none_match.contains(current):
+        response = Response(status=304)
+        response.vary.add('Accept-Encoding')
+        response.set_etag(current)
+    else:
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def asset_response(name: str) -> Optional[Response]:
+    """Ответ с собранным файлом из памяти (с учетом Accept-Encoding и If-None-Match)"""
+    static_assets.ensure_loaded()
+    asset = static_assets.get(name, request.headers.get('Accept-Encoding', ''))
+    if asset is None:
+        return None
+    body, encoding, etag = asset
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype=StaticAssets.mimetype(name))
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = StaticAssets.cache_control(name)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
 @app.route('/')
 def index():
     """Главная страница мини-приложения"""
-    return send_from_directory('webapp', 'index.html')
+    return asset_response('index.html') or send_from_directory('webapp', 'index.html')
 
 
 @app.route('/<path:path>')
 def serve_static(path):
     """Отдача статических файлов"""
-    return send_from_directory('webapp', path)
+    return asset_response(path) or send_from_directory('webapp', path)
 
 
 @app.route('/api/get_movie')
@@ -48,6 +223,9 @@ def api_get_movie():
     try:
         user_id = request.args.get('user_id', type=int)
         
+        import aiohttp
+        from kinopoisk_api import get_popular_movies
+        
         async def _get_movie():
             async with aiohttp.ClientSession() as session:
                 # Получаем популярные фильмы
@@ -72,12 +250,15 @@ def api_get_popular():
         media_type = request.args.get('type', 'movie')
         limit = request.args.get('limit', 10, type=int)
         
+        import aiohttp
+        from kinopoisk_api import get_popular_movies, get_popular_tv
+        
         async def _get_popular():
             async with aiohttp.ClientSession() as session:
                 if media_type == 'movie':
-                    data = await get_popular_movies(session, page=random.randint(1, 10))
+                    data = await get_popular_movies(session, page=random.randint(1, 10), docs_limit=limit)
                 else:
-                    data = await get_popular_tv(session, page=random.randint(1, 10))
+                    data = await get_popular_tv(session, page=random.randint(1, 10), docs_limit=limit)
                 
                 if data and data.get('docs'):
                     movies = data['docs'][:limit]
@@ -85,12 +266,94 @@ def api_get_popular():
                 return {'success': False, 'message': 'Фильмы не найдены'}
         
         result = run_async(_get_popular())
+        # Страница выбирается случайно - ETag почти никогда не совпал бы
         return jsonify(result)
     except Exception as e:
         logger.error(f"Ошибка API get_popular: {e}")
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+@app.route('/api/poster')
+def api_poster():
+    """
+    Постер нужной ширины (w) через кэш posters.py: WebP, если браузер его принимает, иначе JPEG.
+    Без src или при ошибке загрузки - SVG-заглушка с названием (title).
+    """
+    import posters
+    
+    src = request.args.get('src', '')
+    width = request.args.get('w', 0, type=int)
+    fmt = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+    result = posters.poster_cache.get(src, width, fmt) if src and posters.allowed(src) else None
+    if result is None:
+        response = Response(posters.placeholder_svg(request.args.get('title', '')), mimetype='image/svg+xml')
+        # Заглушку вместо недоступного постера браузер перепроверит позже
+        response.headers['Cache-Control'] = IMMUTABLE if not src else 'public, max-age=300'
+        return response
+    body, mimetype = result
+    response = Response(body, mimetype=mimetype)
+    response.headers['Cache-Control'] = IMMUTABLE
+    response.vary.add('Accept')
+    return response
+
+
+def _fetch_feed_page(page: int) -> List[Dict]:
+    """Страница популярных фильмов - кандидаты для ленты"""
+    import aiohttp
+    from kinopoisk_api import get_popular_movies
+    
+    async def _fetch():
+        async with aiohttp.ClientSession() as session:
+            return await get_popular_movies(session, page=page)
+    
+    try:
+        data = run_async(_fetch())
+        return (data or {}).get('docs') or []
+    except Exception as e:
+        logger.error(f"Ошибка загрузки кандидатов ленты: {e}")
+        return []
+
+
+@app.route('/api/feed')
+def api_feed():
+    """Лента карточек (Server-Sent Events): следующие фильмы приходят заранее, по одному на свайп"""
+    import feed
+    
+    user_id = request.args.get('user_id', type=int)
+    if not user_id:
+        return jsonify({'success': False, 'message': 'user_id required'}), 400
+    stream = feed.streams.open(user_id, _fetch_feed_page)
+    if stream is None:
+        return jsonify({'success': False, 'message': 'Too many feed streams'}), 503
+    response = Response(stream_with_context(feed.streams.events(stream)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # nginx и похожие прокси не должны буферизовать поток
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/api/feed/swipe', methods=['POST'])
+def api_feed_swipe():
+    """
+    Свайп карточки из ленты: {"stream": id потока, "movie_id": id, "action": "like" | "skip"}.
+    Отправляется через navigator.sendBeacon, поэтому тело читается как JSON при любом Content-Type.
+    """
+    import feed
+    
+    try:
+        data = json_codec.loads(request.get_data())
+    except ValueError:
+        return jsonify({'success': False, 'message': 'invalid JSON'}), 400
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': 'invalid JSON'}), 400
+    stream = feed.streams.get(data.get('stream'))
+    if stream is None:
+        return jsonify({'success': False, 'message': 'stream not found'}), 404
+    if not stream.report(data.get('movie_id'), data.get('action')):
+        return jsonify({'success': False, 'message': 'unknown movie or action'}), 400
+    return '', 204
+
+
 @app.route('/api/get_favorites', methods=['GET'])
 def api_get_favorites():
     """Получить избранное пользователя"""
@@ -102,7 +365,7 @@ def api_get_favorites():
         
         favorites = get_favorites(user_id)
         
-        return jsonify({
+        return cacheable_json({
             'success': True,
             'favorites': favorites
         })
@@ -143,7 +406,7 @@ def api_check_favorite():
         
         is_fav = is_in_favorites(user_id, movie_id)
         
-        return jsonify({
+        return cacheable_json({
             'success': True,
             'is_favorite': is_fav
         })
@@ -152,10 +415,166 @@ def api_check_favorite():
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+@app.route('/api/check_favorites', methods=['GET'])
+def api_check_favorites():
+    """Проверить сразу несколько фильмов: movie_ids=1,2,3"""
+    try:
+        user_id = request.args.get('user_id', type=int)
+        raw_ids = request.args.get('movie_ids', '')
+        
+        try:
+            movie_ids = [int(x) for x in raw_ids.split(',') if x.strip()]
+        except ValueError:
+            return jsonify({'success': False, 'message': 'movie_ids must be integers'}), 400
+        if not user_id or not movie_ids:
+            return jsonify({'success': False, 'message': 'user_id and movie_ids required'}), 400
+        if len(movie_ids) > MAX_CHECK_IDS:
+            return jsonify({'success': False, 'message': f'at most {MAX_CHECK_IDS} movie_ids'}), 400
+        
+        favorite_ids = check_favorites(user_id, movie_ids)
+        
+        return cacheable_json({
+            'success': True,
+            'favorites': {str(movie_id): movie_id in favorite_ids for movie_id in movie_ids}
+        })
+    except Exception as e:
+        logger.error(f"Ошибка API check_favorites: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+def _is_id(value) -> bool:
+    """Положительный целый id (bool не считается числом)"""
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+@app.route('/api/add_favorites', methods=['POST'])
+def api_add_favorites():
+    """Добавить несколько фильмов в избранное одной транзакцией"""
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'success': False, 'message': 'JSON object required'}), 400
+        user_id = data.get('user_id')
+        movies = data.get('movies')
+        
+        if not _is_id(user_id) or not movies:
+            return jsonify({'success': False, 'message': 'user_id and movies required'}), 400
+        if not isinstance(movies, list) or not all(isinstance(m, dict) and _is_id(m.get('id')) for m in movies):
+            return jsonify({'success': False, 'message': 'movies must be objects with integer id'}), 400
+        if len(movies) > MAX_CHECK_IDS:
+            return jsonify({'success': False, 'message': f'at most {MAX_CHECK_IDS} movies'}), 400
+        
+        added = add_many_to_favorites(user_id, movies)
+        if added is None:
+            return jsonify({'success': False, 'message': 'Failed to add to favorites'}), 500
+        return jsonify({'success': True, 'added': added})
+    except Exception as e:
+        logger.error(f"Ошибка API add_favorites: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@app.route('/api/remove_favorites', methods=['POST'])
+def api_remove_favorites():
+    """Удалить несколько фильмов из избранного одной транзакцией"""
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'success': False, 'message': 'JSON object required'}), 400
+        user_id = data.get('user_id')
+        movie_ids = data.get('movie_ids')
+        
+        if not _is_id(user_id) or not movie_ids:
+            return jsonify({'success': False, 'message': 'user_id and movie_ids required'}), 400
+        if not isinstance(movie_ids, list) or not all(_is_id(movie_id) for movie_id in movie_ids):
+            return jsonify({'success': False, 'message': 'movie_ids must be a list of integers'}), 400
+        if len(movie_ids) > MAX_CHECK_IDS:
+            return jsonify({'success': False, 'message': f'at most {MAX_CHECK_IDS} movie_ids'}), 400
+        
+        removed = remove_many_from_favorites(user_id, movie_ids)
+        if removed is None:
+            return jsonify({'success': False, 'message': 'Failed to remove from favorites'}), 500
+        return jsonify({'success': True, 'removed': removed})
+    except Exception as e:
+        logger.error(f"Ошибка API remove_favorites: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@app.route('/api/export_favorites', methods=['GET'])
+def api_export_favorites():
+    """Выгрузить все избранное в NDJSON (по фильму на строку), потоком"""
+    user_id = request.args.get('user_id', type=int)
+    if not user_id:
+        return jsonify({'success': False, 'message': 'user_id required'}), 400
+    
+    def generate():
+        for line in iter_favorites_json(user_id):
+            yield line + '\n'
+    
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename="favorites_{user_id}.ndjson"'
+    return response
+
+
+@app.route('/api/import_favorites', methods=['POST'])
+def api_import_favorites():
+    """
+    Загрузить избранное из NDJSON (тело запроса, по фильму на строку).
+    Тело читается потоком, фильмы записываются пачками по IMPORT_BATCH.
+    """
+    try:
+        user_id = request.args.get('user_id', type=int)
+        if not _is_id(user_id):
+            return jsonify({'success': False, 'message': 'user_id required'}), 400
+        
+        imported = 0
+        skipped = 0
+        batch = []
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                movie = json_codec.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            if not isinstance(movie, dict) or not _is_id(movie.get('id')):
+                skipped += 1
+                continue
+            batch.append(movie)
+            if len(batch) >= IMPORT_BATCH:
+                added = add_many_to_favorites(user_id, batch)
+                if added is None:
+                    return jsonify({'success': False, 'message': 'Failed to import favorites',
+                                    'imported': imported}), 500
+                imported += added
+                batch = []
+        if batch:
+            added = add_many_to_favorites(user_id, batch)
+            if added is None:
+                return jsonify({'success': False, 'message': 'Failed to import favorites',
+                                'imported': imported}), 500
+            imported += added
+        
+        return jsonify({'success': True, 'imported': imported, 'skipped': skipped})
+    except Exception as e:
+        logger.error(f"Ошибка API import_favorites: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
 if __name__ == '__main__':
     # Получаем порт из переменной окружения (для Render, Heroku и др.)
     # Если не установлена, используем 5000 по умолчанию
     port = int(os.environ.get('PORT', 5000))
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    init_database('web')
+    startup.mark('init_database')
+    if WEB_METRICS_PORT:
+        metrics.start_metrics_server(WEB_METRICS_PORT, METRICS_HOST)
+    startup.report('ready')
     # Для запуска на локальной машине или на сервере
     app.run(host='0.0.0.0', port=port, debug=False)
 
@@ -6,6 +6,30 @@ tg.expand();
 // API URL (замените на ваш домен)
 const API_URL = 'https://service-production-25ac.up.railway.app/api';  // Замените на ваш URL
 
+// Постеры загружаются через прокси веб-сервера: уменьшенные копии в WebP/JPEG,
+// нужную ширину браузер выбирает по srcset (ширина карточки - до 400px)
+const POSTER_WIDTHS = [240, 360, 480, 720];
+const POSTER_SIZES = '(max-width: 400px) 100vw, 400px';
+
+function posterSrc(url, width) {
+    return `${API_URL}/poster?src=${encodeURIComponent(url)}&w=${width}`;
+}
+
+function posterSrcset(url) {
+    return POSTER_WIDTHS.map(w => `${posterSrc(url, w)} ${w}w`).join(', ');
+}
+
+function placeholderSrc(title) {
+    return `${API_URL}/poster?title=${encodeURIComponent(title)}`;
+}
+
+// Лента (Server-Sent Events): сервер присылает следующие карточки заранее,
+// по одной на каждый свайп; свайпы отправляются через sendBeacon без ожидания ответа
+const FEED_WAIT_MS = 1500;
+let feedSource = null;
+let feedStream = null;
+let cardWaiter = null;
+
 // Состояние приложения
 let currentMovie = null;
 let viewedCount = 0;
@@ -42,6 +66,66 @@ let currentX = 0;
 let currentY = 0;
 let isDragging = false;
 
+// Загрузить постер карточки заранее (браузер выберет ширину по srcset)
+function prefetchPoster(movie) {
+    const posterUrl = movie.poster?.url || movie.poster?.previewUrl;
+    if (!posterUrl) return;
+    const img = new Image();
+    img.sizes = POSTER_SIZES;
+    img.srcset = posterSrcset(posterUrl);
+    img.src = posterSrc(posterUrl, 360);
+}
+
+function openFeed() {
+    if (feedSource) feedSource.close();
+    feedSource = null;
+    feedStream = null;
+    if (!window.EventSource || !userId) return;
+    
+    feedSource = new EventSource(`${API_URL}/feed?user_id=${userId}`);
+    feedSource.addEventListener('hello', (e) => {
+        feedStream = JSON.parse(e.data).stream;
+    });
+    feedSource.addEventListener('card', (e) => {
+        const movie = JSON.parse(e.data).movie;
+        moviesQueue.push(movie);
+        prefetchPoster(movie);
+        if (cardWaiter) cardWaiter();
+    });
+    feedSource.addEventListener('empty', () => {
+        if (cardWaiter) cardWaiter();
+    });
+    feedSource.onerror = () => {
+        // EventSource переподключится сам; до нового hello свайпы не отправляются
+        feedStream = null;
+        if (cardWaiter) cardWaiter();
+    };
+}
+
+function waitForCard(ms) {
+    return new Promise(resolve => {
+        const timer = setTimeout(() => {
+            cardWaiter = null;
+            resolve();
+        }, ms);
+        cardWaiter = () => {
+            clearTimeout(timer);
+            cardWaiter = null;
+            resolve();
+        };
+    });
+}
+
+function reportSwipe(action) {
+    if (!feedStream || !currentMovie?.id) return;
+    const body = JSON.stringify({ stream: feedStream, movie_id: currentMovie.id, action });
+    if (navigator.sendBeacon) {
+        navigator.sendBeacon(`${API_URL}/feed/swipe`, body);
+    } else {
+        fetch(`${API_URL}/feed/swipe`, { method: 'POST', body, keepalive: true }).catch(() => {});
+    }
+}
+
 // Создать индикатор свайпа
 const swipeIndicator = document.createElement('div');
 swipeIndicator.className = 'swipe-indicator';
@@ -53,6 +137,11 @@ async function loadMovie() {
         loading.style.display = 'block';
         movieContent.style.display = 'none';
         
+        // Следующая карточка ленты обычно уже в очереди; если нет - ждем ее недолго
+        if (moviesQueue.length === 0 && feedSource) {
+            await waitForCard(FEED_WAIT_MS);
+        }
+        
         // Если очередь пуста, загружаем новые фильмы
         if (moviesQueue.length === 0) {
             const response = await fetch(`${API_URL}/get_movie?user_id=${userId}`);
@@ -108,13 +197,18 @@ function displayMovie(movie) {
     
     description.textContent = desc;
     
+    poster.onerror = function() {
+        this.onerror = null;
+        this.removeAttribute('srcset');
+        this.src = placeholderSrc(name);
+    };
     if (posterUrl) {
-        poster.src = posterUrl;
-        poster.onerror = function() {
-            this.src = 'https://via.placeholder.com/400x600?text=No+Poster';
-        };
+        poster.sizes = POSTER_SIZES;
+        poster.srcset = posterSrcset(posterUrl);
+        poster.src = posterSrc(posterUrl, 360);
     } else {
-        poster.src = 'https://via.placeholder.com/400x600?text=No+Poster';
+        poster.removeAttribute('srcset');
+        poster.src = placeholderSrc(name);
     }
     
     currentMovie = movie;
@@ -123,6 +217,7 @@ function displayMovie(movie) {
 // Добавить в избранное
 async function addToFavorites() {
     if (!currentMovie) return;
+    reportSwipe('like');
     
     try {
         const response = await fetch(`${API_URL}/add_favorite`, {
@@ -151,6 +246,7 @@ async function addToFavorites() {
 
 // Пропустить фильм
 function skipMovie() {
+    reportSwipe('skip');
     loadMovie();
 }
 
@@ -263,6 +359,7 @@ dislikeBtn.addEventListener('click', skipMovie);
 favoritesBtn.addEventListener('click', loadFavorites);
 refreshBtn.addEventListener('click', () => {
     moviesQueue = [];
+    openFeed();
     loadMovie();
 });
 closeModal.addEventListener('click', () => {
@@ -270,6 +367,7 @@ closeModal.addEventListener('click', () => {
 });
 
 // Инициализация
+openFeed();
 loadMovie();
 updateStats();
 
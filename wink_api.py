@@ -1,41 +1,148 @@
 """
 Модуль для работы с Wink (поиск фильмов на стриминговом сервисе)
+
+Если задан WINK_API_URL, WinkResolver проверяет, есть ли фильм на Wink:
+запросы идут параллельно (не больше WINK_CONCURRENCY одновременно), одинаковые
+запросы объединяются, найденные и ненайденные результаты кэшируются с разным
+сроком жизни. Без WINK_API_URL используется ссылка на поиск Wink.
 """
+from __future__ import annotations
+
+import asyncio
 import logging
-import aiohttp
-from typing import Optional, Dict
-from config import WINK_SEARCH_URL
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Tuple, TYPE_CHECKING
+from config import (
+    WINK_SEARCH_URL, WINK_API_URL, WINK_CONCURRENCY, WINK_POSITIVE_TTL_SEC,
+    WINK_NEGATIVE_TTL_SEC, WINK_TIMEOUT_SEC, WINK_CACHE_SIZE
+)
 import urllib.parse
+import json_codec
+import metrics
+
+if TYPE_CHECKING:
+    # только для аннотаций
+    import aiohttp
 
 logger = logging.getLogger(__name__)
 
 
-async def search_wink(session: aiohttp.ClientSession, query: str) -> Optional[str]:
-    """
-    Поиск фильма/сериала на Wink
-    Возвращает URL для поиска на Wink
-    """
-    try:
-        # Кодируем запрос для URL
-        encoded_query = urllib.parse.quote(query)
-        wink_search_url = f"{WINK_SEARCH_URL}/search?q={encoded_query}"
-        return wink_search_url
-    except Exception as e:
-        logger.error(f"Error creating Wink search URL: {e}")
-        return None
+def wink_search_url(movie_name: str) -> str:
+    """Ссылка на поиск фильма/сериала на Wink"""
+    return f"{WINK_SEARCH_URL}/search?q={urllib.parse.quote(movie_name)}"
+
+
+def _normalize(name: str) -> str:
+    return ' '.join(name.casefold().replace('ё', 'е').split())
+
+
+def _match(items, movie_name: str, year: Optional[int]) -> Optional[str]:
+    """Ссылка на первый результат поиска Wink с тем же названием (и годом, если он известен)"""
+    wanted = _normalize(movie_name)
+    for item in items:
+        if _normalize(item.get('name') or '') != wanted:
+            continue
+        if year and item.get('year') and item['year'] != year:
+            continue
+        if item.get('url'):
+            return item['url']
+        if item.get('id'):
+            return f"{WINK_SEARCH_URL}/media_items/{item['id']}"
+    return None
+
+
+class WinkResolver:
+    """Проверка наличия фильмов на Wink с ограничением параллельности и кэшем"""
+
+    def __init__(self, api_url: str = WINK_API_URL, concurrency: int = WINK_CONCURRENCY,
+                 positive_ttl: float = WINK_POSITIVE_TTL_SEC, negative_ttl: float = WINK_NEGATIVE_TTL_SEC,
+                 timeout: float = WINK_TIMEOUT_SEC, max_entries: int = WINK_CACHE_SIZE):
+        self.api_url = api_url.rstrip('/')
+        self.concurrency = concurrency
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.max_entries = max_entries
+        # (название, год) -> (истекает, ссылка или None)
+        self._cache: "OrderedDict[Tuple[str, Optional[int]], Tuple[float, Optional[str]]]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, Optional[int]], asyncio.Future] = {}
+        # Семафор и сессия привязаны к циклу событий, в котором созданы
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.api_url)
 
+    def cached(self, movie_name: str, year: Optional[int] = None) -> Tuple[bool, Optional[str]]:
+        """(есть ли свежий результат в кэше, ссылка)"""
+        key = (_normalize(movie_name), year)
+        entry = self._cache.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return False, None
+        self._cache.move_to_end(key)
+        return True, entry[1]
 
-async def get_wink_link(session: aiohttp.ClientSession, movie_name: str) -> Optional[str]:
-    """
-    Получить ссылку на поиск фильма на Wink
-    """
-    return await search_wink(session, movie_name)
+    async def resolve(self, movie_name: str, year: Optional[int] = None) -> Optional[str]:
+        """Ссылка на фильм на Wink или None, если его там нет (или Wink недоступен)"""
+        if not self.enabled or not movie_name:
+            return None
+        hit, url = self.cached(movie_name, year)
+        metrics.record_cache('wink', hit)
+        if hit:
+            return url
+        key = (_normalize(movie_name), year)
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        url = None
+        try:
+            url = await self._lookup(movie_name, year)
+            return url
+        except Exception as e:
+            logger.error(f"Error resolving Wink link for {movie_name}: {e}")
+            return None
+        finally:
+            del self._inflight[key]
+            future.set_result(url)
 
+    async def _lookup(self, movie_name: str, year: Optional[int]) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._session is None or self._session.closed:
+            import aiohttp
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        status = 'error'
+        async with self._semaphore:
+            start = time.perf_counter()
+            try:
+                async with self._session.get(f"{self.api_url}/search", params={'query': movie_name}) as response:
+                    status = str(response.status)
+                    if response.status != 200:
+                        # Ошибки не кэшируются: следующий показ карточки спросит Wink снова
+                        logger.error(f"Error searching Wink: {response.status}")
+                        return None
+                    data = json_codec.loads(await response.read())
+            finally:
+                metrics.observe('upstream_request_duration_seconds', time.perf_counter() - start,
+                                function='wink_search', status=status)
+        url = _match(data.get('items') or [], movie_name, year)
+        ttl = self.positive_ttl if url else self.negative_ttl
+        self._cache[(_normalize(movie_name), year)] = (time.monotonic() + ttl, url)
+        if len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return url
 
-def format_wink_info(movie_name: str, wink_url: Optional[str]) -> str:
-    """Форматировать информацию о доступности на Wink"""
-    if wink_url:
-        return f"📺 <b>Доступно на Wink:</b>\n<a href='{wink_url}'>🔍 Найти на Wink</a>"
-    return ""
+    async def close(self):
+        """Закрыть HTTP-сессию (при остановке бота)"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
 
 
+wink_resolver = WinkResolver()
@@ -0,0 +1,250 @@
+"""
+Отложенная запись избранного (FAVORITES_WRITE_BEHIND=1)
+
+Добавление и удаление фильма не пишут в базу сразу: изменение дописывается строкой
+в журнал процесса (FAVORITES_JOURNAL_DIR/<процесс>.<номер>.journal) и применяется к
+кэшу в памяти, на этом запрос завершается. Фоновый поток раз в FAVORITES_FLUSH_MS
+сворачивает накопленные изменения (для пары пользователь/фильм остается последнее) и
+записывает их в базу одной транзакцией на шард, после чего удаляет журнал. При запуске
+журнал, оставшийся после аварийной остановки, применяется к базе.
+
+FAVORITES_JOURNAL_SYNC:
+always   - запрос ждет fsync журнала; одновременные запросы разных пользователей
+           делят один fsync, но запрос все равно длится время fsync (миллисекунды
+           на обычном диске), а не микросекунды
+interval - журнал без fsync в пути запроса: запрос ждет только записи в файл
+           (десятки микросекунд), данные остаются в буфере ОС. Падение процесса
+           изменения переживают, а при отключении питания или падении ОС теряются
+           изменения за последние FAVORITES_FLUSH_MS - fsync выполняется при каждой
+           записи в базу
+"""
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+import json_codec
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: журнал не защищен от второго процесса с тем же именем
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# movie_id -> строка избранного (добавление) или None (удаление)
+Changes = Dict[int, Optional[tuple]]
+
+
+class WriteBehind:
+    """Журнал изменений избранного одного процесса и фоновая запись в хранилище"""
+
+    def __init__(self, get_backend: Callable, directory: str, name: str,
+                 flush_interval: float = 0.2, sync: str = 'always'):
+        if sync not in ('always', 'interval'):
+            raise ValueError(f"FAVORITES_JOURNAL_SYNC: ожидается always или interval, получено {sync}")
+        self.get_backend = get_backend
+        self.directory = directory
+        self.name = name
+        self.flush_interval = flush_interval
+        self.sync = sync
+        # Порядок блокировок: _sync_lock -> _lock; _flush_lock -> shard.lock
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: Dict[int, Changes] = {}
+        self._flushing: Dict[int, Changes] = {}
+        self._segment = 0
+        self._fd: Optional[int] = None
+        self._written = 0
+        self._synced = 0
+        self._lock_fd: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- Файлы журнала ---
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{self.name}.{segment:06d}.journal")
+
+    def _segments(self) -> List[Tuple[int, str]]:
+        prefix = f"{self.name}."
+        found = []
+        for filename in os.listdir(self.directory):
+            if filename.startswith(prefix) and filename.endswith('.journal'):
+                number = filename[len(prefix):-len('.journal')]
+                if number.isdigit():
+                    found.append((int(number), os.path.join(self.directory, filename)))
+        return sorted(found)
+
+    def _open_segment(self):
+        """Начать новый файл журнала (вызывать под _lock)"""
+        self._segment += 1
+        self._fd = os.open(self._path(self._segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def start(self):
+        """Захватить журнал, применить оставшиеся изменения и запустить фоновую запись"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_fd = os.open(os.path.join(self.directory, f"{self.name}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+                raise RuntimeError(f"Журнал {self.name} уже используется другим процессом")
+        segments = self._segments()
+        if segments:
+            self._segment = segments[-1][0]
+            self._recover(segments)
+        with self._lock:
+            self._open_segment()
+        self._thread = threading.Thread(target=self._run, name=f'write-behind-{self.name}', daemon=True)
+        self._thread.start()
+
+    def _recover(self, segments: List[Tuple[int, str]]):
+        """Записать в базу изменения из журнала, оставшегося после остановки"""
+        changes: Dict[int, Changes] = {}
+        records = 0
+        for _, path in segments:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json_codec.loads(line)
+                        row = tuple(record['r']) if record['r'] is not None else None
+                        changes.setdefault(record['u'], {})[record['m']] = row
+                        records += 1
+                    except (ValueError, KeyError, TypeError):
+                        # Недописанная строка в конце журнала при аварийной остановке
+                        continue
+        if changes:
+            self._write(changes)
+        for _, path in segments:
+            os.remove(path)
+        logger.info(f"Журнал избранного {self.name}: применено изменений {records}")
+
+    # --- Запись изменений ---
+
+    def log(self, user_id: int, rows: List[tuple], removals: List[int]) -> int:
+        """Дописать изменения пользователя в журнал; возвращает номер записи для wait"""
+        lines = [json_codec.dumps({'u': user_id, 'm': row[1], 'r': row}) for row in rows]
+        lines += [json_codec.dumps({'u': user_id, 'm': movie_id, 'r': None}) for movie_id in removals]
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        with self._lock:
+            os.write(self._fd, data)
+            changes = self._pending.setdefault(user_id, {})
+            for row in rows:
+                changes[row[1]] = row
+            for movie_id in removals:
+                changes[movie_id] = None
+            self._written += 1
+            return self._written
+
+    def wait(self, seq: int):
+        """Дождаться, пока запись seq станет устойчивой (для sync=always - fsync журнала)"""
+        if self.sync != 'always' or self._synced >= seq:
+            return
+        with self._sync_lock:
+            if self._synced >= seq:
+                return
+            with self._lock:
+                fd, target = self._fd, self._written
+            # Все, кто дописал журнал до этого момента, ждут этот же fsync
+            os.fsync(fd)
+            self._synced = target
+
+    def overlay(self, user_id: int) -> List[Changes]:
+        """Еще не записанные в базу изменения пользователя, от старых к новым"""
+        with self._lock:
+            return [changes[user_id] for changes in (self._flushing, self._pending) if user_id in changes]
+
+    def has_pending(self, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self._pending or user_id in self._flushing
+
+    # --- Запись в базу ---
+
+    def _write(self, changes: Dict[int, Changes]):
+        """Записать изменения в хранилище: одна транзакция на шард"""
+        backend = self.get_backend()
+        by_shard = defaultdict(lambda: ([], []))
+        for user_id, movies in changes.items():
+            rows, removals = by_shard[backend.shard(user_id).index]
+            for movie_id, row in movies.items():
+                if row is None:
+                    removals.append((user_id, movie_id))
+                else:
+                    rows.append(row)
+        for index, (rows, removals) in by_shard.items():
+            shard = backend.shards[index]
+            with shard.lock:
+                backend.apply(shard, rows, removals)
+
+    def flush(self) -> int:
+        """Записать накопленные изменения в базу; возвращает число записанных изменений"""
+        with self._flush_lock:
+            with self._sync_lock:
+                with self._lock:
+                    if not self._pending:
+                        return 0
+                    # Новый файл журнала: старые удаляются после записи в базу
+                    os.fsync(self._fd)
+                    os.close(self._fd)
+                    self._synced = self._written
+                    done = self._segment
+                    self._open_segment()
+                    self._flushing, self._pending = self._pending, {}
+                    snapshot = self._flushing
+            count = sum(len(movies) for movies in snapshot.values())
+            start = time.perf_counter()
+            try:
+                self._write(snapshot)
+            except Exception as e:
+                metrics.inc('favorites_flush_total', result='error')
+                logger.error(f"Ошибка записи журнала избранного в базу: {e}")
+                # Вернуть изменения в очередь; более новые изменения тех же фильмов важнее
+                with self._lock:
+                    for user_id, movies in snapshot.items():
+                        merged = dict(movies)
+                        merged.update(self._pending.get(user_id, {}))
+                        self._pending[user_id] = merged
+                    self._flushing = {}
+                return 0
+            with self._lock:
+                self._flushing = {}
+                pending = sum(len(movies) for movies in self._pending.values())
+            for segment, path in self._segments():
+                if segment <= done:
+                    os.remove(path)
+            metrics.inc('favorites_flush_total', result='ok')
+            metrics.observe('favorites_flush_duration_seconds', time.perf_counter() - start)
+            metrics.inc('favorites_flushed_changes_total', count)
+            metrics.set_gauge('favorites_pending_changes', pending)
+            return count
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка фоновой записи избранного: {e}")
+
+    def close(self):
+        """Остановить фоновый поток и записать оставшиеся изменения"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+        for segment, path in self._segments():
+            if not self._pending and os.path.getsize(path) == 0:
+                os.remove(path)
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None